@@ -1,13 +1,81 @@
 from flask import Flask
+from flask.signals import request_started
 from flask_login import LoginManager
+import contextvars
 import os
+import sys
 import logging
 import warnings
 from urllib3.exceptions import NotOpenSSLWarning
 warnings.filterwarnings('ignore', category=NotOpenSSLWarning)
 
+# Set while begin_request dispatches a request for the ASGI app, an async view then hands its coroutine back instead of waiting on it
+_defer_async_views = contextvars.ContextVar('defer_async_views', default=False)
+
+# What an async view returns to begin_request: the coroutine of the view, not awaited yet
+class PendingView:
+    def __init__(self, coro) -> None:
+        self.coro = coro
+
+# The async views run on the background loop of the worker (see app/event_loop.py) instead of a new loop per request,
+# so they share the headless browser and the LLM limits with the jobs.
+# Under the ASGI app (app/asgi.py) a request goes through begin_request and finish_request instead of wsgi_app: the thread that runs them
+# is given back while an async view waits, the view is awaited on the loop of the server in between.
+class AudienceBuilderApp(Flask):
+    def async_to_sync(self, func):
+        from app.event_loop import run_sync
+
+        def wrapper(*args, **kwargs):
+            if _defer_async_views.get():
+                return PendingView(func(*args, **kwargs))
+            return run_sync(func(*args, **kwargs))
+        return wrapper
+
+    # This method does the first half of wsgi_app and full_dispatch_request: it pushes the request context and runs the before_request
+    # functions and the view. It returns the context and what the view returned, a PendingView for an async view, or the exception it raised.
+    def begin_request(self, environ: dict):
+        ctx = self.request_context(environ)
+        ctx.push()
+        self._got_first_request = True
+        try:
+            request_started.send(self, _async_wrapper=self.ensure_sync)
+            rv = self.preprocess_request()
+            if rv is None:
+                token = _defer_async_views.set(True)
+                try:
+                    rv = self.dispatch_request()
+                finally:
+                    _defer_async_views.reset(token)
+            return ctx, rv
+        except Exception as e:
+            return ctx, e
+
+    # This method does the second half: it handles the exception of the view or finalizes what it returned (the awaited result of a PendingView),
+    # pops the request context and returns the WSGI response iterable, like wsgi_app.
+    def finish_request(self, ctx, rv, start_response):
+        error = None
+        try:
+            try:
+                try:
+                    if isinstance(rv, Exception):
+                        raise rv
+                except Exception as e:
+                    rv = self.handle_user_exception(e)
+                response = self.finalize_request(rv)
+            except Exception as e:
+                error = e
+                response = self.handle_exception(e)
+            except:  # noqa: B001
+                error = sys.exc_info()[1]
+                raise
+            return response(ctx.request.environ, start_response)
+        finally:
+            if error is not None and self.should_ignore_error(error):
+                error = None
+            ctx.pop(error)
+
 def create_app():
-    app = Flask(__name__)
+    app = AudienceBuilderApp(__name__)
 
     from app.routes.base_routes import bp as base_bp
     from app.routes.auth_routes import auth_bp as auth_bp
@@ -17,15 +85,15 @@ def create_app():
     login_manager.init_app(app)
     # Tell it which page to show when someone needs to log in
     login_manager.login_view = 'auth.login'
-    # This function tells Flask-Login how to find a specific user
+    # This function tells Flask-Login how to find a specific user, a warm request gets it from the user cache without touching the database
     @login_manager.user_loader
     def load_user(user_id):
-        from app.database.models import User
-        from app.database.database import SessionLocal
-        db = SessionLocal()
-        user = db.query(User).get(int(user_id))
-        db.close()
-        return user
+        from app.api.user_operations import load_session_user
+        return load_session_user(int(user_id))
+
+    # The session of a request is opened on first use (see get_request_db) and closed here
+    from app.database.database import close_request_db
+    app.teardown_appcontext(close_request_db)
 
 
     app.register_blueprint(base_bp)
@@ -1,25 +1,143 @@
-from typing import List, Optional
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
+import base64
+import json
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy.orm import Session, load_only
+from sqlalchemy import desc, or_, tuple_
 from ..database.models import OnlineArticles
-from datetime import datetime
+from ..url_utils import normalize_url
+from datetime import datetime, timezone
+
+def encode_article_cursor(article: OnlineArticles) -> str:
+    """
+    Encode the position of an article in the newest-first listing, the next page starts right after it.
+    """
+    payload = json.dumps([article.created_at.isoformat(), article.id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_article_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Decode a cursor made by encode_article_cursor, raises ValueError if it isn't one.
+    """
+    try:
+        created_at, article_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return datetime.fromisoformat(created_at), int(article_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
 
 def get_user_articles(
     db: Session, 
     user_id: int,
-    limit: int = 50  # Adding a limit for safety
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    source_blog: Optional[str] = None,
+    profile_fit: Optional[bool] = None
+) -> Tuple[List[OnlineArticles], Optional[str]]:
+    """
+    Get one page of the articles of a user, newest first, optionally only those of one blog or with one profile fit.
+    The page starts after cursor (keyset pagination on created_at, id, served by ix_online_articles_user_id_created_at),
+    so a deep page costs the same as the first one. Only the columns the listing shows are loaded.
+    Returns the articles and the cursor of the next page, None on the last page.
+    """
+    try:
+        query = db.query(OnlineArticles)\
+            .options(load_only(
+                OnlineArticles.id, OnlineArticles.url, OnlineArticles.title, OnlineArticles.source_blog,
+                OnlineArticles.profile_fit, OnlineArticles.created_at, OnlineArticles.updated_at
+            ))\
+            .filter(OnlineArticles.user_id == user_id)
+        if source_blog:
+            query = query.filter(OnlineArticles.source_blog == source_blog)
+        if profile_fit is not None:
+            query = query.filter(OnlineArticles.profile_fit == profile_fit)
+        if cursor:
+            query = query.filter(tuple_(OnlineArticles.created_at, OnlineArticles.id) < decode_article_cursor(cursor))
+        # One row more than the page tells whether there is a next page
+        articles = query\
+            .order_by(desc(OnlineArticles.created_at), desc(OnlineArticles.id))\
+            .limit(limit + 1)\
+            .all()
+        next_cursor = encode_article_cursor(articles[limit - 1]) if len(articles) > limit else None
+        return articles[:limit], next_cursor
+    except ValueError:
+        raise
+    except Exception as e:
+        print(f"Database error in get_user_articles: {str(e)}")  # We'll replace with proper logging later
+        return [], None
+
+def get_llm_labelled_articles(
+    db: Session,
+    user_id: int,
+    limit: int = 1000
 ) -> List[OnlineArticles]:
     """
-    Get articles for a user profile with basic pagination.
-    Returns the articles in chronological order (newest first).
+    Get the articles of a user whose profile fit was decided by the LLM,
+    these are the labels the relevance prefilter is evaluated against.
     """
     try:
         articles = db.query(OnlineArticles)\
             .filter(OnlineArticles.user_id == user_id)\
+            .filter(OnlineArticles.profile_fit.isnot(None))\
+            .filter((OnlineArticles.fit_source == None) | (OnlineArticles.fit_source == 'llm'))\
             .order_by(desc(OnlineArticles.created_at))\
             .limit(limit)\
             .all()
         return articles
     except Exception as e:
-        print(f"Database error in get_user_articles: {str(e)}")  # We'll replace with proper logging later
-        return []
\ No newline at end of file
+        print(f"Database error in get_llm_labelled_articles: {str(e)}")
+        return []
+
+def get_known_articles(
+    db: Session,
+    user_id: int,
+    urls: List[str]
+) -> Dict[str, OnlineArticles]:
+    """
+    Get the articles of a user that were already scored on an earlier scan, in one query.
+    Returns them keyed on their normalised url. Articles whose comparison failed are left out so that they are tried again.
+    """
+    normalized_urls = list({normalize_url(url) for url in urls})
+    if not normalized_urls:
+        return {}
+    try:
+        articles = db.query(OnlineArticles)\
+            .filter(OnlineArticles.user_id == user_id)\
+            .filter(OnlineArticles.normalized_url.in_(normalized_urls))\
+            .filter(or_(OnlineArticles.fit_source == None, OnlineArticles.fit_source != 'error'))\
+            .all()
+        return {article.normalized_url: article for article in articles}
+    except Exception as e:
+        print(f"Database error in get_known_articles: {str(e)}")
+        return {}
+
+def upsert_articles(
+    db: Session,
+    rows: List[Dict]
+) -> None:
+    """
+    Insert or update many articles with one statement, a row is identified by (user_id, normalised url).
+    Every row needs user_id and url, the other columns are optional. The caller commits.
+    """
+    now = datetime.now(timezone.utc)
+    values = {}
+    for row in rows:
+        normalized_url = normalize_url(row["url"])
+        # The same article can't be in one upsert twice, the last one wins
+        values[(row["user_id"], normalized_url)] = {**row, "normalized_url": normalized_url, "created_at": now, "updated_at": now}
+    if not values:
+        return
+
+    dialect = db.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"upsert_articles doesn't support {dialect}")
+
+    statement = insert(OnlineArticles).values(list(values.values()))
+    updated_columns = {key for row in values.values() for key in row} - {"user_id", "normalized_url", "created_at"}
+    statement = statement.on_conflict_do_update(
+        index_elements=['user_id', 'normalized_url'],
+        set_={column: statement.excluded[column] for column in updated_columns}
+    )
+    db.execute(statement)
@@ -0,0 +1,53 @@
+from typing import Dict, Optional, Tuple
+from ..database.database import SessionLocal
+from ..database.models import Profile, ProfileEmbedding
+
+# This function returns the id and the interests description of the profile of a user.
+def get_profile_text(user_id: int) -> Tuple[int, str]:
+    db = SessionLocal()
+    try:
+        profile = db.query(Profile).filter(Profile.user_id == user_id).first()
+        if not profile:
+            raise ValueError(f"No profile found for user_id: {user_id}")
+        return profile.id, profile.interests_description
+    finally:
+        db.close()
+
+# This function returns the stored embedding of a profile for one embedding backend, None if there isn't one.
+def get_profile_embedding(profile_id: int, embedder: str) -> Optional[Dict]:
+    db = SessionLocal()
+    try:
+        embedding = db.query(ProfileEmbedding).filter(
+            ProfileEmbedding.profile_id == profile_id,
+            ProfileEmbedding.embedder == embedder
+        ).first()
+        if not embedding:
+            return None
+        return {
+            "vector": embedding.vector,
+            "dimensions": embedding.dimensions,
+            "text_hash": embedding.text_hash
+        }
+    finally:
+        db.close()
+
+# This function stores (or replaces) the embedding of a profile for one embedding backend.
+def save_profile_embedding(profile_id: int, embedder: str, vector: bytes, dimensions: int, text_hash: str) -> None:
+    db = SessionLocal()
+    try:
+        embedding = db.query(ProfileEmbedding).filter(
+            ProfileEmbedding.profile_id == profile_id,
+            ProfileEmbedding.embedder == embedder
+        ).first()
+        if embedding is None:
+            embedding = ProfileEmbedding(profile_id=profile_id, embedder=embedder)
+            db.add(embedding)
+        embedding.vector = vector
+        embedding.dimensions = dimensions
+        embedding.text_hash = text_hash
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
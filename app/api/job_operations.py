@@ -0,0 +1,240 @@
+from typing import Dict, List, Optional
+from sqlalchemy import func
+from ..database.database import SessionLocal
+from ..database.models import Job, JobTweet
+from datetime import datetime, timezone, timedelta
+import json
+
+def _now():
+    return datetime.now(timezone.utc)
+
+def job_to_dict(job: Job) -> Dict:
+    return {
+        "id": job.id,
+        "user_id": job.user_id,
+        "kind": job.kind,
+        "url": job.url,
+        "status": job.status,
+        "current_step": job.current_step,
+        "steps": json.loads(job.steps) if job.steps else [],
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+        "attempts": job.attempts,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None
+    }
+
+# This function stores a new job in the queue and returns its id.
+def create_job(user_id: int, kind: str, url: str) -> int:
+    db = SessionLocal()
+    try:
+        job = Job(user_id=user_id, kind=kind, url=url, status='queued', attempts=0)
+        db.add(job)
+        db.commit()
+        return job.id
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+# This function returns a job of a user as a dictionary, None if the job doesn't exist or belongs to someone else.
+def get_job(job_id: int, user_id: int) -> Optional[Dict]:
+    db = SessionLocal()
+    try:
+        job = db.query(Job).filter(Job.id == job_id, Job.user_id == user_id).first()
+        if not job:
+            return None
+        result = job_to_dict(job)
+        result["partial_result"] = _job_tweets(db, job_id)
+        return result
+    finally:
+        db.close()
+
+# This function returns the tweets a job has streamed, from the given position on.
+def _job_tweets(db, job_id: int, start: int = 0) -> List[str]:
+    rows = db.query(JobTweet.text).filter(JobTweet.job_id == job_id, JobTweet.position >= start).order_by(JobTweet.position).all()
+    return [row.text for row in rows]
+
+# This function returns what the progress page of a job needs to catch up: the status and the steps of the job and the tweets after the ones
+# the browser already has. It reads only those columns, the result and the other tweets aren't loaded on every poll.
+# Returns None if the job doesn't exist or belongs to someone else.
+def get_job_progress(job_id: int, user_id: int, sent_tweets: int = 0) -> Optional[Dict]:
+    db = SessionLocal()
+    try:
+        job = db.query(Job.status, Job.current_step, Job.steps, Job.error).filter(Job.id == job_id, Job.user_id == user_id).first()
+        if not job:
+            return None
+        return {
+            "status": job.status,
+            "current_step": job.current_step,
+            "steps": json.loads(job.steps) if job.steps else [],
+            "error": job.error,
+            "tweets": _job_tweets(db, job_id, sent_tweets)
+        }
+    finally:
+        db.close()
+
+# This function returns the most recent jobs of a user.
+def get_user_jobs(user_id: int, limit: int = 20) -> List[Dict]:
+    db = SessionLocal()
+    try:
+        jobs = db.query(Job).filter(Job.user_id == user_id).order_by(Job.created_at.desc()).limit(limit).all()
+        return [job_to_dict(job) for job in jobs]
+    finally:
+        db.close()
+
+# This function takes the oldest queued job and marks it as running for this worker.
+# The update only succeeds if the job is still queued, so two workers can never run the same job.
+def claim_next_job(worker_id: str) -> Optional[Dict]:
+    db = SessionLocal()
+    try:
+        job = db.query(Job).filter(Job.status == 'queued').order_by(Job.created_at, Job.id).first()
+        if not job:
+            return None
+        now = _now()
+        claimed = db.query(Job).filter(Job.id == job.id, Job.status == 'queued').update({
+            Job.status: 'running',
+            Job.worker_id: worker_id,
+            Job.started_at: now,
+            Job.heartbeat_at: now,
+            Job.attempts: Job.attempts + 1
+        }, synchronize_session=False)
+        db.commit()
+        if not claimed:
+            return None
+        db.refresh(job)
+        return job_to_dict(job)
+    except Exception as e:
+        db.rollback()
+        print(f"Error claiming a job: {str(e)}")
+        return None
+    finally:
+        db.close()
+
+# This function records the progress of a running job. An event with a "duration" is a finished step, anything else is the step that just started.
+def record_job_progress(job_id: int, event: Dict) -> None:
+    db = SessionLocal()
+    try:
+        job = db.query(Job).filter(Job.id == job_id).first()
+        if not job:
+            return
+        if "duration" in event:
+            steps = json.loads(job.steps) if job.steps else []
+            steps.append(event)
+            job.steps = json.dumps(steps)
+            job.current_step = None
+        else:
+            job.current_step = event.get("name")
+        job.heartbeat_at = _now()
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Error recording the progress of job {job_id}: {str(e)}")
+    finally:
+        db.close()
+
+# This function adds a tweet that was just streamed to the partial result of a running job, as a row of its own
+# so that the tweets that were already stored aren't read and written again.
+def record_job_tweet(job_id: int, tweet: str) -> None:
+    db = SessionLocal()
+    try:
+        updated = db.query(Job).filter(Job.id == job_id).update({Job.heartbeat_at: _now()}, synchronize_session=False)
+        if not updated:
+            return
+        position = db.query(func.count(JobTweet.id)).filter(JobTweet.job_id == job_id).scalar()
+        db.add(JobTweet(job_id=job_id, position=position, text=tweet))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Error recording a tweet of job {job_id}: {str(e)}")
+    finally:
+        db.close()
+
+# This function stores the outcome of a job.
+def finish_job(job_id: int, status: str, result=None, error: str = None) -> None:
+    db = SessionLocal()
+    try:
+        db.query(Job).filter(Job.id == job_id).update({
+            Job.status: status,
+            Job.result: json.dumps(result) if result is not None else None,
+            Job.error: error,
+            Job.current_step: None,
+            Job.finished_at: _now()
+        }, synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Error finishing job {job_id}: {str(e)}")
+    finally:
+        db.close()
+
+# This function tells the other workers that the jobs of this worker are still alive.
+def heartbeat_jobs(job_ids: List[int]) -> None:
+    if not job_ids:
+        return
+    db = SessionLocal()
+    try:
+        db.query(Job).filter(Job.id.in_(job_ids), Job.status == 'running').update(
+            {Job.heartbeat_at: _now()}, synchronize_session=False
+        )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Error updating the job heartbeats: {str(e)}")
+    finally:
+        db.close()
+
+# This function puts running jobs back in the queue: the ones of a worker that is shutting down (worker_id),
+# or the ones whose worker stopped sending heartbeats (stale_after seconds). Jobs that were tried max_attempts times fail instead.
+def requeue_jobs(worker_id: str = None, stale_after: int = None, max_attempts: int = 3) -> int:
+    db = SessionLocal()
+    try:
+        query = db.query(Job).filter(Job.status == 'running')
+        if worker_id is not None:
+            query = query.filter(Job.worker_id == worker_id)
+        if stale_after is not None:
+            query = query.filter(Job.heartbeat_at < _now() - timedelta(seconds=stale_after))
+        jobs = query.all()
+        for job in jobs:
+            if job.attempts >= max_attempts:
+                job.status = 'error'
+                job.error = f"Gave up after {job.attempts} attempts"
+                job.finished_at = _now()
+            else:
+                job.status = 'queued'
+                job.worker_id = None
+                job.current_step = None
+                job.steps = None
+        requeued = [job.id for job in jobs if job.status == 'queued']
+        if requeued:
+            db.query(JobTweet).filter(JobTweet.job_id.in_(requeued)).delete(synchronize_session=False)
+        db.commit()
+        return len(jobs)
+    except Exception as e:
+        db.rollback()
+        print(f"Error requeueing jobs: {str(e)}")
+        return 0
+    finally:
+        db.close()
+
+# This function returns how many jobs there are of every given status and how long (in seconds) the oldest queued job has been waiting.
+def count_jobs_by_status(statuses=('queued', 'running')):
+    db = SessionLocal()
+    try:
+        counts = {status: 0 for status in statuses}
+        counts.update(dict(
+            db.query(Job.status, func.count(Job.id)).filter(Job.status.in_(statuses)).group_by(Job.status).all()
+        ))
+        oldest = db.query(func.min(Job.created_at)).filter(Job.status == 'queued').scalar()
+        if oldest is None:
+            return counts, 0.0
+        if oldest.tzinfo is None:
+            oldest = oldest.replace(tzinfo=timezone.utc)
+        return counts, max(0.0, (_now() - oldest).total_seconds())
+    except Exception as e:
+        print(f"Error counting the jobs: {str(e)}")
+        return {}, 0.0
+    finally:
+        db.close()
@@ -1,6 +1,7 @@
 from typing import List, Optional
 from ..database.database import SessionLocal
 from ..database.models import Prompt, User
+from .prompt_operations import get_prompt_cache
 from datetime import datetime
 
 def set_default_prompt(user_id:int) -> Optional[str]:
@@ -86,6 +87,8 @@ These are the secondary articles.
         db.add(default_prompt_2)
         db.add(default_prompt_1)
         db.commit()
+        get_prompt_cache().store(default_prompt_2)
+        get_prompt_cache().store(default_prompt_1)
         return print('Successfully added the default prompt to the user')
     except Exception as e:
         db.rollback()
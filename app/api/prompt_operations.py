@@ -1,25 +1,152 @@
+import os
+import threading
+import time
 from typing import List, Optional
-from ..database.database import SessionLocal
+from langchain.prompts import PromptTemplate
+from sqlalchemy import select
+from ..database.database import SessionLocal, AsyncSessionLocal
 from ..database.models import Prompt
 from datetime import datetime
 
+# This class keeps the prompts of the worker in memory, keyed on (user_id, type), together with their compiled PromptTemplates.
+# Every entry remembers the version of its row. Once an entry is older than PROMPT_CACHE_CHECK_INTERVAL seconds, the next read
+# only asks the database for the version of the row, and the template is read again when another worker changed it.
+class PromptCache:
+    def __init__(self, check_interval: float = None) -> None:
+        self.check_interval = check_interval if check_interval is not None else float(os.environ.get('PROMPT_CACHE_CHECK_INTERVAL', 5))
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self, db, prompt_type: int, user_id: int):
+        prompt = db.query(Prompt).filter(Prompt.type == prompt_type, Prompt.user_id == user_id).first()
+        if prompt is None:
+            return None
+        print(f"Fetched the template from the database and the template is: {prompt.template[:50]}")
+        return self.store(prompt)
+
+    # This method returns the cached entry of a prompt and whether it was checked recently enough to be used without asking the database.
+    def _cached(self, prompt_type: int, user_id: int):
+        with self._lock:
+            entry = self._entries.get((user_id, prompt_type))
+        return entry, entry is not None and time.monotonic() - entry["checked"] < self.check_interval
+
+    # This method tells whether a cached entry is still the version of the row in the database.
+    def _still_current(self, entry, version) -> bool:
+        if entry is None or version != entry["version"]:
+            self.misses += 1
+            return False
+        entry["checked"] = time.monotonic()
+        self.hits += 1
+        return True
+
+    # This method returns the entry of a prompt ({"template", "version", ...}), or None if the user has no such prompt.
+    def get(self, prompt_type: int, user_id: int):
+        entry, fresh = self._cached(prompt_type, user_id)
+        if fresh:
+            self.hits += 1
+            return entry
+
+        db = SessionLocal()
+        try:
+            if entry is not None:
+                version = db.query(Prompt.version).filter(Prompt.type == prompt_type, Prompt.user_id == user_id).scalar()
+                if self._still_current(entry, version):
+                    return entry
+            else:
+                self.misses += 1
+            return self._load(db, prompt_type, user_id)
+        finally:
+            db.close()
+
+    # This method is get for the async paths, it asks the database through the async engine.
+    async def aget(self, prompt_type: int, user_id: int):
+        entry, fresh = self._cached(prompt_type, user_id)
+        if fresh:
+            self.hits += 1
+            return entry
+
+        async with AsyncSessionLocal() as db:
+            if entry is not None:
+                version = await db.scalar(select(Prompt.version).where(Prompt.type == prompt_type, Prompt.user_id == user_id))
+                if self._still_current(entry, version):
+                    return entry
+            else:
+                self.misses += 1
+            prompt = await db.scalar(select(Prompt).where(Prompt.type == prompt_type, Prompt.user_id == user_id).limit(1))
+        if prompt is None:
+            return None
+        print(f"Fetched the template from the database and the template is: {prompt.template[:50]}")
+        return self.store(prompt)
+
+    # This method puts a prompt row in the cache, the routes call it right after they commit a change so this worker doesn't read it again.
+    def store(self, prompt: Prompt):
+        entry = {
+            "template": prompt.template,
+            "version": prompt.version,
+            "checked": time.monotonic(),
+            "compiled": {}
+        }
+        with self._lock:
+            self._entries[(prompt.user_id, prompt.type)] = entry
+        return entry
+
+    def invalidate(self, user_id: int, prompt_type: int = None) -> None:
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == user_id and prompt_type in (None, key[1])]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0, "prompts": len(self._entries)}
+
+_prompt_cache = None
+
+# This function returns the prompt cache of the current worker.
+def get_prompt_cache() -> PromptCache:
+    global _prompt_cache
+    if _prompt_cache is None:
+        _prompt_cache = PromptCache()
+    return _prompt_cache
+
 def get_prompt(prompt_type: int, user_id: int) -> Optional[str]:
-    db = SessionLocal()
     try:
-        prompt = db.query(Prompt).filter(
-            Prompt.type == prompt_type, 
-            Prompt.user_id == user_id
-        ).first()
-        
-        if prompt:
-            print(f"Fetched the template from the database and the template is: {prompt.template[:50]}")
-            return prompt.template
+        entry = get_prompt_cache().get(prompt_type, user_id)
+        return entry["template"] if entry else None
+    except Exception as e:
+        print(f"Error fetching prompt from database {str(e)}")
+        return None
+
+# This function returns the compiled PromptTemplate of a prompt, it is only built again when the prompt changes.
+def get_prompt_template(prompt_type: int, user_id: int, input_variables: List[str]) -> Optional[PromptTemplate]:
+    try:
+        entry = get_prompt_cache().get(prompt_type, user_id)
+    except Exception as e:
+        print(f"Error fetching prompt from database {str(e)}")
         return None
+    return _compiled_template(entry, input_variables)
+
+# This function is get_prompt_template for the async paths (the pipeline).
+async def aget_prompt_template(prompt_type: int, user_id: int, input_variables: List[str]) -> Optional[PromptTemplate]:
+    try:
+        entry = await get_prompt_cache().aget(prompt_type, user_id)
     except Exception as e:
         print(f"Error fetching prompt from database {str(e)}")
         return None
-    finally:
-        db.close()
+    return _compiled_template(entry, input_variables)
+
+def _compiled_template(entry, input_variables: List[str]) -> Optional[PromptTemplate]:
+    if entry is None:
+        return None
+    variables = tuple(input_variables)
+    if variables not in entry["compiled"]:
+        entry["compiled"][variables] = PromptTemplate(template=entry["template"], input_variables=list(variables))
+    return entry["compiled"][variables]
+
+# This function bumps the version of a prompt that was edited, call it before committing so the other workers notice the change.
+def bump_prompt_version(prompt: Prompt) -> None:
+    prompt.version = (prompt.version or 0) + 1
 
 if __name__ == "__main__":
     # Test get_prompt with user_id 3
@@ -0,0 +1,82 @@
+from datetime import date
+from typing import Dict, List, Optional
+from sqlalchemy import func
+from ..database.database import SessionLocal
+from ..database.models import LLMUsage, User
+
+COUNTERS = ('calls', 'cached_calls', 'prompt_tokens', 'completion_tokens', 'cost')
+
+# This function adds usage rows (user_id, day, call_site, model and the counters) to the daily rollups with one upsert.
+def add_usage(rows: List[Dict]) -> None:
+    if not rows:
+        return
+    db = SessionLocal()
+    try:
+        dialect = db.get_bind().dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            raise NotImplementedError(f"add_usage doesn't support {dialect}")
+
+        statement = insert(LLMUsage).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=['user_id', 'day', 'call_site', 'model'],
+            set_={column: getattr(LLMUsage, column) + statement.excluded[column] for column in COUNTERS}
+        )
+        db.execute(statement)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+# This function returns what a user spent (USD) on LLM calls since a day, included.
+def get_spend_since(user_id: int, since: date) -> float:
+    db = SessionLocal()
+    try:
+        spend = db.query(func.sum(LLMUsage.cost)).filter(LLMUsage.user_id == user_id, LLMUsage.day >= since).scalar()
+        return float(spend or 0.0)
+    finally:
+        db.close()
+
+# This function returns the usage of a user since a day, added up by call site (most expensive first) and by day (newest first).
+def get_usage_summary(user_id: int, since: date) -> Dict:
+    db = SessionLocal()
+    try:
+        sums = [func.sum(getattr(LLMUsage, column)).label(column) for column in COUNTERS]
+        by_call_site = db.query(LLMUsage.call_site, LLMUsage.model, *sums).filter(
+            LLMUsage.user_id == user_id, LLMUsage.day >= since
+        ).group_by(LLMUsage.call_site, LLMUsage.model).all()
+        by_day = db.query(LLMUsage.day, *sums).filter(
+            LLMUsage.user_id == user_id, LLMUsage.day >= since
+        ).group_by(LLMUsage.day).order_by(LLMUsage.day.desc()).all()
+        return {
+            "by_call_site": sorted([row._asdict() for row in by_call_site], key=lambda row: -row["cost"]),
+            "by_day": [row._asdict() for row in by_day],
+            "total": {column: sum(row._asdict()[column] for row in by_day) for column in COUNTERS}
+        }
+    finally:
+        db.close()
+
+# This function returns the monthly budget (USD) of a user, None when there is no limit.
+def get_monthly_budget(user_id: int) -> Optional[float]:
+    db = SessionLocal()
+    try:
+        return db.query(User.monthly_budget).filter(User.id == user_id).scalar()
+    finally:
+        db.close()
+
+# This function sets (or with None removes) the monthly budget of a user.
+def set_monthly_budget(user_id: int, budget: Optional[float]) -> None:
+    db = SessionLocal()
+    try:
+        db.query(User).filter(User.id == user_id).update({User.monthly_budget: budget})
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
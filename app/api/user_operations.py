@@ -0,0 +1,85 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from flask_login import UserMixin
+from ..database.database import get_request_db
+from ..database.models import User
+
+# This class is the logged in user of a request. It only has the fields the request path needs, so it can be kept
+# between requests instead of loading the User row (and opening a session) on every page view.
+# The API key isn't one of them, the routes that call the LLM load it from the database.
+class SessionUser(UserMixin):
+    def __init__(self, id: int, email: str, is_onboarded: bool, active: bool = True) -> None:
+        self.id = id
+        self.email = email
+        self.is_onboarded = is_onboarded
+        self.active = active
+
+    # Flask-Login only treats an active user as authenticated, like it did with the User row
+    @property
+    def is_active(self) -> bool:
+        return self.active
+
+# This class keeps the SessionUsers of the worker for USER_CACHE_TTL seconds. The routes that change a user invalidate it,
+# the other workers see the change once the TTL runs out. Users that aren't onboarded yet aren't cached,
+# so a user that just finished the onboarding in another worker is never sent back to it.
+class UserCache:
+    def __init__(self, ttl: float = None, max_users: int = None) -> None:
+        self.ttl = ttl if ttl is not None else float(os.environ.get('USER_CACHE_TTL', 30))
+        self.max_users = max_users or int(os.environ.get('USER_CACHE_MAX_USERS', 1000))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[SessionUser]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if time.monotonic() > entry[0]:
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def set(self, user: SessionUser) -> None:
+        if self.ttl <= 0 or not user.is_onboarded:
+            return
+        with self._lock:
+            self._entries[user.id] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+_user_cache = None
+
+# This function returns the user cache of the current worker.
+def get_user_cache() -> UserCache:
+    global _user_cache
+    if _user_cache is None:
+        _user_cache = UserCache()
+    return _user_cache
+
+# This function loads the logged in user for Flask-Login, from the cache or with one query on the session of the request.
+def load_session_user(user_id: int) -> Optional[SessionUser]:
+    cache = get_user_cache()
+    user = cache.get(user_id)
+    if user is not None:
+        return user
+    row = get_request_db().query(
+        User.id, User.email, User.is_onboarded, User.is_active
+    ).filter(User.id == user_id).first()
+    if row is None:
+        return None
+    user = SessionUser(row.id, row.email, bool(row.is_onboarded), bool(row.is_active))
+    cache.set(user)
+    return user
+
+# This function drops the cached user, call it after changing the user or their profile.
+def invalidate_session_user(user_id: int) -> None:
+    get_user_cache().invalidate(user_id)
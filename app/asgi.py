@@ -0,0 +1,197 @@
+import asyncio
+import contextvars
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+from urllib.parse import parse_qs
+from app import create_app, PendingView
+from app.event_loop import adopt_background_loop
+
+# The ASGI app of the async serving mode (gunicorn -c gunicorn_async.conf.py, with uvicorn workers).
+# The event loop of the server is the one loop of the worker: the job executors, the shared browser, the LLM scheduler
+# and the async views all run on it, so a worker can wait on many slow crawls and LLM calls at the same time.
+# The job event streams are served here without Flask, every other request goes to the Flask app (see serve_flask):
+# its synchronous parts run on a pool of ASGI_WSGI_THREADS threads, its async views on the loop.
+
+flask_app = create_app()
+_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('ASGI_WSGI_THREADS', 32)), thread_name_prefix='wsgi')
+
+JOB_EVENTS_PATH = re.compile(r'^/jobs/(\d+)/events$')
+
+# This function turns an ASGI scope and a request body into a WSGI environ.
+def build_environ(scope: dict, body) -> dict:
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope["query_string"].decode("ascii"),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "SERVER_NAME": scope["server"][0] if scope.get("server") else "localhost",
+        "SERVER_PORT": str(scope["server"][1]) if scope.get("server") else "80",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": BytesIO(),
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin1")
+        key = {"content-length": "CONTENT_LENGTH", "content-type": "CONTENT_TYPE"}.get(name, "HTTP_" + name.upper().replace("-", "_"))
+        value = value.decode("latin1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+# This function serves one request with the Flask app and sends its response as it is produced, streamed responses included.
+# The synchronous parts (before_request, the sync views, rendering and sending the response) run on the pool of ASGI_WSGI_THREADS threads,
+# an async view is awaited on the loop in between, so a request that waits on a crawl or an LLM call doesn't hold a thread.
+# All of it runs in one context, the request context of Flask lives in context variables.
+async def serve_flask(scope: dict, receive, send) -> None:
+    loop = asyncio.get_running_loop()
+    with SpooledTemporaryFile(max_size=65536) as body:
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body.write(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        body.seek(0)
+        context = contextvars.copy_context()
+
+        ctx, rv = await loop.run_in_executor(_executor, context.run, flask_app.begin_request, build_environ(scope, body))
+        if isinstance(rv, PendingView):
+            try:
+                rv = await loop.create_task(rv.coro, context=context)
+            except asyncio.CancelledError:
+                context.run(ctx.pop)
+                raise
+            except Exception as e:
+                rv = e
+
+        def send_from_thread(message: dict) -> None:
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def respond() -> None:
+            response = {}
+
+            def start_response(status, headers, exc_info=None):
+                response["start"] = {
+                    "type": "http.response.start",
+                    "status": int(status.split(" ", 1)[0]),
+                    "headers": [(name.lower().encode("latin1"), value.encode("latin1")) for name, value in headers]
+                }
+
+            chunks = flask_app.finish_request(ctx, rv, start_response)
+            try:
+                for chunk in chunks:
+                    if "sent" not in response:
+                        send_from_thread(response["start"])
+                        response["sent"] = True
+                    if chunk:
+                        send_from_thread({"type": "http.response.body", "body": chunk, "more_body": True})
+            finally:
+                if hasattr(chunks, "close"):
+                    chunks.close()
+            if "sent" not in response:
+                send_from_thread(response["start"])
+            send_from_thread({"type": "http.response.body", "body": b"", "more_body": False})
+
+        await loop.run_in_executor(_executor, context.run, respond)
+
+async def send_response(send, status: int, body: bytes = b"", content_type: bytes = b"text/plain; charset=utf-8") -> None:
+    await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", content_type)]})
+    await send({"type": "http.response.body", "body": body})
+
+# This function returns the id of the user of the session cookie of a request, None if nobody is logged in.
+# It goes through Flask-Login, so the session and the remember-me cookie work exactly like in the Flask routes.
+def session_user_id(scope: dict):
+    from flask_login import current_user
+    with flask_app.request_context(build_environ(scope, BytesIO())):
+        return current_user.id if current_user.is_authenticated else None
+
+# This function streams the progress of a job (like the Flask route job_events) without holding a thread while it waits.
+async def serve_job_events(scope: dict, receive, send, job_id: int) -> None:
+    from app.api.job_operations import get_job_progress
+    from app.job_events import JobEventStream, parse_event_position
+
+    user_id = await asyncio.to_thread(session_user_id, scope)
+    if user_id is None:
+        await send_response(send, 401, b"Login required")
+        return
+    if await asyncio.to_thread(get_job_progress, job_id, user_id) is None:
+        await send_response(send, 404, b"Not found")
+        return
+    headers = dict(scope.get("headers", []))
+    query = parse_qs(scope["query_string"].decode("ascii"))
+    sent_steps, sent_tweets = parse_event_position(
+        headers.get(b"last-event-id", b"").decode("latin1"),
+        _query_int(query, "steps"),
+        _query_int(query, "tweets")
+    )
+
+    await send({"type": "http.response.start", "status": 200, "headers": [
+        (b"content-type", b"text/event-stream; charset=utf-8"),
+        (b"cache-control", b"no-cache"),
+        (b"x-accel-buffering", b"no")
+    ]})
+    # The stream stops as soon as the browser goes away
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        async for event in JobEventStream(job_id, user_id, sent_steps, sent_tweets):
+            if disconnected.done():
+                return
+            await send({"type": "http.response.body", "body": event.encode(), "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+    finally:
+        disconnected.cancel()
+
+def _query_int(query: dict, name: str) -> int:
+    value = query.get(name, ["0"])[0]
+    return int(value) if value.isdigit() else 0
+
+async def _wait_for_disconnect(receive) -> None:
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+# The worker adopts the loop of the server and starts its job executors when it starts,
+# and puts its jobs back in the queue and closes the browser when it stops (in threads, they wait on the loop).
+async def lifespan(receive, send) -> None:
+    from app.jobs import get_job_runner, shutdown_job_runner
+    from app.browser_pool import shutdown_crawler_pool
+    from app.trace_store import get_trace_store
+    from app.usage import get_usage_recorder
+    from app.database.database import dispose_async_engine
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            adopt_background_loop(asyncio.get_running_loop())
+            get_job_runner().start()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await asyncio.to_thread(shutdown_job_runner)
+            await asyncio.to_thread(shutdown_crawler_pool)
+            await asyncio.to_thread(get_trace_store().flush)
+            await asyncio.to_thread(get_usage_recorder().flush)
+            await dispose_async_engine()
+            _executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def application(scope: dict, receive, send) -> None:
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    if scope["method"] == "GET":
+        match = JOB_EVENTS_PATH.match(scope["path"])
+        if match:
+            await serve_job_events(scope, receive, send, int(match.group(1)))
+            return
+    await serve_flask(scope, receive, send)
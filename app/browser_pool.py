@@ -0,0 +1,138 @@
+import asyncio
+import atexit
+import json
+import logging
+import os
+import uuid
+from crawl4ai import AsyncWebCrawler
+from crawl4ai.chunking_strategy import RegexChunking
+from app.event_loop import run_in_background, run_sync, in_background_loop
+
+# This class keeps one headless browser alive per worker and shares it between all the crawl4ai calls.
+# Every crawl gets its own browser context (through a one-off crawl4ai session) which is closed right after,
+# the number of crawls running at the same time is capped, and the browser is replaced after a number of uses
+# or when the machine runs low on memory.
+class CrawlerPool:
+    def __init__(self, max_concurrency: int = None, max_uses: int = None, min_available_mb: int = None) -> None:
+        self.max_concurrency = max_concurrency or int(os.environ.get('CRAWLER_MAX_CONCURRENCY', 4))
+        self.max_uses = max_uses or int(os.environ.get('CRAWLER_MAX_USES', 100))
+        self.min_available_mb = min_available_mb or int(os.environ.get('CRAWLER_MIN_AVAILABLE_MB', 300))
+        self._crawler = None
+        self._uses = 0
+        # Number of crawls that are currently using each browser, keyed by id(crawler)
+        self._leases = {}
+        # The semaphore and the lock are created lazily because they have to belong to the background loop
+        self._semaphore = None
+        self._start_lock = None
+
+    # This method runs crawler.arun(**kwargs) on the shared browser, it can be awaited from any event loop.
+    # crawl4ai would run an extraction_strategy synchronously inside arun, on the loop that every crawl of the worker shares,
+    # so the page is fetched without it and the extraction runs in a thread afterwards, filling in extracted_content like crawl4ai does.
+    async def arun(self, extraction_strategy=None, chunking_strategy=None, **kwargs):
+        result = await run_in_background(self._arun(**kwargs))
+        if extraction_strategy is not None and result.success:
+            sections = (chunking_strategy or RegexChunking()).chunk(result.markdown)
+            blocks = await asyncio.to_thread(extraction_strategy.run, result.url, sections)
+            result.extracted_content = json.dumps(blocks, indent=4, default=str)
+        return result
+
+    async def _arun(self, **kwargs):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._start_lock = asyncio.Lock()
+        async with self._semaphore:
+            crawler = await self._acquire()
+            session_id = kwargs.pop('session_id', None) or f"pool-{uuid.uuid4().hex}"
+            try:
+                return await crawler.arun(session_id=session_id, **kwargs)
+            finally:
+                # Closing the session closes the page and its browser context
+                try:
+                    await crawler.crawler_strategy.kill_session(session_id)
+                except Exception as e:
+                    print(f"Error closing the crawler session {session_id}: {str(e)}")
+                await self._release(crawler)
+
+    # This method returns the current browser, starting a new one if there is none or the current one has to be recycled.
+    async def _acquire(self) -> AsyncWebCrawler:
+        async with self._start_lock:
+            if self._crawler is not None and self._should_recycle():
+                print(f"Recycling the headless browser after {self._uses} uses")
+                old_crawler = self._crawler
+                self._crawler = None
+                # If nobody is using the old browser we close it now, otherwise the last crawl closes it
+                if self._leases.get(id(old_crawler), 0) == 0:
+                    await self._close_crawler(old_crawler)
+            if self._crawler is None:
+                crawler = AsyncWebCrawler(verbose=False, log_level=logging.ERROR, silent=True)
+                await crawler.__aenter__()
+                self._crawler = crawler
+                self._uses = 0
+            self._uses += 1
+            self._leases[id(self._crawler)] = self._leases.get(id(self._crawler), 0) + 1
+            return self._crawler
+
+    async def _release(self, crawler: AsyncWebCrawler) -> None:
+        remaining = self._leases.get(id(crawler), 1) - 1
+        self._leases[id(crawler)] = remaining
+        if remaining == 0 and crawler is not self._crawler:
+            await self._close_crawler(crawler)
+
+    async def _close_crawler(self, crawler: AsyncWebCrawler) -> None:
+        self._leases.pop(id(crawler), None)
+        try:
+            await crawler.__aexit__(None, None, None)
+        except Exception as e:
+            print(f"Error closing the headless browser: {str(e)}")
+
+    def _should_recycle(self) -> bool:
+        if self._uses >= self.max_uses:
+            return True
+        available_mb = _available_memory_mb()
+        return available_mb is not None and available_mb < self.min_available_mb
+
+    # This method closes the shared browser, it is called when the worker exits.
+    async def aclose(self) -> None:
+        if self._crawler is not None:
+            crawler = self._crawler
+            self._crawler = None
+            await self._close_crawler(crawler)
+
+    def close(self) -> None:
+        if self._crawler is None:
+            return
+        if in_background_loop():
+            raise RuntimeError("Use 'await pool.aclose()' from the background loop")
+        try:
+            run_sync(self.aclose(), timeout=30)
+        except Exception as e:
+            print(f"Error shutting down the crawler pool: {str(e)}")
+
+# This function reads the memory that is still available on the machine (in MB), None when we can't tell (e.g. macOS).
+def _available_memory_mb():
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        return None
+    return None
+
+_pool = None
+
+# This function returns the crawler pool of the current worker.
+def get_crawler_pool() -> CrawlerPool:
+    global _pool
+    if _pool is None:
+        _pool = CrawlerPool()
+    return _pool
+
+# This function shuts down the crawler pool of the current worker, gunicorn calls it from the worker_exit hook.
+def shutdown_crawler_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+atexit.register(shutdown_crawler_pool)
@@ -12,13 +12,21 @@ from app.crawl4ai import *
 import time
 from datetime import datetime
 import json
-from pathlib import Path
+import re
 import asyncio
 import logging
 import urllib3
 import warnings
-from app.api.prompt_operations import get_prompt
+from app.api.prompt_operations import aget_prompt_template
+from sqlalchemy import select
 from cryptography.fernet import Fernet
+from app.llm_cache import lookup_cached, store_cached, get_llm_cache
+from app.llm_scheduler import scheduled_invoke, get_llm_scheduler, record_llm_usage
+from app.usage import usage_user_id, check_budget, record_usage, get_usage_recorder
+from app.relevance import RelevancePrefilter
+from app.url_utils import normalize_url
+from app.api.article_operations import get_known_articles, upsert_articles
+from app.trace_store import save_trace
 
 logging.getLogger('werkzeug').setLevel(logging.ERROR)
 logging.getLogger('httpx').setLevel(logging.ERROR)
@@ -30,28 +38,28 @@ logging.getLogger('crawl4ai.extraction_strategy').setLevel(logging.ERROR)
 logging.getLogger('crawl4ai.crawler').setLevel(logging.ERROR)
 warnings.filterwarnings('ignore', category=urllib3.exceptions.NotOpenSSLWarning)
 
+# This function passes a progress event to the progress callback of the caller (e.g. the job runner), if there is one.
+async def report_progress(progress, event: dict) -> None:
+    if progress is None:
+        return
+    try:
+        await progress(event)
+    except Exception as e:
+        print(f"Error reporting progress: {str(e)}")
+
 # This class can take a url and write a tweet.
 class ContentProcessor:
     # Initialize the class with LLM, it takes the API key from an environment variable.
+    # A processor doesn't keep anything of a run, so the processor cache can share one between the runs of a user.
     def __init__(self,user):
         self.user = user
+        self.user_id = user.id
         fernet = Fernet(os.environ['ENCRYPTION_KEY'].encode())
         self.decripted_api_key = fernet.decrypt(self.user.openai_api_key).decode()
-        self.llm = ChatOpenAI(openai_api_key=self.decripted_api_key, model_name='gpt-4o-mini')
-        self.traces_dir = Path("traces")
-        self.traces_dir.mkdir(exist_ok=True)
-
-    # This method takes a dictionary and saves the trace in the traces folder
-    def _save_trace(self,trace_data:dict):
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        trace_file = self.traces_dir / f"trace_{timestamp}.json"
-        
-        if not isinstance(trace_data, dict):
-            raise ValueError(f"trace_data must be a dictionary, got {type(trace_data)}")
+        # The LLM scheduler retries the calls, so the client itself doesn't. stream_usage makes a streamed answer end with its token usage
+        self.llm = ChatOpenAI(openai_api_key=self.decripted_api_key, model_name='gpt-4o-mini', max_retries=0, stream_usage=True)
+        self.post_chain = None
 
-        with open(trace_file, 'w') as f:
-            json.dump(trace_data,f,indent=2)
-            
     # This method fetches the prompt template of a prompt in the database and takes its ID as an arguement.
     # def get_prompt(self, id: int) -> Optional[str]:
     #     db = SessionLocal()
@@ -66,9 +74,15 @@ class ContentProcessor:
     #         db.close()
 
     # This method creates a chain with the proper chain template so that we can insert the primary and secondary articles.
-    def setup_chain(self):
-        self.prompt = get_prompt(1,self.user.id)
-        self.prompt_template = PromptTemplate(template=self.prompt,input_variables=["primary","secondary"])
+    # The template comes from the prompt cache, the chain is only built again when the prompt changed
+    async def setup_chain(self):
+        prompt_template = await aget_prompt_template(1, self.user_id, ["primary","secondary"])
+        if prompt_template is None:
+            raise ValueError(f"No tweet prompt found for user_id: {self.user_id}")
+        if self.post_chain is not None and prompt_template is self.prompt_template:
+            return
+        self.prompt = prompt_template.template
+        self.prompt_template = prompt_template
         self.post_chain = self.prompt_template | self.llm
 
     # This method takes the string of the final post and breaks it down to sub-tweets.
@@ -77,10 +91,35 @@ class ContentProcessor:
         content = social_post.content if hasattr(social_post, 'content') else social_post
         return [tweet.strip() for tweet in content.split('\n\n') 
                 if tweet.strip() and not tweet.isspace()]
+
+    # This method streams the generation and passes every tweet to on_tweet as soon as the blank line that ends it arrives.
+    # It returns the whole generated text, which is split with _parse_tweets afterwards exactly like a non-streamed result.
+    # If a usage dictionary is passed, the token usage the stream reports is added to it.
+    async def _stream_chain(self, inputs: dict, on_tweet, usage: dict = None) -> str:
+        content = ""
+        buffer = ""
+        async for chunk in self.post_chain.astream(inputs):
+            if usage is not None and getattr(chunk, 'usage_metadata', None):
+                for name in ('input_tokens', 'output_tokens'):
+                    usage[name] = usage.get(name, 0) + chunk.usage_metadata.get(name, 0)
+            text = chunk.content if hasattr(chunk, 'content') else str(chunk)
+            content += text
+            buffer += text
+            while '\n\n' in buffer:
+                tweet, buffer = buffer.split('\n\n', 1)
+                if tweet.strip():
+                    await report_progress(on_tweet, tweet.strip())
+        if buffer.strip():
+            await report_progress(on_tweet, buffer.strip())
+        return content
     
     # This method takes one URL and returns a dictionary that inside has the list of tweets.
-    async def process_url(self, url:str) -> Optional[Dict]:
+    # use_cache controls the LLM response cache for the generation, by default it is only used for deterministic (temperature 0) models.
+    # progress is an optional async callback that gets the name of every step when it starts and the step itself when it ends.
+    # on_tweet is an optional async callback, when it is given the generation is streamed and every tweet is passed to it as soon as it is complete.
+    async def process_url(self, url:str, use_cache: Optional[bool] = None, progress=None, on_tweet=None) -> Optional[Dict]:
         trace = {
+            "kind": "url",
             "url": url,
             "start_time": datetime.now().isoformat(),
             "steps": [],
@@ -88,75 +127,117 @@ class ContentProcessor:
         }
 
         try:
+            # Every LLM call of the run is accounted to the user, and a user who spent their budget can't start one
+            usage_user_id.set(self.user_id)
+            await asyncio.to_thread(check_budget, self.user_id)
+
             # Extract the article
+            await report_progress(progress, {"name": "extract_article"})
             step_start = time.time()
-            self.article = await extract_article_content(url,self.decripted_api_key)
+            extraction_stats = {}
+            article = await extract_article_content(url,self.decripted_api_key,stats=extraction_stats)
             trace["steps"].append({
                 "name": "extract_article",
                 "duration": time.time() - step_start,
-                "success": True
+                "success": True,
+                "extraction": extraction_stats
             })
-            trace["content"]["article_preview"] = self.article
+            await report_progress(progress, trace["steps"][-1])
+            trace["content"]["article_preview"] = article
             
-            # Setup the chain
-            try:
-                print('Setting up the chains')
-                self.setup_chain()
-            except Exception as e:
-                print(f'Error setting up the chains : {str(e)}')
+            # Setup the chain, a no-op unless the prompt changed since the last run
+            await self.setup_chain()
 
             # Get all the secondary articles in a long string
+            await report_progress(progress, {"name": "get_secondary_articles"})
             step_start = time.time()
-            self.secondary_articles = await get_formatted_summaries(url,self.decripted_api_key)
+            summary_timings = []
+            secondary_articles = await get_formatted_summaries(url,self.decripted_api_key,timings=summary_timings)
             trace["steps"].append({
                 "name": "get_secondary_articles",
                 "duration": time.time() - step_start,
-                "success": True
+                "success": True,
+                "summaries": summary_timings
             })
-            trace["content"]["secondary_articles"] = self.secondary_articles
+            await report_progress(progress, trace["steps"][-1])
+            trace["content"]["secondary_articles"] = secondary_articles
 
             
             # Run the chain
+            await report_progress(progress, {"name": "run_chain"})
             step_start = time.time()
-            trace["content"]["prompt_template"] = self.prompt  # Store the template
-            trace["content"]["final_prompt"] = self.prompt_template.format(  # Store the formatted prompt
-                primary=self.article,
-                secondary=self.secondary_articles
-            )
-            self.result = self.post_chain.invoke({
-                "primary": self.article,
-                "secondary": self.secondary_articles
-            })
+            # The formatted prompt isn't stored, it is the template with the article and the secondary articles the trace already has
+            trace["content"]["prompt_template"] = self.prompt
+            inputs = {
+                "primary": article,
+                "secondary": secondary_articles
+            }
+            first_tweet_after = None
+            if on_tweet is None:
+                result_content = await scheduled_invoke(self.post_chain, self.llm, self.prompt_template, inputs, use_cache=use_cache, call_site='generation')
+            else:
+                async def emit(tweet: str) -> None:
+                    nonlocal first_tweet_after
+                    if first_tweet_after is None:
+                        first_tweet_after = time.time() - step_start
+                    await on_tweet(tweet)
+
+                key, cached = await asyncio.to_thread(lookup_cached, self.llm, self.prompt_template, inputs, use_cache)
+                if cached is not None:
+                    record_llm_usage('generation_stream', self.llm, cached=True)
+                    result_content = cached
+                    for tweet in self._parse_tweets(cached):
+                        await report_progress(emit, tweet)
+                else:
+                    # A stream can only be retried as long as none of its tweets went out
+                    stream_usage = {}
+                    result_content = await get_llm_scheduler().run(
+                        self.decripted_api_key,
+                        lambda: self._stream_chain(inputs, emit, stream_usage),
+                        estimated_tokens=estimate_tokens(self.prompt_template.format(**inputs)) + 1000,
+                        can_retry=lambda: first_tweet_after is None,
+                        call_site='generation_stream'
+                    )
+                    record_usage('generation_stream', self.llm.model_name, stream_usage.get('input_tokens', 0), stream_usage.get('output_tokens', 0))
+                    if key is not None:
+                        await asyncio.to_thread(store_cached, key, result_content)
             trace["steps"].append({
                 "name": "run_chain",
                 "duration": time.time() - step_start,
-                "success": True
+                "success": True,
+                "streamed": on_tweet is not None,
+                "first_tweet_after": first_tweet_after
             })
+            await report_progress(progress, trace["steps"][-1])
             
             #break down the result in tweets
             step_start = time.time()
-            self.tweets = self._parse_tweets(self.result)
+            tweets = self._parse_tweets(result_content)
             trace["steps"].append({
                 "name": "parse_tweets",
                 "duration": time.time() - step_start,
                 "success": True
             })
-            trace["content"]["tweets"] = self.tweets
+            await report_progress(progress, trace["steps"][-1])
+            trace["content"]["tweets"] = tweets
             
             result = {
                 "status": "success",
-                "tweets": self.tweets,
-                "tweet_count": len(self.tweets),
+                "tweets": tweets,
+                "tweet_count": len(tweets),
                 "url": url
             }
             trace["status"] = "success"
-            self._save_trace(trace)
+            trace["llm_cache"] = get_llm_cache().stats()
+            trace["llm_scheduler"] = get_llm_scheduler().limiter(self.decripted_api_key).stats()
+            save_trace(trace)
             return result
         
         except Exception as e:
             trace["status"] = "error"
             trace["error"] = str(e)
-            self._save_trace(trace)
+            trace["error_type"] = type(e).__name__
+            save_trace(trace)
             return {
             "status": "error",
             "message": f"An error occurred: {str(e)}",
@@ -165,48 +246,106 @@ class ContentProcessor:
     
         # Setup a chain that will take only the primary article as input varibles and will create a chain, the purpose is for tests
     
+# The prompt of a batch comparison. The user's own comparison prompt is kept as the criteria, so that the profile is sent once for all the articles of the batch.
+BATCH_COMPARISON_TEMPLATE = """
+Below are the instructions you follow when you judge one article against a profile. Apply them to every numbered article further down, judging each article on its own.
+
+Instructions:
+{criteria}
+
+Profile:
+"{profile}"
+
+Articles:
+{articles}
+
+Respond only with a JSON object that maps the number of every article to "Yes" or "No", for example {{"1": "Yes", "2": "No"}}.
+"""
+
+# The prompt of the title screening, it only has to throw out the articles that obviously don't fit.
+TITLE_SCREEN_TEMPLATE = """
+You screen a list of articles for the person described in the profile, based only on their titles (and descriptions, when there is one).
+For every article answer "yes" if it clearly fits the profile, "no" if it clearly doesn't and "maybe" if the title alone isn't enough to tell.
+Only answer "no" when you are sure, the articles you don't reject are read in full afterwards.
+
+Profile:
+"{profile}"
+
+Articles:
+{articles}
+
+Respond only with a JSON object that maps the number of every article to "yes", "no" or "maybe", for example {{"1": "maybe", "2": "no"}}.
+"""
+
 # This class is handling the comparison of the article to the profile of the user
 class ProfileComparer:
     def __init__(self,user) -> None:
         self.user = user
         fernet = Fernet(os.environ['ENCRYPTION_KEY'].encode())
         self.decripted_api_key = fernet.decrypt(self.user.openai_api_key).decode()
-        self.llm = ChatOpenAI(openai_api_key=self.decripted_api_key, model_name='gpt-4o-mini',temperature=0)
+        self.llm = ChatOpenAI(openai_api_key=self.decripted_api_key, model_name='gpt-4o-mini',temperature=0, max_retries=0)
         self.user_id = user.id
-        self.setup_comparison_chain()
+        self.batch_prompt_template = PromptTemplate(template=BATCH_COMPARISON_TEMPLATE,input_variables=["criteria","profile","articles"])
+        self.batch_chain = self.batch_prompt_template | self.llm
+        self.title_prompt_template = PromptTemplate(template=TITLE_SCREEN_TEMPLATE,input_variables=["profile","articles"])
+        self.title_chain = self.title_prompt_template | self.llm
+        self.batch_max_articles = int(os.environ.get('COMPARISON_BATCH_MAX_ARTICLES', 10))
+        # The comparison chain is set up by the first comparison
+        self.comparison_prompt_template = None
     
     # This method returns the interests of a profile, gets an ID of the profile
-    def _get_profile_interests(self, user_id: int):
-        db = SessionLocal()
+    async def _get_profile_interests(self, user_id: int):
         try:
-            profile = db.query(Profile).filter(Profile.user_id == user_id).first()
+            async with AsyncSessionLocal() as db:
+                profile = (await db.execute(select(Profile.id, Profile.interests_description).where(Profile.user_id == user_id).limit(1))).first()
             if not profile:
                 raise ValueError(f"No profile found for user_id: {user_id}")
             print(f"Got the profile interests")
             return profile.interests_description
         except Exception as e:
             print(f"Error trying to get the profile {str(e)}")
-        finally:
-            db.close()
     
-    # This method sets up the chain
-    def setup_comparison_chain(self):
-        self.prompt = get_prompt(prompt_type=2, user_id=self.user_id)
-        self.comparison_prompt_template = PromptTemplate(template=self.prompt,input_variables=["profile","article"])
+    # This method sets up the chain. Like ContentProcessor.setup_chain, the comparison chain is only built again when the prompt changed
+    async def setup_comparison_chain(self):
+        prompt_template = await aget_prompt_template(2, self.user_id, ["profile","article"])
+        if prompt_template is None:
+            raise ValueError(f"No comparison prompt found for user_id: {self.user_id}")
+        if prompt_template is self.comparison_prompt_template:
+            return
+        self.prompt = prompt_template.template
+        self.comparison_prompt_template = prompt_template
         self.comparison_chain = self.comparison_prompt_template | self.llm
 
-    async def compare_article_to_profile(self, article_url: str, user_id: int) -> Dict:
+    # This method compares one article to the profile of the user, the LLM answer is cached unless use_cache is False.
+    # The comparison is written to the trace store, unless traced is False because it is part of a blog scan that has its own trace.
+    async def compare_article_to_profile(self, article_url: str, user_id: int, use_cache: bool = True, traced: bool = True) -> Dict:
+        trace = {
+            "kind": "comparison",
+            "url": article_url,
+            "start_time": datetime.now().isoformat(),
+            "steps": []
+        }
         try:
-            profile_interests = self._get_profile_interests(user_id)
-            article_content = await extract_article_content(article_url,self.decripted_api_key)
+            usage_user_id.set(user_id)
+            await asyncio.to_thread(check_budget, user_id)
+            # The prompt and the profile are read at the same time
+            _, profile_interests = await asyncio.gather(self.setup_comparison_chain(), self._get_profile_interests(user_id))
+            step_start = time.time()
+            extraction_stats = {}
+            article_content = await extract_article_content(article_url,self.decripted_api_key,use_cache=use_cache,stats=extraction_stats)
+            trace["steps"].append({"name": "extract_article", "duration": time.time() - step_start, "success": True, "extraction": extraction_stats})
             print(f"Profile interests: {profile_interests[:50]}")
             print(f"Article content preview: {article_content[:50]}...")
-            result = self.comparison_chain.invoke({
+            step_start = time.time()
+            result = await scheduled_invoke(self.comparison_chain, self.llm, self.comparison_prompt_template, {
                 "profile": profile_interests,
                 "article": article_content
-            })
+            }, use_cache=use_cache, call_site='comparison')
             llm_response = result.content if hasattr(result, 'content') else str(result)
+            trace["steps"].append({"name": "compare", "duration": time.time() - step_start, "success": True})
             print(f"LLM Response: {llm_response}")  # Debug print
+            trace["status"] = "success"
+            trace["comparison"] = {"article": article_content, "llm_response": llm_response}
             return {
                 "status": "success",
                 "url": article_url,
@@ -216,12 +355,184 @@ class ProfileComparer:
             
         except Exception as e:
             print(f"Comparison error: {str(e)}")
+            trace["status"] = "error"
+            trace["error"] = str(e)
+            trace["error_type"] = type(e).__name__
             return {
                 "status": "error",
                 "message": f"An error occurred: {str(e)}",
                 "url": article_url,
                 "profile_id": id
             }
+        finally:
+            if traced:
+                save_trace(trace)
+
+    # This method packs the articles into batches. An article takes its condensed content's tokens, a batch is closed when the next article
+    # would go over the token budget or the batch already has batch_max_articles, so long articles end up in small batches and short ones in big batches.
+    def _pack_batches(self, articles: list, token_budget: int) -> list:
+        batches = []
+        batch = []
+        batch_tokens = 0
+        for article in articles:
+            tokens = estimate_tokens(article["title"]) + estimate_tokens(article["content"])
+            if batch and (batch_tokens + tokens > token_budget or len(batch) >= self.batch_max_articles):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+            batch.append(article)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    # This method reads the verdicts of a batch answer, it returns {article number: "Yes"/"No"} (or any other allowed answer)
+    # or raises ValueError if the answer isn't the JSON we asked for.
+    @staticmethod
+    def _parse_verdicts(llm_response: str, count: int, allowed: tuple = ("yes", "no")) -> Dict[int, str]:
+        match = re.search(r'\{.*\}', llm_response, re.DOTALL)
+        if not match:
+            raise ValueError("No JSON object in the batch answer")
+        answer = json.loads(match.group(0))
+        verdicts = {}
+        for key, value in answer.items():
+            number = int(key)
+            if 1 <= number <= count and str(value).strip().lower() in allowed:
+                verdicts[number] = str(value).strip().capitalize()
+        if not verdicts:
+            raise ValueError("No verdicts in the batch answer")
+        return verdicts
+
+    # This method sends one batch of articles to the LLM and returns a result for every article, in the same shape as compare_article_to_profile.
+    # If the call fails or the answer can't be parsed, the batch is split in two halves that are tried again, smaller batches are less likely
+    # to confuse the model. The halving only lives in this call, the comparer is shared by the scans of the user and keeps its batch size.
+    # Articles that are missing from an answer, and a single article whose batch failed, are compared one by one instead.
+    async def _compare_batch(self, batch: list, user_id: int, criteria: str, profile_interests: str, use_cache: bool, stats: Dict) -> list:
+        articles = "\n\n".join(
+            f"Article {number}: {article['title']}\n{article['content']}"
+            for number, article in enumerate(batch, start=1)
+        )
+        verdicts = {}
+        try:
+            result = await scheduled_invoke(self.batch_chain, self.llm, self.batch_prompt_template, {
+                "criteria": criteria,
+                "profile": profile_interests,
+                "articles": articles
+            }, use_cache=use_cache, call_site='batch_comparison')
+            stats["llm_calls"] += 1
+            verdicts = self._parse_verdicts(result.content if hasattr(result, 'content') else str(result), len(batch))
+        except Exception as e:
+            stats["failed_batches"] += 1
+            if len(batch) > 1:
+                half = len(batch) // 2
+                print(f"Batch comparison failed, trying the {len(batch)} articles again in batches of {half} and {len(batch) - half}: {str(e)}")
+                stats["split_batches"] += 1
+                stats["smallest_batch"] = min(stats.get("smallest_batch") or len(batch), half)
+                halves = await asyncio.gather(
+                    self._compare_batch(batch[:half], user_id, criteria, profile_interests, use_cache, stats),
+                    self._compare_batch(batch[half:], user_id, criteria, profile_interests, use_cache, stats)
+                )
+                return halves[0] + halves[1]
+            print(f"Batch comparison failed, comparing the article on its own: {str(e)}")
+
+        results = []
+        for number, article in enumerate(batch, start=1):
+            if number in verdicts:
+                results.append({
+                    "status": "success",
+                    "url": article["url"],
+                    "user_id": user_id,
+                    "llm_response": verdicts[number],
+                    "batched": True
+                })
+            else:
+                stats["single_calls"] += 1
+                stats["llm_calls"] += 1
+                results.append(await self.compare_article_to_profile(article["url"], user_id, use_cache=use_cache, traced=False))
+        return results
+
+    # This method screens articles on their title alone, plus the description when the caller has one, so nothing has to be crawled.
+    # articles is a dictionary of url: {"title", "description"}, the result is {url: "yes"/"no"/"maybe"}.
+    # Articles the answer doesn't cover (or a batch that fails) are "maybe", they still get the full comparison.
+    async def screen_titles(self, articles: Dict[str, Dict], user_id: int, use_cache: bool = True, stats: Dict = None) -> Dict[str, str]:
+        if stats is None:
+            stats = {}
+        stats.update({"llm_calls": 0, "failed_batches": 0})
+        batch_size = int(os.environ.get('TITLE_SCREEN_BATCH_SIZE', 50))
+        urls = list(articles.keys())
+        verdicts = {url: "maybe" for url in urls}
+        if not urls:
+            return verdicts
+        usage_user_id.set(user_id)
+        profile_interests = await self._get_profile_interests(user_id)
+
+        for start in range(0, len(urls), batch_size):
+            batch = urls[start:start + batch_size]
+            lines = []
+            for number, url in enumerate(batch, start=1):
+                line = f"{number}. {articles[url].get('title') or url}"
+                if articles[url].get("description"):
+                    line += f"\n   {articles[url]['description']}"
+                lines.append(line)
+            try:
+                result = await scheduled_invoke(self.title_chain, self.llm, self.title_prompt_template, {
+                    "profile": profile_interests,
+                    "articles": "\n".join(lines)
+                }, use_cache=use_cache, call_site='title_screen')
+                stats["llm_calls"] += 1
+                answer = self._parse_verdicts(result.content if hasattr(result, 'content') else str(result), len(batch), ("yes", "no", "maybe"))
+                for number, verdict in answer.items():
+                    verdicts[batch[number - 1]] = verdict.lower()
+            except Exception as e:
+                print(f"Title screening failed for {len(batch)} articles, they all go to the full comparison: {str(e)}")
+                stats["failed_batches"] += 1
+        return verdicts
+
+    # This method compares many articles (a dictionary of url: title) to the profile with as few LLM calls as possible and returns the results in the same order.
+    # Every article is condensed to COMPARISON_ARTICLE_MAX_TOKENS and the articles are packed into batches of up to COMPARISON_BATCH_TOKEN_BUDGET tokens.
+    # If a stats dictionary is passed, it is filled with the number of batches, LLM calls and fallbacks.
+    async def compare_articles_batch(self, articles_dict: Dict[str, str], user_id: int, use_cache: bool = True, stats: Dict = None) -> list:
+        if stats is None:
+            stats = {}
+        stats.update({"articles": len(articles_dict), "batches": 0, "llm_calls": 0, "failed_batches": 0, "split_batches": 0, "smallest_batch": None, "single_calls": 0})
+        if not articles_dict:
+            return []
+        usage_user_id.set(user_id)
+        article_max_tokens = int(os.environ.get('COMPARISON_ARTICLE_MAX_TOKENS', 600))
+        token_budget = int(os.environ.get('COMPARISON_BATCH_TOKEN_BUDGET', 6000))
+
+        _, profile_interests = await asyncio.gather(self.setup_comparison_chain(), self._get_profile_interests(user_id))
+        # The user's comparison prompt without its inputs, those are given once for the whole batch
+        criteria = self.prompt.replace('{profile}', 'the profile below').replace('{article}', 'the article below')
+
+        urls = list(articles_dict.keys())
+        contents = await asyncio.gather(
+            *[extract_article_content(url, self.decripted_api_key, use_cache=use_cache) for url in urls],
+            return_exceptions=True
+        )
+        results = {}
+        articles = []
+        for url, content in zip(urls, contents):
+            if isinstance(content, Exception):
+                results[url] = {
+                    "status": "error",
+                    "message": f"An error occurred: {str(content)}",
+                    "url": url,
+                    "user_id": user_id
+                }
+                continue
+            articles.append({"url": url, "title": articles_dict[url] or url, "content": condense_text(content, article_max_tokens)})
+
+        batches = self._pack_batches(articles, token_budget)
+        stats["batches"] = len(batches)
+        batch_results = await asyncio.gather(*[
+            self._compare_batch(batch, user_id, criteria, profile_interests, use_cache, stats)
+            for batch in batches
+        ])
+        for batch_result in batch_results:
+            for result in batch_result:
+                results[result["url"]] = result
+        return [results[url] for url in urls]
 
 # This class is handling all the blogs and the extraction of the articles from them.
 class BlogHandler:
@@ -229,38 +540,161 @@ class BlogHandler:
         self.user = user
         fernet = Fernet(os.environ['ENCRYPTION_KEY'].encode())
         self.decripted_api_key = fernet.decrypt(self.user.openai_api_key).decode()
-        self.content_processor = ContentProcessor(self.user)
-        self.profile_comparer = ProfileComparer(self.user)
+        self.user_id = user.id
+        # The processor and the comparer are the ones the processor cache already has for this user
+        from app.processor_cache import get_processor_cache
+        self.content_processor = get_processor_cache().get('content_processor', user)
+        self.profile_comparer = get_processor_cache().get('profile_comparer', user)
+
+    async def _has_profile(self, user_id: int) -> bool:
+        async with AsyncSessionLocal() as db:
+            return await db.scalar(select(Profile.id).where(Profile.user_id == user_id).limit(1)) is not None
     
     # This method takes a url (a blog url) and a profile, it returns a list of dictionaries with all the relevant articles of the blog and wheather they fit the profile or not. 
-    # It also stores the results in the database
-    async def process_and_store_articles(self, blog_url: str, user_id: int) -> list[Dict]:
-        db = SessionLocal()
+    # It also stores the results in the database. progress is an optional async callback that is told about every step, like in process_url.
+    # The articles go through three tiers and every tier only gets what the previous one couldn't decide:
+    # the titles (no crawling), the local relevance prefilter (title + lead text) and the full comparison with the LLM.
+    # If a stats dictionary is passed, it is filled with the counts and timings of every tier, they are also written to the trace.
+    # Articles that were scored on an earlier scan keep their verdict and aren't crawled again, unless rescan_known is True.
+    # A user who spent their monthly budget gets a degraded scan: no title screening and no LLM comparison, the prefilter decides
+    # the uncertain articles by the middle of its band and the articles it can't decide aren't stored, so the next scan looks at them again.
+    async def process_and_store_articles(self, blog_url: str, user_id: int, progress=None, stats: Dict = None, rescan_known: bool = False) -> list[Dict]:
+        trace = {
+            "kind": "blog",
+            "url": blog_url,
+            "start_time": datetime.now().isoformat(),
+            "steps": [],
+            "screening": {}
+        }
+        screening = trace["screening"]
+
+        async def step_done(step: Dict) -> None:
+            trace["steps"].append(step)
+            await report_progress(progress, step)
+
         try:
-            # Get all articles from the blog
+            usage_user_id.set(self.user_id)
+            over_budget = await asyncio.to_thread(get_usage_recorder().over_budget, self.user_id)
+            screening["over_budget"] = over_budget
+
+            # Get all articles from the blog, the user's profile is looked up while the page loads
             print('Extracting all the articles from the page')
-            articles_dict = await extract_all_articles_from_page(blog_url,self.decripted_api_key)
-            # Get the user's profile
+            await report_progress(progress, {"name": "extract_articles"})
+            step_start = time.time()
+            articles_dict, has_profile = await asyncio.gather(
+                extract_all_articles_from_page(blog_url,self.decripted_api_key),
+                self._has_profile(user_id)
+            )
+            await step_done({"name": "extract_articles", "duration": time.time() - step_start, "success": True, "article_count": len(articles_dict)})
             print('Done extracting, now creating a batch of tasks and running them simultanously')
-            profile = db.query(Profile).filter(Profile.user_id == user_id).first()
-            if not profile:
+            if not has_profile:
                 raise ValueError(f"No profile found for user_id: {user_id}")
-            
-            # Create tasks for all article comparisons
-            comparison_tasks = [
-                self.profile_comparer.compare_article_to_profile(url, self.user.id)
-                for url in articles_dict.keys()
-            ]
-
-            # Run all comparisons concurrently
-            comparison_results = await asyncio.gather(*comparison_tasks)
+
+            screening["articles"] = len(articles_dict)
+            decided = {}  # url: (fits_profile, fit_source) of the articles a cheap tier already decided
+
+            # The articles we already know from an earlier scan, looked up in one query
+            known_articles = {}
+            if not rescan_known:
+                async with AsyncSessionLocal() as db:
+                    known_articles = await db.run_sync(get_known_articles, user_id, list(articles_dict.keys()))
+            for url in articles_dict:
+                known = known_articles.get(normalize_url(url))
+                if known is not None:
+                    decided[url] = (bool(known.profile_fit), 'previous_scan')
+            screening["known"] = len(decided)
+            candidates = {url: title for url, title in articles_dict.items() if url not in decided}
+
+            # Tier 1: the titles, and the descriptions of the pages we happen to have cached
+            if os.environ.get('TITLE_SCREEN', 'true').lower() == 'true' and candidates and not over_budget:
+                await report_progress(progress, {"name": "screen_titles"})
+                step_start = time.time()
+                cached_pages = await asyncio.gather(*[asyncio.to_thread(get_cached_description, url) for url in candidates])
+                title_stats = {}
+                verdicts = await self.profile_comparer.screen_titles({
+                    url: {"title": title, "description": description}
+                    for (url, title), (_, description) in zip(candidates.items(), cached_pages)
+                }, user_id, stats=title_stats)
+                in_cache = {url: cached for url, (cached, _) in zip(candidates, cached_pages)}
+                rejected = [url for url, verdict in verdicts.items() if verdict == "no"]
+                for url in rejected:
+                    decided[url] = (False, 'title')
+                screening["title"] = {
+                    "input": len(candidates),
+                    "yes": sum(1 for verdict in verdicts.values() if verdict == "yes"),
+                    "maybe": sum(1 for verdict in verdicts.values() if verdict == "maybe"),
+                    "rejected": len(rejected),
+                    "with_description": sum(1 for _, description in cached_pages if description),
+                    "crawls_avoided": sum(1 for url in rejected if not in_cache[url]),
+                    "duration": time.time() - step_start,
+                    **title_stats
+                }
+                candidates = {url: title for url, title in candidates.items() if url not in decided}
+                await step_done({"name": "screen_titles", "duration": time.time() - step_start, "success": True, "screening": screening["title"]})
+
+            # Every article from here on needs its page
+            screening["crawled"] = len(candidates)
+
+            # Tier 2: the local relevance prefilter, the clear hits and misses don't need the LLM
+            if os.environ.get('RELEVANCE_PREFILTER', 'true').lower() == 'true' and candidates:
+                await report_progress(progress, {"name": "prefilter_articles"})
+                step_start = time.time()
+                prefilter_verdicts = {}
+                try:
+                    prefilter = RelevancePrefilter(self.user_id, self.decripted_api_key)
+                    prefilter_verdicts = await prefilter.screen(candidates)
+                except Exception as e:
+                    print(f"Relevance prefilter failed, sending every article to the LLM: {str(e)}")
+                verdict_counts = {verdict: 0 for verdict in ("accept", "reject", "uncertain")}
+                for url, verdict in prefilter_verdicts.items():
+                    verdict_counts[verdict["verdict"]] += 1
+                    if verdict["verdict"] != "uncertain":
+                        decided[url] = (verdict["verdict"] == "accept", 'prefilter')
+                    elif over_budget:
+                        decided[url] = (verdict["score"] >= (prefilter.reject_below + prefilter.accept_above) / 2, 'prefilter')
+                screening["prefilter"] = {
+                    "input": len(candidates),
+                    "accepted": verdict_counts["accept"],
+                    "rejected": verdict_counts["reject"],
+                    "uncertain": len(candidates) - verdict_counts["accept"] - verdict_counts["reject"],
+                    "duration": time.time() - step_start
+                }
+                candidates = {url: title for url, title in candidates.items() if url not in decided}
+                await step_done({"name": "prefilter_articles", "duration": time.time() - step_start, "success": True, "screening": screening["prefilter"]})
+
+            # Tier 3: compare the articles in full, in batches or one by one with all the comparisons running concurrently
+            await report_progress(progress, {"name": "compare_articles"})
+            step_start = time.time()
+            comparison_stats = {}
+            if over_budget:
+                comparison_results = [{"status": "skipped", "message": "The monthly LLM budget is used up", "url": url} for url in candidates]
+                comparison_stats = {"articles": len(candidates), "llm_calls": 0, "skipped_over_budget": len(candidates)}
+            elif os.environ.get('COMPARISON_BATCH_MODE', 'true').lower() == 'true':
+                comparison_results = await self.profile_comparer.compare_articles_batch(candidates, self.user_id, stats=comparison_stats)
+            else:
+                comparison_results = await asyncio.gather(*[
+                    self.profile_comparer.compare_article_to_profile(url, self.user_id, traced=False)
+                    for url in candidates.keys()
+                ])
+                comparison_stats = {"articles": len(candidates), "llm_calls": len(candidates)}
+            comparisons = dict(zip(candidates.keys(), comparison_results))
+            screening["content"] = {"input": len(candidates), "duration": time.time() - step_start, **comparison_stats}
+            await step_done({"name": "compare_articles", "duration": time.time() - step_start, "success": True, "comparison": comparison_stats})
             print('Done running the tasks, now shaping everything nicely')
 
             # Process Results and Store in Database
             results = []
-            for (url, title), result in zip(articles_dict.items(), comparison_results):
+            new_articles = []
+            for url, title in articles_dict.items():
                 fits_profile = False
-                if result["status"] == "success":
+                fit_source = 'error'
+                result = comparisons.get(url)
+                if result is None:
+                    fits_profile, fit_source = decided[url]
+                elif result["status"] == "skipped":
+                    fit_source = 'budget'
+                elif result["status"] == "success":
+                    fit_source = 'llm'
                     llm_response = str(result["llm_response"]).lower()
                     print(f"\nAnalyzing article: {title}")
                     print(f"LLM Response: {llm_response}")
@@ -270,34 +704,43 @@ class BlogHandler:
                     fits_profile = any(indicator in llm_response for indicator in positive_indicators)
                     print(f"Fits profile: {fits_profile}")
                 
-                # Create new OnlineArticles entry
-                new_article = OnlineArticles(
-                    user_id=self.user.id,
-                    url=url,
-                    title=title,
-                    source_blog=blog_url,
-                    profile_fit=fits_profile
-                )
-                db.add(new_article)
+                if fit_source not in ('previous_scan', 'budget'):
+                    new_articles.append({
+                        "user_id": self.user_id,
+                        "url": url,
+                        "title": title,
+                        "source_blog": blog_url,
+                        "profile_fit": fits_profile,
+                        "fit_source": fit_source
+                    })
                 
                 article_result = {
                     "url": url,
                     "title": title,
-                    "fits_profile": fits_profile
+                    "fits_profile": fits_profile,
+                    "decided_by": fit_source
                 }
                 results.append(article_result)
             print('finished shaping, now commiting')
             
-            # Commit all database changes
-            db.commit()
+            # Store the new articles with one upsert and commit
+            async with AsyncSessionLocal() as db:
+                await db.run_sync(upsert_articles, new_articles)
+                await db.commit()
+            trace["status"] = "success"
             return results
             
         except Exception as e:
-            db.rollback()
             print(f"Error processing and storing articles: {str(e)}")
+            trace["status"] = "error"
+            trace["error"] = str(e)
+            trace["error_type"] = type(e).__name__
             return []
         finally:
-            db.close()
+            if stats is not None:
+                stats.update(screening)
+            trace["llm_scheduler"] = get_llm_scheduler().limiter(self.decripted_api_key).stats()
+            save_trace(trace)
     
 if __name__ == "__main__":
     # Initialize the BlogHandler
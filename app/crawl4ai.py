@@ -1,13 +1,21 @@
 import asyncio
 import os
 import json
-from crawl4ai import AsyncWebCrawler
+import time
 from crawl4ai.extraction_strategy import LLMExtractionStrategy
+from crawl4ai.chunking_strategy import RegexChunking
 from pydantic import BaseModel, Field
-from urllib.parse import urlparse
 import logging
 import warnings
 import urllib3
+from app.browser_pool import get_crawler_pool
+from app.fetch_cache import get_fetch_cache
+from app.llm_cache import get_llm_cache
+from app.readability import extract_main_content, extract_meta_description
+from app.link_extractor import extract_article_links, extract_content_links, resolve_link
+from app.llm_scheduler import get_llm_scheduler, estimate_tokens, RateLimitedError
+from app.metrics import BROWSER_FETCH_SECONDS, record_error
+from app.usage import record_usage
 logging.getLogger().setLevel(logging.ERROR)
 logging.getLogger('werkzeug').setLevel(logging.ERROR)
 logging.getLogger('urllib3').setLevel(logging.ERROR)
@@ -23,15 +31,133 @@ class UrlSchema(BaseModel):
     title: str = Field(..., description='The title of the link, indicative')
     url: str = Field(..., description='The actual url')
 
+# This function returns the rendered page of a url as a dictionary with its html and markdown.
+# Pages come from the fetch cache while they are fresh (or the server confirms they haven't changed), otherwise the shared browser renders them.
+async def fetch_page(url: str) -> dict:
+    started = time.perf_counter()
+    cache = get_fetch_cache()
+    entry = await asyncio.to_thread(cache.get, url)
+    if entry is not None and (cache.is_fresh(entry) or await cache.revalidate(url, entry)):
+        entry["from_cache"] = True
+        BROWSER_FETCH_SECONDS.labels('cache_hit').observe(time.perf_counter() - started)
+        return entry
+    try:
+        result = await get_crawler_pool().arun(url=url, bypass_cache=True, silent=True)
+        if not result.success:
+            raise ValueError(f"Could not fetch {url}: {result.error_message}")
+    except Exception as e:
+        BROWSER_FETCH_SECONDS.labels('error').observe(time.perf_counter() - started)
+        record_error('fetch', e)
+        raise
+    BROWSER_FETCH_SECONDS.labels('browser').observe(time.perf_counter() - started)
+    entry = await asyncio.to_thread(cache.put, url, result.html, result.markdown, result.response_headers)
+    entry["from_cache"] = False
+    return entry
+
+# This function runs an LLM extraction strategy over the markdown of a page and returns the extracted blocks.
+# It runs in a thread because crawl4ai calls the LLM synchronously, which would otherwise block the event loop.
+# The result is cached on (model, instruction, schema, page content), pass use_cache=False to always call the LLM.
+# The extraction goes through the LLM scheduler of its API key, one request per chunk of the page, and is reported under call_site.
+async def run_extraction(url: str, markdown: str, extraction_strategy: LLMExtractionStrategy, use_cache: bool = True, call_site: str = 'extraction') -> list:
+    cache = get_llm_cache()
+    key = cache.make_key(
+        extraction_strategy.provider,
+        'extraction',
+        extraction_strategy.extract_type,
+        extraction_strategy.instruction,
+        extraction_strategy.schema,
+        markdown
+    )
+    if use_cache:
+        cached = await asyncio.to_thread(cache.get, key)
+        if cached is not None:
+            record_usage(call_site, extraction_strategy.provider, cached=True)
+            return cached["blocks"]
+
+    sections = RegexChunking().chunk(markdown)
+
+    async def extract():
+        blocks = await asyncio.to_thread(extraction_strategy.run, url, sections)
+        # crawl4ai gives up on rate limits by itself and returns them as error blocks, the scheduler should retry those
+        if any(block.get('error') and _is_rate_limit_block(block) for block in blocks):
+            raise RateLimitedError(f"Extraction of {url} was rate limited")
+        return blocks
+
+    page_tokens = estimate_tokens(markdown)
+    blocks = await get_llm_scheduler().run(
+        extraction_strategy.api_token,
+        extract,
+        estimated_tokens=page_tokens + estimate_tokens(extraction_strategy.instruction) + 1000,
+        requests=max(1, int(page_tokens // extraction_strategy.chunk_token_threshold) + 1),
+        call_site=call_site
+    )
+    record_usage(call_site, extraction_strategy.provider, *_extraction_usage(extraction_strategy, markdown, blocks))
+    # Failed extractions come back as error blocks, we don't want to keep serving those
+    if use_cache and not any(block.get('error') for block in blocks):
+        await asyncio.to_thread(cache.set, key, {"blocks": blocks})
+    return blocks
+
+# This function returns the (prompt, completion) tokens an extraction used. Newer crawl4ai versions add them up in total_usage,
+# the one we pin throws the usage of its responses away, so then they are estimated from the page, the instruction of every chunk and the blocks.
+def _extraction_usage(extraction_strategy: LLMExtractionStrategy, markdown: str, blocks: list) -> tuple:
+    total_usage = getattr(extraction_strategy, 'total_usage', None)
+    if total_usage is not None and getattr(total_usage, 'prompt_tokens', 0):
+        return total_usage.prompt_tokens, total_usage.completion_tokens
+    chunks = max(1, int(estimate_tokens(markdown) // extraction_strategy.chunk_token_threshold) + 1)
+    instruction_tokens = estimate_tokens(extraction_strategy.instruction) + estimate_tokens(json.dumps(extraction_strategy.schema or {})) + 500
+    return estimate_tokens(markdown) + chunks * instruction_tokens, estimate_tokens(json.dumps(blocks))
+
+def _is_rate_limit_block(block: dict) -> bool:
+    content = str(block.get('content', '')).lower()
+    return 'rate limit' in content or 'ratelimit' in content or '429' in content
+
+# Running average of how long an LLM article extraction takes in this worker, used to estimate the time readability saves
+_llm_extraction_durations = {"average": None}
+
+def _record_llm_extraction_duration(duration: float) -> None:
+    average = _llm_extraction_durations["average"]
+    _llm_extraction_durations["average"] = duration if average is None else 0.8 * average + 0.2 * duration
+
+# This function shortens a text to about max_tokens, cutting at the last paragraph (or sentence) that still fits.
+def condense_text(text: str, max_tokens: int) -> str:
+    text = (text or '').strip()
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    for boundary in ('\n\n', '. ', '\n'):
+        position = cut.rfind(boundary)
+        if position > max_chars // 2:
+            return cut[:position + 1].strip()
+    return cut.strip()
+
 # This function takes a url and tries to re-create the article of the URL as realistically as possible.
-async def extract_article_content(url,api_key):
+# The article is first extracted locally from the html, the LLM only rebuilds it when the local extraction scores below READABILITY_MIN_SCORE.
+# If a stats dictionary is passed, it is filled with the path that was taken, the score and the time/tokens saved.
+async def extract_article_content(url,api_key,use_cache=True,stats:dict = None):
     logging.getLogger('crawl4ai.extraction_strategy.llm').setLevel(logging.ERROR)
-    async with AsyncWebCrawler(verbose=False, log_level=logging.ERROR, silent=True) as crawler:
-        print("Trying to extract the content from the article")
-        result = await crawler.arun(
-            url=url,
-            word_count_threshold=5,
-            extraction_strategy=LLMExtractionStrategy(
+    print("Trying to extract the content from the article")
+    page = await fetch_page(url)
+    step_start = time.time()
+    readable = await asyncio.to_thread(extract_main_content, page["html"])
+    readability_duration = time.time() - step_start
+    if stats is not None:
+        stats.update({"score": readable["score"], "readability_duration": readability_duration})
+    if readable["score"] >= float(os.environ.get('READABILITY_MIN_SCORE', 0.7)):
+        if stats is not None:
+            llm_duration = _llm_extraction_durations.get("average")
+            stats.update({
+                "path": "readability",
+                "tokens_saved": estimate_tokens(page["markdown"]),
+                "time_saved": llm_duration - readability_duration if llm_duration else None
+            })
+        return readable["markdown"]
+
+    step_start = time.time()
+    content_blocks = await run_extraction(
+            url,
+            page["markdown"],
+            LLMExtractionStrategy(
                 provider='openai/gpt-4o-mini',
                 api_token=api_key,
                 instruction=""" 
@@ -48,27 +174,47 @@ You are an expert at reading raw webpage markup and reconstructing the original
 Your final output should be a neatly organized version of the article's textual content, suitable for further processing or summarization.
                 """
             ),
-            bypass_cache=True,
-            silent=True
-        )
-    content_blocks = json.loads(result.extracted_content)
+            use_cache=use_cache,
+            call_site='article_extraction'
+    )
     formatted_article = []
     for block in content_blocks:
         if 'content' in block:
             formatted_article.extend(block['content'])
     
     article = "\n\n".join(formatted_article)
+    _record_llm_extraction_duration(time.time() - step_start)
+    if stats is not None:
+        stats.update({"path": "llm", "tokens_saved": 0, "time_saved": 0})
     return article
 
+# This function returns (whether the page is in the fetch cache, its meta description) without ever crawling the page.
+def get_cached_description(url: str):
+    entry = get_fetch_cache().get(url)
+    if entry is None:
+        return False, ''
+    return True, extract_meta_description(entry["html"])
+
+# This function returns the first words of the main content of a page, a cheap text to judge what an article is about.
+async def get_lead_text(url: str, max_words: int = 80) -> str:
+    page = await fetch_page(url)
+    readable = await asyncio.to_thread(extract_main_content, page["html"])
+    return " ".join(readable["markdown"].split()[:max_words])
+
 # This function takes a url and returns all the relevant urls referenced in the article of this URL
-async def extract_relevant_urls(url,api_key):
-    domain = urlparse(url).netloc 
-    base_url = f"https://{domain}"
-    formatted_urls = []
-    async with AsyncWebCrawler(verbose = True, log_level=logging.ERROR) as crawler:
-        result = await crawler.arun(
-            url=url,
-            extraction_strategy=LLMExtractionStrategy(
+# The links are read from the main content of the html, the LLM is only asked when that finds nothing.
+async def extract_relevant_urls(url,api_key,use_cache=True):
+    page = await fetch_page(url)
+    formatted_urls = await asyncio.to_thread(extract_content_links, page["html"], url, 5)
+    if formatted_urls:
+        print(formatted_urls)
+        return formatted_urls
+
+    print("No links found in the html, asking the LLM")
+    urls = await run_extraction(
+            url,
+            page["markdown"],
+            LLMExtractionStrategy(
                 provider='openai/gpt-4o-mini',
                 api_token=api_key,
                 schema= UrlSchema.model_json_schema(),
@@ -86,28 +232,27 @@ async def extract_relevant_urls(url,api_key):
                 }]
                 """
             ),
-            bypass_cache = True,
-            silent=True
-        )
-        urls = json.loads(result.extracted_content)
-        for article in urls:
-            article_url = article['url']
-            if article_url.startswith('/'):
-                article_url = f"{base_url}{article_url}"
-                # print(article_url)
+            use_cache=use_cache,
+            call_site='link_extraction'
+    )
+    for article in urls:
+        if 'url' not in article:
+            continue
+        article_url = resolve_link(article['url'], url)
+        if article_url and article_url not in formatted_urls:
             formatted_urls.append(article_url)
-        print(formatted_urls)
-        return formatted_urls
+    print(formatted_urls)
+    return formatted_urls[:5]
 
 # This function takes a url and returns a small summary
-async def write_small_summary(url):
-    async with AsyncWebCrawler(verbose = True) as crawler:
-        result = await crawler.arun(
-            url=url,
-            word_count_threshold=5,
-            extraction_strategy=LLMExtractionStrategy(
+async def write_small_summary(url,use_cache=True,api_key=None):
+    page = await fetch_page(url)
+    content_blocks = await run_extraction(
+            url,
+            page["markdown"],
+            LLMExtractionStrategy(
                 provider='openai/gpt-4o-mini',
-                api_token=os.getenv('OPENAI_API_KEY'),
+                api_token=api_key or os.getenv('OPENAI_API_KEY'),
                 instruction="""You are tasked with creating a concise summary of the provided webpage content.
 
 INSTRUCTIONS:
@@ -129,34 +274,48 @@ GUIDELINES:
 FORMAT:
 Return only the summary text, with no additional headers or metadata."""
             ),
-            bypass_cache = True
-        )
-        
-        content_blocks = json.loads(result.extracted_content)
-        formatted_article = []
-        for block in content_blocks:
-            if 'content' in block:
-                formatted_article.extend(block['content'])
+            use_cache=use_cache,
+            call_site='summary'
+    )
     
-        summary = "\n\n".join(formatted_article)
-        return summary.strip()
+    formatted_article = []
+    for block in content_blocks:
+        if 'content' in block:
+            formatted_article.extend(block['content'])
+
+    summary = "\n\n".join(formatted_article)
+    return summary.strip()
 
 # This function takes the url and returns a dictionary of all relevant URLs and their Summary. 
-async def get_summaries_of_urls(url:str,api_key:str) -> dict:
+# The summaries run concurrently, at most max_concurrency (SUMMARY_CONCURRENCY) at a time, and the dictionary keeps the order of the links.
+# If a timings list is passed, the duration of every single summary is appended to it so that slow ones show up in the trace.
+async def get_summaries_of_urls(url:str,api_key:str,timings:list = None,max_concurrency:int = None) -> dict:
     urls = await extract_relevant_urls(url,api_key)
+    semaphore = asyncio.Semaphore(max_concurrency or int(os.environ.get('SUMMARY_CONCURRENCY', 5)))
+
+    async def summarise(article_url):
+        async with semaphore:
+            step_start = time.time()
+            try:
+                summary = await write_small_summary(article_url,api_key=api_key)
+                success = True
+            except Exception as e:
+                print(f"Error processing {article_url}: {str(e)}")
+                summary = "Error: Could not generate summary"
+                success = False
+            return summary, {"url": article_url, "duration": time.time() - step_start, "success": success}
+
+    results = await asyncio.gather(*(summarise(article_url) for article_url in urls))
     summaries = {}
-    for article_url in urls:
-        try:
-            summary = await write_small_summary(article_url)
-            summaries[article_url]= summary
-        except Exception as e:
-            print(f"Error processing {article_url}: {str(e)}")
-            summaries[article_url] = "Error: Could not generate summary"
+    for article_url, (summary, timing) in zip(urls, results):
+        summaries[article_url] = summary
+        if timings is not None:
+            timings.append(timing)
     return summaries
 
 # This function takes a dictionary from get_summaries_of_urls and returns a string in nice format to passed into another prompt
-async def get_formatted_summaries(url: str,api_key:str) -> str:
-    summaries = await get_summaries_of_urls(url,api_key)
+async def get_formatted_summaries(url: str,api_key:str,timings:list = None) -> str:
+    summaries = await get_summaries_of_urls(url,api_key,timings=timings)
     formatted_output = []
     for index, (url, summary) in enumerate(summaries.items(), 1):
         article_block = f"""**Article: {index}**
@@ -170,11 +329,18 @@ Content: {summary}
     return "\n".join(formatted_output)
 
 # This function takes a url and returns all the articles depicted in the url, url might be the techrunch main page.
-async def extract_all_articles_from_page(url:str,api_key) -> dict:
-    async with AsyncWebCrawler(verbose=False, log_level=logging.ERROR) as crawler:
-        result = await crawler.arun(
-            url=url,
-            extraction_strategy=LLMExtractionStrategy(
+# The article links are read from the html structure first, the LLM is only asked when that finds nothing.
+async def extract_all_articles_from_page(url:str,api_key,use_cache=True) -> dict:
+    page = await fetch_page(url)
+    article_dict = await asyncio.to_thread(extract_article_links, page["html"], url)
+    if article_dict:
+        return article_dict
+
+    print("No article links found in the html, asking the LLM")
+    articles = await run_extraction(
+            url,
+            page["markdown"],
+            LLMExtractionStrategy(
                 provider='openai/gpt-4o-mini',
                 api_token=api_key,
                 schema=UrlSchema.model_json_schema(),
@@ -205,24 +371,20 @@ Example output:
     "title": "Second Article Title"
 }]"""
             ),
-            bypass_cache=True,
-            silent=True
-        )
-        # Parse the results
-        articles = json.loads(result.extracted_content)
+            use_cache=use_cache,
+            call_site='blog_extraction'
+    )
+    
+    # Process URLs to ensure they're absolute
+    for article in articles:
+        if 'url' not in article:
+            continue
+        # Convert relative URLs to absolute
+        article_url = resolve_link(article['url'], url)
+        if article_url:
+            article_dict[article_url] = article.get('title', '')
         
-        # Process URLs to ensure they're absolute
-        domain = urlparse(url).netloc
-        base_url = f"https://{domain}"
-        article_dict = {}
-        for article in articles:
-            article_url = article['url']
-            # Convert relative URLs to absolute
-            if article_url.startswith('/'):
-                article_url = f"{base_url}{article_url}"
-            article_dict[article_url] = article['title']
-            
-        return article_dict
+    return article_dict
 
 async def main():
     articles = await extract_all_articles_from_page('https://www.snowflake.com/en/blog/')
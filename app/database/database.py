@@ -1,27 +1,79 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 import os
 from dotenv import load_dotenv
+from .pool import pool_options, async_pool_options, instrument_engine
 
 load_dotenv()
 
 SQLALCHEMY_DATABASE_URL = f"sqlite:////Users/anastasiosanastasiadis/Desktop/coding/build_audience/instance/prompts.db"
 DATABASE_URL = os.environ.get('DATABASE_URL')
-# Create engine
+# Create engine, the pool is sized from the environment (see app/database/pool.py)
 engine = create_engine(
-    DATABASE_URL
+    DATABASE_URL,
+    **pool_options(DATABASE_URL)
 )
+instrument_engine(engine)
 
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# The async paths (the pipeline, the job runner and the async views) use an async engine on the same database:
+# asyncpg for Postgres and aiosqlite for SQLite, so a query waits on the event loop instead of blocking it.
+# Its connections belong to the loop that opened them, every async path of a worker runs on its background loop (see app/event_loop.py).
+_async_engine = None
+_async_session_factory = None
+_async_pid = None
+
+# This function turns the url of the sync engine into the url of its async driver.
+def async_database_url(database_url: str) -> str:
+    url = make_url(database_url)
+    if url.get_backend_name() == 'postgresql':
+        url = url.set(drivername='postgresql+asyncpg')
+        # asyncpg takes ssl where libpq takes sslmode
+        if 'sslmode' in url.query:
+            query = dict(url.query)
+            query['ssl'] = query.pop('sslmode')
+            url = url.set(query=query)
+    elif url.get_backend_name() == 'sqlite':
+        url = url.set(drivername='sqlite+aiosqlite')
+    return url.render_as_string(hide_password=False)
+
+# This function returns the async engine of the current worker, creating it on first use.
+# Behind a transaction pooler (pgbouncer, the Supabase pooler on port 6543) asyncpg can't keep prepared statements, set DB_ASYNC_STATEMENT_CACHE_SIZE=0 there.
+def get_async_engine():
+    global _async_engine, _async_session_factory, _async_pid
+    if _async_engine is None or _async_pid != os.getpid():
+        connect_args = {}
+        if make_url(DATABASE_URL).get_backend_name() == 'postgresql':
+            connect_args["statement_cache_size"] = int(os.environ.get('DB_ASYNC_STATEMENT_CACHE_SIZE', 100))
+        _async_engine = create_async_engine(async_database_url(DATABASE_URL), connect_args=connect_args, **async_pool_options(DATABASE_URL))
+        instrument_engine(_async_engine.sync_engine)
+        _async_session_factory = async_sessionmaker(_async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+        _async_pid = os.getpid()
+    return _async_engine
+
+# This function opens a session on the async engine, the async counterpart of SessionLocal: async with AsyncSessionLocal() as db: ...
+def AsyncSessionLocal() -> AsyncSession:
+    get_async_engine()
+    return _async_session_factory()
+
+# This function closes the connections of the async engine, it has to be awaited on the loop that uses them.
+async def dispose_async_engine() -> None:
+    global _async_engine
+    if _async_engine is not None and _async_pid == os.getpid():
+        await _async_engine.dispose()
+    _async_engine = None
+
 # 1. Create the base
 Base = declarative_base()
 
 def init_db():
     # Import models here to ensure they are known to SQLAlchemy
-    from .models import Prompt, User, Profile, OnlineArticles
+    from .models import Prompt, User, Profile, OnlineArticles, Job, ProfileEmbedding
     Base.metadata.create_all(bind=engine)
 
 def get_db():
@@ -29,4 +81,18 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# This function returns the session of the current Flask request. It is only opened when a request needs it
+# and close_request_db, registered as a teardown in create_app, closes it once the request is over.
+def get_request_db():
+    from flask import g
+    if 'db' not in g:
+        g.db = SessionLocal()
+    return g.db
+
+def close_request_db(exception=None):
+    from flask import g
+    db = g.pop('db', None)
+    if db is not None:
+        db.close()
@@ -1,12 +1,14 @@
-from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, Float, String, Text, Boolean, Date, DateTime, ForeignKey, LargeBinary, UniqueConstraint, Index
 from .database import Base
 from datetime import datetime, timezone
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 from sqlalchemy.orm import relationship 
+from ..url_utils import normalize_url
 
 class Prompt(Base):
     __tablename__ = 'prompts'
+    __table_args__ = (Index('ix_prompts_user_id_type', 'user_id', 'type'),)
 
     id = Column(Integer, primary_key=True)
     type = Column(Integer,nullable=False)
@@ -16,6 +18,8 @@ class Prompt(Base):
     template = Column(Text, nullable=False)
     input_variables = Column(Text, nullable=True)  # Stored as JSON string
     is_active = Column(Boolean, default=True)
+    # Bumped on every edit, the prompt caches of the workers compare it instead of the template
+    version = Column(Integer, nullable=False, default=1, server_default='1')
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), 
                        onupdate=lambda: datetime.now(timezone.utc))
@@ -23,6 +27,7 @@ class Prompt(Base):
     
 class Profile(Base):
     __tablename__ = 'profiles'
+    __table_args__ = (Index('ix_profiles_user_id', 'user_id'),)
 
     # Primary Data
     id = Column(Integer,primary_key=True)
@@ -35,21 +40,89 @@ class Profile(Base):
     updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc),
                        onupdate=lambda: datetime.now(timezone.utc))
     user = relationship('User',back_populates='profile')
+
+class ProfileEmbedding(Base):
+    __tablename__ = 'profile_embeddings'
+    __table_args__ = (UniqueConstraint('profile_id', 'embedder'),)
+
+    id = Column(Integer,primary_key=True)
+    profile_id = Column(Integer, ForeignKey('profiles.id'), nullable=False)
+    embedder = Column(String(100), nullable=False) # Name of the embedding backend, vectors of different backends can't be compared
+    dimensions = Column(Integer, nullable=False)
+    vector = Column(LargeBinary, nullable=False) # float32 array
+    text_hash = Column(String(64), nullable=False) # sha256 of the interests description the vector was made from
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc),
+                       onupdate=lambda: datetime.now(timezone.utc))
     
 class OnlineArticles(Base):
     __tablename__ = 'online_articles'
+    __table_args__ = (
+        UniqueConstraint('user_id', 'normalized_url', name='uq_online_articles_user_normalized_url'),
+        # Serves the newest-first pages of /processed-articles, id breaks the ties between rows created at the same time
+        Index('ix_online_articles_user_id_created_at', 'user_id', 'created_at', 'id'),
+    )
 
     id = Column(Integer,primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     url = Column(String(500),nullable=False)
+    normalized_url = Column(String(500), nullable=False,
+                            default=lambda context: normalize_url(context.get_current_parameters()['url'])) # One row per user and article, see app/url_utils.py
     title = Column(Text,nullable=True)
     source_blog = Column(String(200), nullable=True)
     profile_fit = Column(Boolean,nullable=True) # Does it fit the user profile or not?
+    fit_source = Column(String(20), nullable=True) # Who decided profile_fit: title, prefilter, llm, or error when the comparison failed
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), 
                        onupdate=lambda: datetime.now(timezone.utc))
     user = relationship('User', back_populates='online_articles')
 
+class Job(Base):
+    __tablename__ = 'jobs'
+
+    id = Column(Integer,primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    kind = Column(String(50), nullable=False) # process_url or process_blog
+    url = Column(String(500), nullable=False)
+    status = Column(String(20), nullable=False, default='queued') # queued, running, success or error
+    current_step = Column(String(100), nullable=True)
+    steps = Column(Text, nullable=True) # Stored as JSON string, one entry per finished pipeline step
+    result = Column(Text, nullable=True) # Stored as JSON string
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0, nullable=False)
+    worker_id = Column(String(100), nullable=True) # The worker process that is running the job
+    heartbeat_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    user = relationship('User', back_populates='jobs')
+
+class JobTweet(Base):
+    __tablename__ = 'job_tweets'
+    __table_args__ = (UniqueConstraint('job_id', 'position', name='uq_job_tweets_job_id_position'),)
+
+    # One row per tweet a running job has streamed so far, a new tweet is an insert instead of a rewrite of the job (see record_job_tweet)
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey('jobs.id'), nullable=False)
+    position = Column(Integer, nullable=False) # 0 for the first tweet of the job
+    text = Column(Text, nullable=False)
+
+class LLMUsage(Base):
+    __tablename__ = 'llm_usage'
+    __table_args__ = (UniqueConstraint('user_id', 'day', 'call_site', 'model', name='uq_llm_usage_user_day_call_site_model'),)
+
+    # One row per user, day, pipeline step and model, the calls are added up in it (see app/usage.py)
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    day = Column(Date, nullable=False) # UTC
+    call_site = Column(String(50), nullable=False) # The pipeline step that made the calls, e.g. generation, comparison, summary
+    model = Column(String(100), nullable=False)
+    calls = Column(Integer, nullable=False, default=0)
+    cached_calls = Column(Integer, nullable=False, default=0) # Answered by the LLM cache, they cost nothing
+    prompt_tokens = Column(BigInteger, nullable=False, default=0)
+    completion_tokens = Column(BigInteger, nullable=False, default=0)
+    cost = Column(Float, nullable=False, default=0.0) # USD, from the prices in app/usage.py
+    user = relationship('User', back_populates='llm_usage')
+
 class User(Base,UserMixin):
     __tablename__ = 'users'
 
@@ -62,7 +135,10 @@ class User(Base,UserMixin):
     profile = relationship('Profile',back_populates='user', uselist=False)
     prompts = relationship('Prompt',back_populates='user')
     online_articles = relationship('OnlineArticles', back_populates='user')
+    jobs = relationship('Job', back_populates='user')
     is_onboarded = Column(Boolean,default=False,nullable=True)
+    monthly_budget = Column(Float, nullable=True) # USD of LLM usage per calendar month, no limit when empty
+    llm_usage = relationship('LLMUsage', back_populates='user')
         
     def set_password(self, password, method='pbkdf2:sha256'):
         self.password_hash = generate_password_hash(password, method=method)
@@ -0,0 +1,154 @@
+import os
+import threading
+import time
+import traceback
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from app.metrics import DB_POOL_WAIT_SECONDS, DB_POOL_TIMEOUTS_TOTAL, DB_POOL_CHECKED_OUT, DB_POOL_LEAKED
+
+# Upper bounds (in seconds) of the buckets of the checkout wait histogram, the last bucket takes everything above
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, float('inf'))
+
+# This class collects the health of the connection pool of the worker: how long checkouts waited for a connection,
+# how many connections are out, and which connections have been out for longer than DB_POOL_LEAK_AFTER seconds.
+# The waits, timeouts, connections out and leaks also go to the Prometheus metrics (app/metrics.py), /debug/db-pool has the details.
+# Formatting the stack of every checkout costs something on every query, so the stack of the code that took a leaked connection
+# is only kept when DB_POOL_TRACK_STACKS is set, turn it on while hunting a leak.
+class PoolStats:
+    def __init__(self) -> None:
+        self.leak_after = float(os.environ.get('DB_POOL_LEAK_AFTER', 30))
+        self.track_stacks = os.environ.get('DB_POOL_TRACK_STACKS', 'false').lower() in ('1', 'true', 'yes')
+        self.lock = threading.Lock()
+        self.wait_counts = [0] * len(WAIT_BUCKETS)
+        self.wait_sum = 0.0
+        self.wait_max = 0.0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.checked_out = {}
+
+    def record_wait(self, seconds: float, timed_out: bool = False) -> None:
+        with self.lock:
+            for index, bound in enumerate(WAIT_BUCKETS):
+                if seconds <= bound:
+                    self.wait_counts[index] += 1
+                    break
+            self.wait_sum += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+        DB_POOL_WAIT_SECONDS.observe(seconds)
+        if timed_out:
+            DB_POOL_TIMEOUTS_TOTAL.inc()
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy) -> None:
+        # The frames of SQLAlchemy itself are left out, the interesting part is the code that opened the session
+        stack = None
+        if self.track_stacks:
+            stack = [frame for frame in traceback.format_stack(limit=40)[:-1] if '/sqlalchemy/' not in frame][-8:]
+        with self.lock:
+            self.checkouts += 1
+            self.checked_out[id(connection_record)] = {
+                "since": time.monotonic(),
+                "thread": threading.current_thread().name,
+                "stack": stack
+            }
+        DB_POOL_CHECKED_OUT.inc()
+        self.update_leak_gauge()
+
+    def on_checkin(self, dbapi_connection, connection_record) -> None:
+        with self.lock:
+            checkout = self.checked_out.pop(id(connection_record), None)
+        if checkout is not None:
+            DB_POOL_CHECKED_OUT.dec()
+            self.update_leak_gauge()
+
+    # This method sets the leak gauge of the worker, it is called on every checkout and checkin and before a scrape.
+    def update_leak_gauge(self) -> None:
+        now = time.monotonic()
+        with self.lock:
+            leaked = sum(1 for checkout in self.checked_out.values() if now - checkout["since"] > self.leak_after)
+        DB_POOL_LEAKED.set(leaked)
+
+    # This method returns the connections that have been checked out for longer than leak_after seconds.
+    def leaks(self) -> list:
+        now = time.monotonic()
+        with self.lock:
+            return sorted([
+                {"age": now - checkout["since"], "thread": checkout["thread"], "stack": "".join(checkout["stack"] or [])}
+                for checkout in self.checked_out.values()
+                if now - checkout["since"] > self.leak_after
+            ], key=lambda leak: -leak["age"])
+
+    def stats(self, pool=None) -> dict:
+        with self.lock:
+            waits = sum(self.wait_counts)
+            result = {
+                "checkouts": self.checkouts,
+                "checked_out": len(self.checked_out),
+                "timeouts": self.timeouts,
+                "wait_avg": self.wait_sum / waits if waits else 0.0,
+                "wait_max": self.wait_max,
+                "wait_histogram": {
+                    ("+Inf" if bound == float('inf') else str(bound)): count
+                    for bound, count in zip(WAIT_BUCKETS, self.wait_counts)
+                }
+            }
+        if pool is not None and hasattr(pool, 'size'):
+            result.update({"pool_size": pool.size(), "overflow": pool.overflow(), "idle": pool.checkedin(), "status": pool.status()})
+        result["leaks"] = self.leaks()
+        return result
+
+pool_stats = PoolStats()
+
+# This class makes a pool measure how long every checkout waits for a free connection.
+class _TimedCheckout:
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            pool_stats.record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_stats.record_wait(time.perf_counter() - started)
+        return connection
+
+class InstrumentedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+# The same for the pool of the async engine
+class InstrumentedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+# This function returns the engine arguments of the connection pool, from the environment.
+# Every gunicorn worker has its own pool: DB_POOL_SIZE should cover its request threads plus the job executors (JOB_CONCURRENCY),
+# and workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW + DB_ASYNC_POOL_SIZE + DB_ASYNC_MAX_OVERFLOW) has to stay under the connection limit of the database.
+# SQLite doesn't need any of it and keeps the defaults of SQLAlchemy.
+def pool_options(database_url: str) -> dict:
+    if not database_url or database_url.startswith('sqlite'):
+        return {}
+    return {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": int(os.environ.get('DB_POOL_SIZE', 10)),
+        "max_overflow": int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        "pool_timeout": float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        "pool_recycle": int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        "pool_pre_ping": os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+    }
+
+# This function hooks the checkout and checkin events of an engine up to the pool stats.
+def instrument_engine(engine) -> None:
+    event.listen(engine, 'checkout', pool_stats.on_checkout)
+    event.listen(engine, 'checkin', pool_stats.on_checkin)
+
+# This function returns the engine arguments of the pool of the async engine. It only serves the pipeline (one event loop per worker),
+# so it is sized separately and smaller, with DB_ASYNC_POOL_SIZE and DB_ASYNC_MAX_OVERFLOW.
+def async_pool_options(database_url: str) -> dict:
+    options = pool_options(database_url)
+    if not options:
+        return {}
+    options.update({
+        "poolclass": InstrumentedAsyncQueuePool,
+        "pool_size": int(os.environ.get('DB_ASYNC_POOL_SIZE', 5)),
+        "max_overflow": int(os.environ.get('DB_ASYNC_MAX_OVERFLOW', 5))
+    })
+    return options
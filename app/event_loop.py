@@ -0,0 +1,134 @@
+import asyncio
+import contextvars
+import os
+import sys
+import threading
+import time
+import traceback
+
+# Every gunicorn worker gets one long-lived event loop running in a daemon thread.
+# Objects that are bound to a loop (the headless browser, queues, semaphores) live on it,
+# while Flask views and async_to_sync calls (which each spin up a short-lived loop) hand work over to it.
+# Under the ASGI app (app/asgi.py) the loop of the server itself is adopted instead, so there is a single loop per worker.
+_loop = None
+_thread = None
+_pid = None
+_monitor = None
+_lock = threading.Lock()
+
+# This class watches an event loop from a thread of its own and reports when the loop is blocked, i.e. when something on it
+# runs synchronous work (a database query, an LLM call without await, a big parse) instead of awaiting it.
+# Every interval it schedules a callback on the loop; if the loop doesn't get to it within threshold seconds, it prints
+# what the loop thread is running at that moment and, once the loop is back, for how long it was blocked.
+# It is meant for development (LOOP_BLOCK_MONITOR, set by gunicorn_dev.conf.py and run.py), see start_loop_monitor.
+class LoopBlockMonitor:
+    def __init__(self, loop: asyncio.AbstractEventLoop, thread_id: int, threshold: float = None, interval: float = None) -> None:
+        self.loop = loop
+        self.thread_id = thread_id
+        self.threshold = threshold or float(os.environ.get('LOOP_BLOCK_THRESHOLD', 0.1))
+        self.interval = interval or float(os.environ.get('LOOP_BLOCK_INTERVAL', 0.5))
+        self.blocks = 0
+        self.longest = 0.0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._watch, name='loop-block-monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.interval):
+            answered = threading.Event()
+            sent = time.monotonic()
+            try:
+                self.loop.call_soon_threadsafe(answered.set)
+            except RuntimeError:
+                # The loop was closed
+                return
+            if answered.wait(self.threshold):
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+            while not answered.wait(1):
+                if self._stopped.is_set() or self.loop.is_closed():
+                    return
+            blocked = time.monotonic() - sent
+            self.blocks += 1
+            self.longest = max(self.longest, blocked)
+            print(f"Event loop blocked for {blocked:.3f}s (threshold {self.threshold}s), it was running:\n{stack}")
+
+# This function starts the block monitor of the background loop when LOOP_BLOCK_MONITOR is set, it is called with _lock held.
+def _start_loop_monitor(thread_id: int) -> None:
+    global _monitor
+    if _monitor is not None:
+        _monitor.stop()
+        _monitor = None
+    if os.environ.get('LOOP_BLOCK_MONITOR', 'false').lower() in ('1', 'true', 'yes'):
+        _monitor = LoopBlockMonitor(_loop, thread_id)
+        _monitor.start()
+
+# This function returns the background loop of the current process, starting it on first use.
+def get_background_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _thread, _pid
+    with _lock:
+        # A forked worker inherits the parent's loop object but not its thread, so we start a fresh one.
+        if _loop is None or _loop.is_closed() or _pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _thread = threading.Thread(target=_loop.run_forever, name='background-event-loop', daemon=True)
+            _thread.start()
+            _pid = os.getpid()
+            _start_loop_monitor(_thread.ident)
+        return _loop
+
+# This function makes a loop that is already running (the loop of the ASGI server) the background loop of the process.
+# An adopted loop isn't ours to stop, stop_background_loop leaves it alone. It has to be called from the thread that runs the loop.
+def adopt_background_loop(loop: asyncio.AbstractEventLoop) -> None:
+    global _loop, _thread, _pid
+    with _lock:
+        _loop = loop
+        _thread = None
+        _pid = os.getpid()
+        _start_loop_monitor(threading.get_ident())
+
+# This function tells us whether the caller is already running on the background loop.
+def in_background_loop() -> bool:
+    try:
+        return asyncio.get_running_loop() is _loop
+    except RuntimeError:
+        return False
+
+# The coroutine runs in a copy of the context of the caller, so context variables (the Flask request, the user whose usage is recorded) go along with it
+async def _in_context(context: contextvars.Context, coro):
+    return await context.run(asyncio.ensure_future, coro)
+
+def _submit(coro):
+    return asyncio.run_coroutine_threadsafe(_in_context(contextvars.copy_context(), coro), get_background_loop())
+
+# This function runs a coroutine on the background loop and can be awaited from any other loop.
+async def run_in_background(coro):
+    if in_background_loop():
+        return await coro
+    return await asyncio.wrap_future(_submit(coro))
+
+# This function runs a coroutine on the background loop and blocks the calling (synchronous) thread until it is done.
+def run_sync(coro, timeout: float = None):
+    if in_background_loop():
+        raise RuntimeError("run_sync can't be called from the background loop, await the coroutine instead")
+    return _submit(coro).result(timeout=timeout)
+
+# This function stops the background loop, it is called when the worker exits.
+def stop_background_loop():
+    global _loop, _thread, _monitor
+    with _lock:
+        if _monitor is not None:
+            _monitor.stop()
+            _monitor = None
+        if _loop is not None and _thread is not None and not _loop.is_closed() and _pid == os.getpid():
+            _loop.call_soon_threadsafe(_loop.stop)
+            _thread.join(timeout=5)
+            _loop.close()
+        _loop = None
+        _thread = None
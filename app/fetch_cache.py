@@ -0,0 +1,69 @@
+import os
+import time
+import aiohttp
+from app.sqlite_cache import SQLiteLRUCache
+from app.url_utils import normalize_url
+
+# This class stores the rendered pages we crawled, keyed on the normalised url.
+# Entries younger than the TTL are served as they are. Older entries are revalidated with a conditional GET
+# (If-None-Match / If-Modified-Since) and only re-rendered when the server says the page changed.
+class FetchCache:
+    def __init__(self, path: str = None, ttl: int = None, max_mb: int = None) -> None:
+        self.ttl = ttl if ttl is not None else int(os.environ.get('FETCH_CACHE_TTL', 1800))
+        max_mb = max_mb if max_mb is not None else int(os.environ.get('FETCH_CACHE_MAX_MB', 500))
+        self.store = SQLiteLRUCache(
+            path or os.environ.get('FETCH_CACHE_PATH', 'instance/fetch_cache.db'),
+            table='fetched_pages',
+            max_bytes=max_mb * 1024 * 1024
+        )
+
+    def get(self, url: str):
+        return self.store.get(normalize_url(url))
+
+    # This method stores a freshly rendered page together with the validators the server sent.
+    def put(self, url: str, html: str, markdown: str, response_headers: dict = None) -> dict:
+        headers = {key.lower(): value for key, value in (response_headers or {}).items()}
+        entry = {
+            "url": url,
+            "html": html,
+            "markdown": markdown,
+            "fetched_at": time.time(),
+            "etag": headers.get('etag'),
+            "last_modified": headers.get('last-modified')
+        }
+        self.store.set(normalize_url(url), entry)
+        return entry
+
+    def is_fresh(self, entry: dict) -> bool:
+        return time.time() - entry["fetched_at"] < self.ttl
+
+    # This method asks the server whether a stale entry is still valid. If it is, the entry is marked fresh again and True is returned.
+    async def revalidate(self, url: str, entry: dict) -> bool:
+        headers = {}
+        if entry.get("etag"):
+            headers['If-None-Match'] = entry["etag"]
+        if entry.get("last_modified"):
+            headers['If-Modified-Since'] = entry["last_modified"]
+        if not headers:
+            return False
+        try:
+            timeout = aiohttp.ClientTimeout(total=10)
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                async with session.get(url, headers=headers, allow_redirects=True) as response:
+                    if response.status != 304:
+                        return False
+        except Exception as e:
+            print(f"Error revalidating {url}: {str(e)}")
+            return False
+        entry["fetched_at"] = time.time()
+        self.store.set(normalize_url(url), entry)
+        return True
+
+_fetch_cache = None
+
+# This function returns the fetch cache of the current worker.
+def get_fetch_cache() -> FetchCache:
+    global _fetch_cache
+    if _fetch_cache is None:
+        _fetch_cache = FetchCache()
+    return _fetch_cache
@@ -1,6 +1,6 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, SubmitField, TextAreaField, PasswordField
-from wtforms.validators import DataRequired, URL, Length, Email, EqualTo
+from wtforms import StringField, SubmitField, TextAreaField, PasswordField, DecimalField
+from wtforms.validators import DataRequired, URL, Length, Email, EqualTo, Optional, NumberRange
 
 class UrlSubmit(FlaskForm):
     url = StringField('Url',validators=[DataRequired(),URL()])
@@ -51,4 +51,8 @@ class RegistrationForm(FlaskForm):
 
 class SettingsForm(FlaskForm):
     openai_api_key = StringField('OpenAI API Key', validators=[DataRequired()])
-    submit = SubmitField('Update Settings')
\ No newline at end of file
+    submit = SubmitField('Update Settings')
+
+class BudgetForm(FlaskForm):
+    monthly_budget = DecimalField('Monthly LLM budget (USD)', places=2, validators=[Optional(), NumberRange(min=0)])
+    save_budget = SubmitField('Save Budget')
\ No newline at end of file
@@ -0,0 +1,75 @@
+import asyncio
+import json
+import os
+import time
+from app.api.job_operations import get_job_progress
+
+# This function formats one server-sent event.
+def format_sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# This function returns how many steps and tweets of a job the browser already has: a reconnecting browser sends the id of the last event it got,
+# otherwise the page tells how many it was rendered with.
+def parse_event_position(last_event_id: str, steps: int = 0, tweets: int = 0) -> tuple:
+    try:
+        sent_steps, sent_tweets = [int(part) for part in (last_event_id or '').split('-')]
+        return sent_steps, sent_tweets
+    except ValueError:
+        return steps or 0, tweets or 0
+
+# This class produces the progress of a job as server-sent events: a "step" for every finished step, "current" for the step that is running,
+# a "tweet" for every tweet as soon as it is generated and "done" once the job has finished.
+# The job is read every JOB_EVENTS_INTERVAL seconds while it produces events, the wait doubles up to JOB_EVENTS_MAX_INTERVAL seconds while nothing changes.
+# It gives up after timeout (JOB_EVENTS_TIMEOUT) seconds, the browser reconnects by itself and gets only the events it hasn't seen yet.
+# The Flask route iterates it in its request thread, the ASGI app iterates it asynchronously so that a waiting stream doesn't hold a thread.
+class JobEventStream:
+    def __init__(self, job_id: int, user_id: int, sent_steps: int = 0, sent_tweets: int = 0, timeout: int = None) -> None:
+        self.job_id = job_id
+        self.user_id = user_id
+        self.sent_steps = sent_steps
+        self.sent_tweets = sent_tweets
+        self.current_step = None
+        self.finished = False
+        self.timeout = timeout if timeout is not None else int(os.environ.get('JOB_EVENTS_TIMEOUT', 300))
+        self.interval = float(os.environ.get('JOB_EVENTS_INTERVAL', 0.5))
+        self.max_interval = float(os.environ.get('JOB_EVENTS_MAX_INTERVAL', 5))
+        self.delay = self.interval
+
+    # This method reads the progress of the job once and returns the events the browser hasn't seen yet.
+    def poll(self) -> list:
+        job = get_job_progress(self.job_id, self.user_id, self.sent_tweets)
+        if job is None:
+            self.finished = True
+            return []
+        events = []
+        for step in job["steps"][self.sent_steps:]:
+            self.sent_steps += 1
+            events.append(f"id: {self.sent_steps}-{self.sent_tweets}\n" + format_sse('step', step))
+        for tweet in job["tweets"]:
+            self.sent_tweets += 1
+            events.append(f"id: {self.sent_steps}-{self.sent_tweets}\n" + format_sse('tweet', {"index": self.sent_tweets, "text": tweet}))
+        if job["current_step"] != self.current_step:
+            self.current_step = job["current_step"]
+            events.append(format_sse('current', {"name": self.current_step}))
+        if job["status"] in ('success', 'error'):
+            events.append(format_sse('done', {"status": job["status"], "error": job["error"]}))
+            self.finished = True
+        self.delay = self.interval if events else min(self.delay * 2, self.max_interval)
+        return events
+
+    def __iter__(self):
+        deadline = time.time() + self.timeout
+        while time.time() < deadline:
+            yield from self.poll()
+            if self.finished:
+                return
+            time.sleep(self.delay)
+
+    async def __aiter__(self):
+        deadline = time.time() + self.timeout
+        while time.time() < deadline:
+            for event in await asyncio.to_thread(self.poll):
+                yield event
+            if self.finished:
+                return
+            await asyncio.sleep(self.delay)
@@ -0,0 +1,149 @@
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime
+from app.event_loop import get_background_loop, run_sync
+from app.api.job_operations import (
+    create_job, claim_next_job, record_job_progress, record_job_tweet, finish_job, heartbeat_jobs, requeue_jobs
+)
+from app.metrics import JOB_QUEUE_WAIT_SECONDS, record_error
+
+# This class runs the queued jobs of the database on the background loop of the worker.
+# A few executors take jobs one at a time, report the progress of every pipeline step back to the job row,
+# and send heartbeats so that the jobs of a worker that died are picked up again by the others.
+class JobRunner:
+    def __init__(self, concurrency: int = None, poll_interval: float = None) -> None:
+        self.concurrency = concurrency or int(os.environ.get('JOB_CONCURRENCY', 3))
+        self.poll_interval = poll_interval or float(os.environ.get('JOB_POLL_INTERVAL', 2))
+        self.heartbeat_interval = int(os.environ.get('JOB_HEARTBEAT_INTERVAL', 30))
+        self.stale_after = int(os.environ.get('JOB_STALE_AFTER', 180))
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._running_jobs = set()
+        self._tasks = []
+        self._wakeup = None
+        self._started = False
+
+    # This method starts the executors on the background loop, calling it again does nothing.
+    def start(self) -> None:
+        if self._started:
+            return
+        self._started = True
+        asyncio.run_coroutine_threadsafe(self._start(), get_background_loop())
+
+    async def _start(self) -> None:
+        self._wakeup = asyncio.Event()
+        requeued = await asyncio.to_thread(requeue_jobs, None, self.stale_after)
+        if requeued:
+            print(f"Requeued {requeued} jobs of workers that stopped responding")
+        self._tasks = [asyncio.create_task(self._executor()) for _ in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+    # This method wakes the executors up, so a job that was just submitted doesn't wait for the next poll.
+    def notify(self) -> None:
+        if self._wakeup is not None:
+            get_background_loop().call_soon_threadsafe(self._wakeup.set)
+
+    async def _executor(self) -> None:
+        while True:
+            job = await asyncio.to_thread(claim_next_job, self.worker_id)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if job["created_at"] and job["started_at"]:
+                # Both are UTC, whether the database kept the timezone or not
+                waited = datetime.fromisoformat(job["started_at"]).replace(tzinfo=None) - datetime.fromisoformat(job["created_at"]).replace(tzinfo=None)
+                JOB_QUEUE_WAIT_SECONDS.labels(job["kind"]).observe(max(0.0, waited.total_seconds()))
+            self._running_jobs.add(job["id"])
+            try:
+                await self._execute(job)
+            finally:
+                self._running_jobs.discard(job["id"])
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            await asyncio.to_thread(heartbeat_jobs, list(self._running_jobs))
+            await asyncio.to_thread(requeue_jobs, None, self.stale_after)
+
+    # This method runs one job and stores its result.
+    async def _execute(self, job: dict) -> None:
+        # Imported here because the processors import half of the app
+        from app.processor_cache import get_processor_cache
+        from app.database.database import AsyncSessionLocal
+        from app.database.models import User
+
+        def progress(event: dict) -> None:
+            record_job_progress(job["id"], event)
+
+        async def report(event: dict) -> None:
+            await asyncio.to_thread(progress, event)
+
+        async def stream(tweet: str) -> None:
+            await asyncio.to_thread(record_job_tweet, job["id"], tweet)
+
+        try:
+            async with AsyncSessionLocal() as db:
+                user = await db.get(User, job["user_id"])
+            if user is None:
+                raise ValueError(f"No user found for user_id: {job['user_id']}")
+
+            if job["kind"] == 'process_url':
+                result = await get_processor_cache().get('content_processor', user).process_url(job["url"], progress=report, on_tweet=stream)
+                status = 'success' if result.get("status") == 'success' else 'error'
+                await asyncio.to_thread(finish_job, job["id"], status, result, result.get("message"))
+            elif job["kind"] == 'process_blog':
+                screening = {}
+                articles = await get_processor_cache().get('blog_handler', user).process_and_store_articles(job["url"], user.id, progress=report, stats=screening)
+                await asyncio.to_thread(finish_job, job["id"], 'success', {"articles": articles, "screening": screening})
+            else:
+                raise ValueError(f"Unknown job kind: {job['kind']}")
+        except Exception as e:
+            print(f"Error running job {job['id']}: {str(e)}")
+            record_error('job', e)
+            await asyncio.to_thread(finish_job, job["id"], 'error', None, str(e))
+
+    # This method stops the executors and puts the jobs that were still running back in the queue.
+    def stop(self) -> None:
+        if not self._started:
+            return
+        self._started = False
+
+        async def cancel():
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        try:
+            run_sync(cancel(), timeout=10)
+        except Exception as e:
+            print(f"Error stopping the job runner: {str(e)}")
+        requeue_jobs(worker_id=self.worker_id)
+
+_runner = None
+
+# This function returns the job runner of the current worker.
+def get_job_runner() -> JobRunner:
+    global _runner
+    if _runner is None:
+        _runner = JobRunner()
+    return _runner
+
+# This function queues a pipeline run for a user and returns the job id straight away.
+def enqueue_job(user_id: int, kind: str, url: str) -> int:
+    job_id = create_job(user_id, kind, url)
+    runner = get_job_runner()
+    runner.start()
+    runner.notify()
+    return job_id
+
+# This function stops the job runner of the current worker, gunicorn calls it from the worker_exit hook.
+def shutdown_job_runner() -> None:
+    global _runner
+    if _runner is not None:
+        _runner.stop()
+        _runner = None
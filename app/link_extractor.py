@@ -0,0 +1,81 @@
+import re
+from urllib.parse import urljoin, urlsplit, urlunsplit
+from app.readability import parse_html, find_main_container
+from app.url_utils import normalize_url
+
+# Path segments of listing and site pages, links that contain them are never articles
+NON_ARTICLE_SEGMENTS = {
+    'tag', 'tags', 'author', 'authors', 'category', 'categories', 'topic', 'topics', 'page', 'search',
+    'login', 'signin', 'signup', 'register', 'about', 'contact', 'privacy', 'terms', 'feed', 'rss', 'careers'
+}
+SKIPPED_SCHEMES = ('mailto:', 'javascript:', 'tel:', 'data:')
+
+# This function turns the href of an anchor into an absolute url (without the fragment), None if it can't be an article.
+def resolve_link(href: str, page_url: str):
+    href = (href or '').strip()
+    if not href or href.startswith('#') or href.lower().startswith(SKIPPED_SCHEMES):
+        return None
+    parts = urlsplit(urljoin(page_url, href))
+    if parts.scheme not in ('http', 'https'):
+        return None
+    segments = {segment.lower() for segment in parts.path.split('/') if segment}
+    if not segments or segments & NON_ARTICLE_SEGMENTS:
+        return None
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, parts.query, ''))
+
+def _site(url: str) -> str:
+    host = (urlsplit(url).hostname or '').lower()
+    return host[4:] if host.startswith('www.') else host
+
+# This function finds the best title for an anchor: a heading inside it, its text, its title/aria-label, or the heading of the card around it.
+def _link_title(anchor) -> str:
+    heading = anchor.find(re.compile(r'^h[1-6]$'))
+    for candidate in (heading, anchor):
+        if candidate is not None:
+            text = re.sub(r'\s+', ' ', candidate.get_text(' ', strip=True))
+            if text:
+                return text
+    for attribute in ('title', 'aria-label'):
+        if anchor.get(attribute):
+            return anchor[attribute].strip()
+    card = anchor.find_parent(['article', 'li', 'div'])
+    heading = card.find(re.compile(r'^h[1-6]$')) if card is not None else None
+    return re.sub(r'\s+', ' ', heading.get_text(' ', strip=True)) if heading is not None else ''
+
+# This function collects the links of a region as {url: title}, de-duplicated on the normalised url.
+# When the same url shows up twice (e.g. an image link and a title link) the longer title wins.
+def _collect_links(region, page_url: str, min_title_words: int, same_site: bool) -> dict:
+    page_key = normalize_url(page_url)
+    links = {}
+    keys = {}
+    for anchor in region.find_all('a', href=True):
+        url = resolve_link(anchor['href'], page_url)
+        if url is None or (same_site and _site(url) != _site(page_url)):
+            continue
+        key = normalize_url(url)
+        if key == page_key:
+            continue
+        title = _link_title(anchor)
+        if len(title.split()) < min_title_words:
+            continue
+        if key in keys:
+            if len(title) > len(links[keys[key]]):
+                links[keys[key]] = title
+            continue
+        keys[key] = url
+        links[url] = title
+    return links
+
+# This function takes the html of a blog index (or news homepage) and returns {url: title} for the articles it lists.
+# Navigation, footer, sidebar, tag, category and author links are dropped, and only links on the same site are kept.
+def extract_article_links(html: str, page_url: str) -> dict:
+    soup = parse_html(html)
+    region = soup.find('main') or soup.body or soup
+    return _collect_links(region, page_url, min_title_words=3, same_site=True)
+
+# This function takes the html of an article and returns the urls the article links to from its main content.
+def extract_content_links(html: str, page_url: str, limit: int = 5) -> list:
+    soup = parse_html(html)
+    region = find_main_container(soup)
+    links = _collect_links(region, page_url, min_title_words=1, same_site=False)
+    return list(links.keys())[:limit]
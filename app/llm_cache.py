@@ -0,0 +1,79 @@
+import hashlib
+import json
+import os
+from langchain_core.messages import AIMessage
+from app.sqlite_cache import SQLiteLRUCache
+
+# This class caches LLM responses by the hash of everything that determines them:
+# the model, the temperature and the full prompt (or the extraction instruction plus the page content).
+class LLMCache:
+    def __init__(self, path: str = None, max_entries: int = None) -> None:
+        self.store = SQLiteLRUCache(
+            path or os.environ.get('LLM_CACHE_PATH', 'instance/llm_cache.db'),
+            table='llm_responses',
+            max_entries=max_entries or int(os.environ.get('LLM_CACHE_MAX_ENTRIES', 20000))
+        )
+        self.hits = 0
+        self.misses = 0
+
+    # This method builds the cache key out of the model, the temperature and all the parts of the prompt.
+    @staticmethod
+    def make_key(model: str, temperature, *parts) -> str:
+        payload = json.dumps([model, temperature, *parts], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str):
+        value = self.store.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: dict) -> None:
+        self.store.set(key, value)
+
+    # This method returns the hit/miss counters of this worker together with the size of the cache.
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            **self.store.stats()
+        }
+
+_llm_cache = None
+
+# This function returns the LLM cache of the current worker.
+def get_llm_cache() -> LLMCache:
+    global _llm_cache
+    if _llm_cache is None:
+        _llm_cache = LLMCache()
+    return _llm_cache
+
+# This function looks a prompt | llm call up in the cache and returns (key, cached content).
+# The key is None when the call shouldn't be cached: by default only deterministic calls (temperature 0) are, use_cache=True/False forces it either way.
+def lookup_cached(llm, prompt_template, inputs: dict, use_cache: bool = None):
+    temperature = getattr(llm, 'temperature', None)
+    if use_cache is None:
+        use_cache = temperature == 0
+    if not use_cache:
+        return None, None
+    cache = get_llm_cache()
+    key = cache.make_key(llm.model_name, temperature, prompt_template.format(**inputs))
+    cached = cache.get(key)
+    return key, cached["content"] if cached is not None else None
+
+def store_cached(key: str, result) -> None:
+    if key is not None:
+        get_llm_cache().set(key, {"content": result.content if hasattr(result, 'content') else str(result)})
+
+# This function invokes a prompt | llm chain through the cache.
+def invoke_cached(chain, llm, prompt_template, inputs: dict, use_cache: bool = None):
+    key, cached = lookup_cached(llm, prompt_template, inputs, use_cache)
+    if cached is not None:
+        return AIMessage(content=cached)
+    result = chain.invoke(inputs)
+    store_cached(key, result)
+    return result
@@ -0,0 +1,297 @@
+import asyncio
+import hashlib
+import os
+import random
+import threading
+import time
+import weakref
+from collections import deque
+from email.utils import parsedate_to_datetime
+from app.llm_cache import lookup_cached, store_cached
+from app.metrics import LLM_CALL_SECONDS, LLM_QUEUE_WAIT_SECONDS, record_error
+from app.usage import record_usage
+
+# This function gives a rough token count of a text (about 4 characters per token for English).
+def estimate_tokens(text: str) -> int:
+    return len(text or '') // 4
+
+# Raised when a call came back rate limited without an exception, e.g. crawl4ai turns a 429 into an error block
+class RateLimitedError(Exception):
+    def __init__(self, message: str, retry_after: float = None) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def _status_code(error: Exception):
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status
+
+def _is_rate_limit(error: Exception) -> bool:
+    return isinstance(error, RateLimitedError) or _status_code(error) == 429 or 'RateLimit' in type(error).__name__
+
+# Rate limits, overloaded servers and dropped connections are worth another try, bad requests and auth errors aren't
+def _is_retryable(error: Exception) -> bool:
+    if _is_rate_limit(error):
+        return True
+    if _status_code(error) in (500, 502, 503, 504):
+        return True
+    return type(error).__name__ in ('APIConnectionError', 'APITimeoutError', 'Timeout', 'ServiceUnavailableError', 'InternalServerError')
+
+# This function reads how long the provider asked us to wait, in seconds, from the Retry-After(-ms) header of an error.
+def _retry_after(error: Exception):
+    if getattr(error, 'retry_after', None) is not None:
+        return float(error.retry_after)
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        value = headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+# This class is a token bucket that can be shared by threads and event loops. A caller reserves what it needs straight away
+# and is told how long to wait for it, so the callers are served in order and the rate stays smooth instead of bursting.
+class TokenBucket:
+    def __init__(self, per_minute: float) -> None:
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # This method takes amount out of the bucket and returns how many seconds the caller has to wait before using it.
+    def reserve(self, amount: float) -> float:
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+    # This method puts back (or takes out more of) what a call was estimated to use, once its actual usage is known.
+    def adjust(self, amount: float) -> None:
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+# This class holds the limits and the metrics of one API key.
+class KeyLimiter:
+    def __init__(self, rpm: float, tpm: float, max_concurrency: int) -> None:
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+        # The callers waiting for a slot, one event per event loop because the calls of a key can come from different loops
+        self._slot_events = weakref.WeakKeyDictionary()
+        self.waits = deque(maxlen=1000)
+        self.calls = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.failures = 0
+
+    # This method waits until the buckets have room for the call and a concurrency slot is free.
+    # A caller that finds no free slot waits on the event of its loop, release sets the events of all the loops that have waiters.
+    async def acquire(self, estimated_tokens: int, requests: int) -> None:
+        delay = max(self.requests.reserve(requests), self.tokens.reserve(estimated_tokens), self.paused_until - time.monotonic())
+        if delay > 0:
+            await asyncio.sleep(delay)
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            slot_freed = self._slot_events.get(loop)
+            if slot_freed is None:
+                slot_freed = self._slot_events[loop] = asyncio.Event()
+        while True:
+            # Cleared before looking, so a slot freed in between still wakes us up
+            slot_freed.clear()
+            with self.lock:
+                now = time.monotonic()
+                if self.in_flight < self.max_concurrency and now >= self.paused_until:
+                    self.in_flight += 1
+                    return
+                paused = self.paused_until - now
+            if paused > 0:
+                # Nobody signals the end of a pause, the caller wakes up by itself
+                try:
+                    await asyncio.wait_for(slot_freed.wait(), paused)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await slot_freed.wait()
+
+    def release(self) -> None:
+        with self.lock:
+            self.in_flight -= 1
+            waiting = list(self._slot_events.items())
+        for loop, slot_freed in waiting:
+            try:
+                loop.call_soon_threadsafe(slot_freed.set)
+            except RuntimeError:
+                # The loop is closed, nobody waits on it anymore
+                with self.lock:
+                    self._slot_events.pop(loop, None)
+
+    # This method holds back every call of the key for a while, the provider told one of them to slow down.
+    def pause(self, seconds: float) -> None:
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def stats(self) -> dict:
+        waits = sorted(self.waits)
+        return {
+            "calls": self.calls,
+            "in_flight": self.in_flight,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "failures": self.failures,
+            "queue_wait_avg": sum(waits) / len(waits) if waits else 0.0,
+            "queue_wait_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+            "queue_wait_max": waits[-1] if waits else 0.0
+        }
+
+# This class schedules the LLM calls of the worker. Every API key gets a requests/minute and a tokens/minute bucket
+# and a bounded number of calls in flight, kept a little under the provider limits (LLM_RATE_HEADROOM).
+# The buckets live in the worker, so LLM_RPM, LLM_TPM and LLM_MAX_CONCURRENCY are the limits of the whole server and every worker
+# gets an equal share of them: they are divided by the number of workers (WEB_CONCURRENCY, the gunicorn configs set it).
+# A busy worker can't borrow the share of an idle one, but the workers together never go over the provider limits.
+# Calls that fail with a rate limit or a server error are retried with exponential backoff and jitter, waiting at least as long as Retry-After says.
+class LLMScheduler:
+    def __init__(self, rpm: int = None, tpm: int = None, max_concurrency: int = None, max_retries: int = None, workers: int = None) -> None:
+        headroom = float(os.environ.get('LLM_RATE_HEADROOM', 0.9))
+        self.workers = max(1, workers or int(os.environ.get('WEB_CONCURRENCY', 1)))
+        self.rpm = (rpm or int(os.environ.get('LLM_RPM', 500))) * headroom / self.workers
+        self.tpm = (tpm or int(os.environ.get('LLM_TPM', 200000))) * headroom / self.workers
+        self.max_concurrency = max(1, (max_concurrency or int(os.environ.get('LLM_MAX_CONCURRENCY', 8))) // self.workers)
+        self.max_retries = max_retries if max_retries is not None else int(os.environ.get('LLM_MAX_RETRIES', 5))
+        self.base_delay = float(os.environ.get('LLM_BACKOFF_BASE', 1))
+        self.max_delay = float(os.environ.get('LLM_BACKOFF_MAX', 60))
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    # The keys are only kept hashed, the metrics are reported per hash
+    @staticmethod
+    def key_id(api_key: str) -> str:
+        return hashlib.sha256((api_key or '').encode()).hexdigest()[:12]
+
+    def limiter(self, api_key: str) -> KeyLimiter:
+        key_id = self.key_id(api_key)
+        with self._lock:
+            if key_id not in self._limiters:
+                self._limiters[key_id] = KeyLimiter(self.rpm, self.tpm, self.max_concurrency)
+            return self._limiters[key_id]
+
+    def _backoff(self, attempt: int, retry_after: float = None) -> float:
+        ceiling = min(self.max_delay, self.base_delay * 2 ** attempt)
+        delay = random.uniform(ceiling / 2, ceiling)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    # This method runs one LLM call under the limits of api_key and returns its result.
+    # call is a function without arguments that returns a new awaitable every time, so the call can be made again.
+    # estimated_tokens (prompt + answer) and requests are taken out of the buckets up front, used_tokens(result) corrects the estimate afterwards.
+    # can_retry is asked before every retry, e.g. a stream that already passed on some of its output can't be started over.
+    # call_site names the part of the pipeline that makes the call, the latency metrics are reported per call site.
+    async def run(self, api_key: str, call, estimated_tokens: int = 0, requests: int = 1, used_tokens=None, can_retry=None, call_site: str = 'other'):
+        limiter = self.limiter(api_key)
+        attempt = 0
+        while True:
+            queued = time.monotonic()
+            await limiter.acquire(estimated_tokens, requests)
+            started = time.monotonic()
+            limiter.waits.append(started - queued)
+            LLM_QUEUE_WAIT_SECONDS.labels(call_site).observe(started - queued)
+            limiter.calls += 1
+            error = None
+            try:
+                result = await call()
+            except Exception as e:
+                error = e
+            finally:
+                limiter.release()
+            LLM_CALL_SECONDS.labels(call_site, 'success' if error is None else ('rate_limited' if _is_rate_limit(error) else 'error')).observe(time.monotonic() - started)
+
+            if error is None:
+                if used_tokens is not None:
+                    try:
+                        used = used_tokens(result)
+                        if used:
+                            limiter.tokens.adjust(estimated_tokens - used)
+                    except Exception:
+                        pass
+                return result
+
+            if _is_rate_limit(error):
+                limiter.rate_limited += 1
+            if not _is_retryable(error) or attempt >= self.max_retries or (can_retry is not None and not can_retry()):
+                limiter.failures += 1
+                record_error('llm', error)
+                raise error
+            delay = self._backoff(attempt, _retry_after(error))
+            if _is_rate_limit(error):
+                limiter.pause(delay)
+            limiter.retries += 1
+            attempt += 1
+            print(f"LLM call failed ({type(error).__name__}), retrying in {delay:.1f}s (attempt {attempt}/{self.max_retries})")
+            await asyncio.sleep(delay)
+
+    # This method returns the metrics of every key, including how long calls waited in the queue.
+    def stats(self) -> dict:
+        with self._lock:
+            return {key_id: limiter.stats() for key_id, limiter in self._limiters.items()}
+
+_scheduler = None
+
+# This function returns the LLM scheduler of the current worker.
+def get_llm_scheduler() -> LLMScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = LLMScheduler()
+    return _scheduler
+
+def _llm_api_key(llm) -> str:
+    key = getattr(llm, 'openai_api_key', None)
+    return key.get_secret_value() if hasattr(key, 'get_secret_value') else key
+
+def _usage_tokens(result):
+    usage = getattr(result, 'usage_metadata', None)
+    return usage.get('total_tokens') if usage else None
+
+# This function records the usage of a chat model answer (or of a cache hit, without an answer) for the user whose work is running.
+def record_llm_usage(call_site: str, llm, result=None, cached: bool = False) -> None:
+    usage = getattr(result, 'usage_metadata', None) or {}
+    record_usage(call_site, getattr(llm, 'model_name', None), usage.get('input_tokens', 0), usage.get('output_tokens', 0), cached=cached)
+
+# This function invokes a prompt | llm chain through the LLM cache and the scheduler, the async counterpart of invoke_cached.
+# The call itself is made with ainvoke on the async client of the model, so waiting for the answer takes neither the loop nor a thread,
+# and the calls of a blog scan run side by side up to the concurrency of the key. The cache lives in SQLite and is read and written in a thread.
+async def scheduled_invoke(chain, llm, prompt_template, inputs: dict, use_cache: bool = None, call_site: str = 'other'):
+    key, cached = await asyncio.to_thread(lookup_cached, llm, prompt_template, inputs, use_cache)
+    if cached is not None:
+        from langchain_core.messages import AIMessage
+        record_llm_usage(call_site, llm, cached=True)
+        return AIMessage(content=cached)
+    estimated_tokens = estimate_tokens(prompt_template.format(**inputs)) + (getattr(llm, 'max_tokens', None) or 1000)
+    result = await get_llm_scheduler().run(
+        _llm_api_key(llm),
+        lambda: chain.ainvoke(inputs),
+        estimated_tokens=estimated_tokens,
+        used_tokens=_usage_tokens,
+        call_site=call_site
+    )
+    record_llm_usage(call_site, llm, result)
+    if key is not None:
+        await asyncio.to_thread(store_cached, key, result)
+    return result
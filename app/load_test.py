@@ -0,0 +1,60 @@
+import argparse
+import asyncio
+import time
+import aiohttp
+
+# This script measures how many slow requests a running server holds at the same time. It fires concurrency requests at once
+# at a path that waits (by default /debug/slow, which needs DEBUG_ENDPOINTS) and reports how long they took: a server that can hold
+# them all finishes in about the time of one request, one that can't finishes in rounds.
+# /debug/slow is an async Flask view like compare_article and goes through the same path as the views users hit,
+# other pages can be measured with --path (and --cookie for the ones that need a login).
+#
+#   python -m app.load_test --url http://127.0.0.1:10000 --concurrency 8 32 128
+#
+# Run it once against gunicorn.conf.py (threaded workers) and once against gunicorn_async.conf.py (ASGI), with the same number of workers.
+
+async def _request(session: aiohttp.ClientSession, url: str, headers: dict) -> tuple:
+    started = time.perf_counter()
+    try:
+        async with session.get(url, headers=headers) as response:
+            await response.read()
+            return time.perf_counter() - started, response.status
+    except Exception:
+        return time.perf_counter() - started, None
+
+# This function sends concurrency requests at the same time and returns their statistics.
+async def run_round(url: str, concurrency: int, cookie: str = None, timeout: float = 300) -> dict:
+    headers = {"Cookie": cookie} if cookie else {}
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        started = time.perf_counter()
+        results = await asyncio.gather(*[_request(session, url, headers) for _ in range(concurrency)])
+        wall = time.perf_counter() - started
+    latencies = sorted(latency for latency, status in results if status == 200)
+    return {
+        "concurrency": concurrency,
+        "ok": len(latencies),
+        "failed": concurrency - len(latencies),
+        "wall": wall,
+        "p50": latencies[len(latencies) // 2] if latencies else None,
+        "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+        "max": latencies[-1] if latencies else None,
+        "per_second": len(latencies) / wall if wall else 0.0
+    }
+
+def _seconds(value) -> str:
+    return f"{value:.2f}s" if value is not None else "-"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure how many slow requests a server holds at the same time")
+    parser.add_argument('--url', default='http://127.0.0.1:10000')
+    parser.add_argument('--path', default='/debug/slow?seconds=2')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[8, 32, 128])
+    parser.add_argument('--cookie', help="Session cookie for paths that need a login, e.g. session=...")
+    args = parser.parse_args()
+
+    print(f"{'concurrency':>11} {'ok':>5} {'failed':>6} {'wall':>8} {'p50':>8} {'p95':>8} {'max':>8} {'req/s':>8}")
+    for concurrency in args.concurrency:
+        result = asyncio.run(run_round(args.url.rstrip('/') + args.path, concurrency, args.cookie))
+        print(f"{result['concurrency']:>11} {result['ok']:>5} {result['failed']:>6} {_seconds(result['wall']):>8} {_seconds(result['p50']):>8} "
+              f"{_seconds(result['p95']):>8} {_seconds(result['max']):>8} {result['per_second']:>8.1f}")
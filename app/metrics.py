@@ -0,0 +1,138 @@
+import os
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+
+# The metrics of the pipeline, exposed on /metrics in the Prometheus text format.
+# With several gunicorn workers every worker writes its samples to PROMETHEUS_MULTIPROC_DIR (the gunicorn configs set it)
+# and a scrape adds up the files of all the workers, so it doesn't matter which worker answers it.
+
+# Seconds, from a cache hit of a few milliseconds up to a blog scan of several minutes
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+FANOUT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+# Seconds a checkout waits for a connection of the pool, the same buckets as /debug/db-pool
+POOL_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+PIPELINE_STEP_SECONDS = Histogram(
+    'pipeline_step_seconds', 'Duration of a pipeline step', ['pipeline', 'step', 'outcome'], buckets=DURATION_BUCKETS
+)
+PIPELINE_RUN_SECONDS = Histogram(
+    'pipeline_run_seconds', 'Duration of a whole pipeline run (the sum of its steps)', ['pipeline', 'status'], buckets=DURATION_BUCKETS
+)
+BROWSER_FETCH_SECONDS = Histogram(
+    'browser_fetch_seconds', 'Time to get a rendered page, from the fetch cache or the headless browser', ['outcome'], buckets=DURATION_BUCKETS
+)
+LLM_CALL_SECONDS = Histogram(
+    'llm_call_seconds', 'Duration of one LLM call attempt', ['call_site', 'outcome'], buckets=DURATION_BUCKETS
+)
+LLM_QUEUE_WAIT_SECONDS = Histogram(
+    'llm_queue_wait_seconds', 'Time an LLM call waited for the rate limits of its API key', ['call_site'], buckets=DURATION_BUCKETS
+)
+COMPARISON_FANOUT = Histogram(
+    'comparison_fanout_articles', 'Articles that entered a tier of a blog scan', ['stage'], buckets=FANOUT_BUCKETS
+)
+JOB_QUEUE_WAIT_SECONDS = Histogram(
+    'job_queue_wait_seconds', 'Time a job spent in the queue before a worker picked it up', ['kind'], buckets=DURATION_BUCKETS
+)
+DB_POOL_WAIT_SECONDS = Histogram(
+    'db_pool_wait_seconds', 'Time a checkout waited for a free connection of the pool', buckets=POOL_WAIT_BUCKETS
+)
+DB_POOL_TIMEOUTS_TOTAL = Counter(
+    'db_pool_timeouts_total', 'Checkouts that gave up waiting for a connection of the pool'
+)
+# The gauges are added up over the workers that are alive
+DB_POOL_CHECKED_OUT = Gauge(
+    'db_pool_checked_out_connections', 'Connections checked out of the pools', multiprocess_mode='livesum'
+)
+DB_POOL_LEAKED = Gauge(
+    'db_pool_leaked_connections', 'Connections checked out for longer than DB_POOL_LEAK_AFTER seconds', multiprocess_mode='livesum'
+)
+ERRORS_TOTAL = Counter(
+    'pipeline_errors_total', 'Errors by component and exception type', ['component', 'error_type']
+)
+
+# This function counts an error of a component (url, blog, comparison, fetch, llm, job) under the type of its exception.
+def record_error(component: str, error) -> None:
+    error_type = error if isinstance(error, str) else type(error).__name__
+    ERRORS_TOTAL.labels(component, error_type or 'Exception').inc()
+
+# This function records the steps of a finished pipeline trace (url, blog or comparison) and counts it if it failed.
+# Blog traces also record how many articles went into every tier of the screening.
+def observe_trace(trace: dict) -> None:
+    pipeline = trace.get("kind") or "url"
+    total = 0.0
+    for step in trace.get("steps") or []:
+        duration = float(step.get("duration") or 0)
+        total += duration
+        PIPELINE_STEP_SECONDS.labels(pipeline, step.get("name", "unknown"), 'success' if step.get("success", True) else 'error').observe(duration)
+    status = trace.get("status") or "unknown"
+    PIPELINE_RUN_SECONDS.labels(pipeline, status).observe(total)
+    if status == "error":
+        record_error(pipeline, trace.get("error_type") or 'Exception')
+
+    screening = trace.get("screening") or {}
+    if "articles" in screening:
+        COMPARISON_FANOUT.labels('articles').observe(screening["articles"])
+    for stage in ("title", "prefilter", "content"):
+        if isinstance(screening.get(stage), dict) and "input" in screening[stage]:
+            COMPARISON_FANOUT.labels(stage).observe(screening[stage]["input"])
+
+# This class reports the depth of the job queue. It is read from the database when the metrics are scraped,
+# the queue is shared by all the workers so there is nothing to add up.
+class JobQueueCollector:
+    def collect(self):
+        # Imported here because the job operations open the database, recording a metric shouldn't need it
+        from app.api.job_operations import count_jobs_by_status
+        depth = GaugeMetricFamily('job_queue_depth', 'Jobs in the queue by status', labels=['status'])
+        oldest = GaugeMetricFamily('job_queue_oldest_seconds', 'Age of the oldest job that is still queued')
+        counts, oldest_age = count_jobs_by_status(('queued', 'running'))
+        for status, count in counts.items():
+            depth.add_metric([status], count)
+        oldest.add_metric([], oldest_age)
+        yield depth
+        yield oldest
+
+def _multiprocess_dir():
+    return os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir')
+
+# This function returns the metrics of all the workers (or of this process when it isn't running under gunicorn) in the Prometheus text format.
+def render_metrics():
+    # Imported here because the pool imports this module
+    from app.database.pool import pool_stats
+    pool_stats.update_leak_gauge()
+    if _multiprocess_dir():
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = CollectorRegistry()
+        registry.register(_DefaultRegistryCollector())
+    registry.register(JobQueueCollector())
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+# This function is called by the gunicorn master when a worker has exited (the child_exit hook of the gunicorn configs).
+# The live gauges of the worker are dropped, its counters and histograms are added to one archive file per type and its own files are removed,
+# so the folder keeps a few files per live worker instead of growing with every worker that max_requests recycles.
+def archive_dead_worker(pid: int) -> None:
+    directory = _multiprocess_dir()
+    if not directory:
+        return
+    from prometheus_client import multiprocess
+    from prometheus_client.mmap_dict import MmapedDict
+    multiprocess.mark_process_dead(pid, directory)
+    for metric_type in ('counter', 'histogram'):
+        path = os.path.join(directory, f'{metric_type}_{pid}.db')
+        if not os.path.exists(path):
+            continue
+        archive = MmapedDict(os.path.join(directory, f'{metric_type}_archive.db'))
+        try:
+            for key, value, timestamp, _ in MmapedDict.read_all_values_from_file(path):
+                archived, _ = archive.read_value(key)
+                archive.write_value(key, archived + value, timestamp)
+        finally:
+            archive.close()
+        os.remove(path)
+
+# Passes the metrics of the default registry of this process on to the registry of a scrape
+class _DefaultRegistryCollector:
+    def collect(self):
+        return REGISTRY.collect()
@@ -0,0 +1,100 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# This class keeps the ready-to-use pipeline objects (ContentProcessor, ProfileComparer, BlogHandler) of the most recent users of the worker,
+# so a warm request skips decrypting the API key, building the OpenAI client and loading the prompts into chains.
+# An entry is dropped when it hasn't been used for PROCESSOR_CACHE_IDLE_TIMEOUT seconds and when the user's stored API key changes
+# (the encrypted key is part of the entry, so this is noticed by every worker). Prompt changes don't drop anything,
+# the processors check the version of their prompt in the prompt cache on every run and only rebuild their chain.
+class ProcessorCache:
+    def __init__(self, max_users: int = None, idle_timeout: float = None) -> None:
+        self.max_users = max_users or int(os.environ.get('PROCESSOR_CACHE_MAX_USERS', 100))
+        self.idle_timeout = idle_timeout if idle_timeout is not None else float(os.environ.get('PROCESSOR_CACHE_IDLE_TIMEOUT', 900))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # The pipeline objects of a user are only valid for the API key they were built with
+    @staticmethod
+    def _fingerprint(user) -> str:
+        key = user.openai_api_key or b''
+        return hashlib.sha256(key if isinstance(key, bytes) else key.encode()).hexdigest()
+
+    @staticmethod
+    def _build(kind: str, user):
+        # Imported here because the content processor imports this module
+        from app.content_processor import ContentProcessor, ProfileComparer, BlogHandler
+        builders = {
+            'content_processor': ContentProcessor,
+            'profile_comparer': ProfileComparer,
+            'blog_handler': BlogHandler
+        }
+        if kind not in builders:
+            raise ValueError(f"Unknown processor kind: {kind}")
+        return builders[kind](user)
+
+    # This method returns the cached pipeline object of the given kind for a user, building it if it isn't cached or no longer valid.
+    def get(self, kind: str, user):
+        fingerprint = self._fingerprint(user)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user.id)
+            if entry is not None and (entry["fingerprint"] != fingerprint or now - entry["used"] > self.idle_timeout):
+                del self._entries[user.id]
+                entry = None
+            if entry is not None and kind in entry["objects"]:
+                entry["used"] = now
+                self._entries.move_to_end(user.id)
+                self.hits += 1
+                return entry["objects"][kind]
+            self.misses += 1
+
+        # Built outside of the lock, a BlogHandler gets the processor and the comparer from the cache itself
+        built = self._build(kind, user)
+
+        with self._lock:
+            entry = self._entries.get(user.id)
+            if entry is None or entry["fingerprint"] != fingerprint:
+                entry = {"fingerprint": fingerprint, "objects": {}, "used": now}
+                self._entries[user.id] = entry
+            entry["used"] = time.monotonic()
+            # Another thread may have built the same object in the meantime, everyone uses the first one
+            built = entry["objects"].setdefault(kind, built)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+        return built
+
+    # This method drops the pipeline objects of a user, the settings route calls it after the user's API key changes.
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        with self._lock:
+            users = len(self._entries)
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "users": users,
+            "max_users": self.max_users
+        }
+
+_processor_cache = None
+
+# This function returns the processor cache of the current worker.
+def get_processor_cache() -> ProcessorCache:
+    global _processor_cache
+    if _processor_cache is None:
+        _processor_cache = ProcessorCache()
+    return _processor_cache
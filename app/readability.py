@@ -0,0 +1,132 @@
+import re
+from bs4 import BeautifulSoup, SoupStrainer
+
+# Tags that never contain article text
+NOISE_TAGS = ['script', 'style', 'noscript', 'template', 'iframe', 'svg', 'canvas', 'form', 'button', 'nav', 'footer', 'aside']
+# Class/id words that mark navigation, sidebars, comments, share buttons and the like
+BOILERPLATE_PATTERN = re.compile(
+    r'(^|[\s_-])(nav|navbar|menu|footer|sidebar|widget|breadcrumbs?|comments?|share|sharing|social|related|'
+    r'newsletter|subscribe|cookie|consent|banner|advert|ads?|promo|popup|modal|signup|author-bio|tags?)([\s_-]|$)',
+    re.IGNORECASE
+)
+BLOCK_TAGS = ['h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'p', 'li', 'blockquote', 'pre']
+CANDIDATE_TAGS = ['article', 'main', 'section', 'div']
+
+def _text(element) -> str:
+    return re.sub(r'\s+', ' ', element.get_text(' ', strip=True)).strip()
+
+def _link_density(element) -> float:
+    text_length = len(_text(element))
+    if text_length == 0:
+        return 1.0
+    link_length = sum(len(_text(link)) for link in element.find_all('a'))
+    return min(link_length / text_length, 1.0)
+
+def _is_boilerplate(element) -> bool:
+    marker = ' '.join(element.get('class', []) or []) + ' ' + (element.get('id') or '') + ' ' + (element.get('role') or '')
+    return bool(BOILERPLATE_PATTERN.search(marker)) or element.get('role') in ('navigation', 'contentinfo', 'complementary')
+
+# This function parses an html document and removes everything that is clearly not content (scripts, menus, footers, share bars...).
+def parse_html(html: str) -> BeautifulSoup:
+    soup = BeautifulSoup(html, 'lxml')
+    for element in soup.find_all(NOISE_TAGS):
+        element.decompose()
+    for element in soup.find_all(True):
+        # Elements inside an already removed parent are decomposed too
+        if element.decomposed or element.name in ('html', 'body', 'article', 'main'):
+            continue
+        # A class like "post comments-enabled" shouldn't take the whole article with it,
+        # so only short or link-heavy blocks are removed
+        if _is_boilerplate(element) and (len(_text(element).split()) < 80 or _link_density(element) > 0.3):
+            element.decompose()
+    return soup
+
+# This function returns the element that holds the main content of the page.
+# An <article> or <main> element wins if it holds real text, otherwise the container with the most paragraph text
+# (and the fewest links) is picked.
+def find_main_container(soup: BeautifulSoup):
+    for tag in ('article', 'main'):
+        candidates = [element for element in soup.find_all(tag) if len(_text(element).split()) >= 100]
+        if candidates:
+            return max(candidates, key=lambda element: len(_text(element)))
+
+    best, best_score = None, 0.0
+    for element in soup.find_all(CANDIDATE_TAGS):
+        paragraphs = element.find_all('p', recursive=False) or element.find_all('p')
+        paragraph_text = sum(len(_text(paragraph)) for paragraph in paragraphs)
+        if paragraph_text == 0:
+            continue
+        # Direct paragraphs count more, so we prefer the tightest container around the text
+        direct = len(element.find_all('p', recursive=False))
+        score = paragraph_text * (1 - _link_density(element)) * (1 + 0.25 * min(direct, 4))
+        if score > best_score:
+            best, best_score = element, score
+    return best or soup.body or soup
+
+# This function turns the main container into markdown, keeping the heading hierarchy, paragraphs, lists and quotes.
+def container_to_markdown(container) -> str:
+    blocks = []
+    for element in container.find_all(BLOCK_TAGS):
+        # Skip blocks nested in another block (e.g. a <p> inside an <li>), the outer block already has their text
+        parent_block = element.find_parent(BLOCK_TAGS)
+        if parent_block is not None and container in parent_block.parents:
+            continue
+        text = _text(element)
+        if not text:
+            continue
+        if element.name[0] == 'h' and element.name[1:].isdigit():
+            blocks.append(f"{'#' * int(element.name[1:])} {text}")
+        elif element.name == 'li':
+            blocks.append(f"- {text}")
+        elif element.name == 'blockquote':
+            blocks.append(f"> {text}")
+        elif element.name == 'pre':
+            blocks.append(f"```\n{element.get_text().strip()}\n```")
+        else:
+            blocks.append(text)
+    return "\n\n".join(blocks)
+
+def _page_title(soup: BeautifulSoup) -> str:
+    og_title = soup.find('meta', attrs={'property': 'og:title'})
+    if og_title and og_title.get('content'):
+        return og_title['content'].strip()
+    h1 = soup.find('h1')
+    if h1:
+        return _text(h1)
+    return _text(soup.title) if soup.title else ''
+
+# This function scores how much the extracted text looks like a complete article, between 0 and 1.
+def quality_score(container, markdown: str) -> float:
+    words = len(markdown.split())
+    paragraphs = sum(1 for block in markdown.split("\n\n") if block and block[0] not in '#->`' and len(block.split()) >= 20)
+    has_heading = any(block.startswith('#') for block in markdown.split("\n\n"))
+    score = (
+        0.5 * min(words / 300, 1.0)
+        + 0.2 * min(paragraphs / 5, 1.0)
+        + 0.2 * (1 - _link_density(container))
+        + 0.1 * has_heading
+    )
+    return round(score, 3)
+
+# This function takes the html of a page and returns its main content as markdown together with a quality score.
+def extract_main_content(html: str) -> dict:
+    soup = parse_html(html)
+    title = _page_title(soup)
+    container = find_main_container(soup)
+    markdown = container_to_markdown(container)
+    if title and not markdown.startswith('# '):
+        markdown = f"# {title}\n\n{markdown}"
+    return {
+        "markdown": markdown,
+        "score": quality_score(container, markdown),
+        "word_count": len(markdown.split())
+    }
+
+# This function returns the description a page gives of itself in its meta tags, only the meta tags are parsed so it is cheap.
+def extract_meta_description(html: str) -> str:
+    soup = BeautifulSoup(html or '', 'lxml', parse_only=SoupStrainer('meta'))
+    for attrs in ({'name': 'description'}, {'property': 'og:description'}, {'name': 'twitter:description'}):
+        meta = soup.find('meta', attrs=attrs)
+        if meta and meta.get('content', '').strip():
+            return ' '.join(meta['content'].split())
+    return ''
@@ -0,0 +1,231 @@
+import argparse
+import asyncio
+import hashlib
+import math
+import os
+import re
+import time
+import zlib
+from collections import Counter
+from typing import Dict, List
+import numpy as np
+from app.api.embedding_operations import get_profile_text, get_profile_embedding, save_profile_embedding
+from app.metrics import LLM_CALL_SECONDS
+from app.usage import record_usage
+
+STOPWORDS = frozenset("""
+a about after all also an and any are as at be been but by can do for from has have how i if in into is it its
+more my new no not of on or our out so than that the their them then there these they this to up was we what
+when which who why will with you your
+""".split())
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# This function scales every row of a matrix to length 1, so that a dot product is the cosine similarity.
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+# This class embeds texts on the CPU without any model or network: words and word pairs are hashed into a fixed number of buckets
+# with a sublinear term frequency. It only sees shared vocabulary, which is enough to tell clear hits from clear misses.
+class HashingEmbedder:
+    reject_below = 0.03
+    accept_above = 0.3
+
+    def __init__(self, dimensions: int = None) -> None:
+        self.dimensions = dimensions or int(os.environ.get('RELEVANCE_HASH_DIMENSIONS', 4096))
+        self.name = f"hashing-{self.dimensions}"
+
+    @staticmethod
+    def _features(text: str) -> List[str]:
+        words = []
+        for word in TOKEN_PATTERN.findall((text or '').lower()):
+            if word in STOPWORDS or len(word) < 2:
+                continue
+            # A very light stemmer, "models" and "model" should land in the same bucket
+            if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+                word = word[:-1]
+            words.append(word)
+        return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, count in Counter(self._features(text)).items():
+                bucket = zlib.crc32(feature.encode())
+                # The sign bit keeps collisions from always adding up
+                sign = 1.0 if bucket & 0x80000000 else -1.0
+                weight = 1.0 + math.log(count)
+                if ' ' in feature:
+                    weight *= 0.5
+                vectors[row, bucket % self.dimensions] += sign * weight
+        return _normalize(vectors)
+
+# This class embeds texts with the OpenAI embeddings API, more accurate than hashing but it costs a request per batch.
+class OpenAIEmbedder:
+    reject_below = 0.2
+    accept_above = 0.5
+
+    def __init__(self, api_key: str, model: str = None) -> None:
+        from langchain_openai import OpenAIEmbeddings
+        self.model = model or os.environ.get('RELEVANCE_OPENAI_MODEL', 'text-embedding-3-small')
+        self.name = f"openai-{self.model}"
+        self.client = OpenAIEmbeddings(model=self.model, openai_api_key=api_key)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        started = time.monotonic()
+        outcome = 'error'
+        try:
+            vectors = self.client.embed_documents(list(texts))
+            outcome = 'success'
+        finally:
+            LLM_CALL_SECONDS.labels('embedding', outcome).observe(time.monotonic() - started)
+        # The embeddings client doesn't pass the usage on, it is estimated from the texts
+        record_usage('embedding', self.model, sum(len(text or '') for text in texts) // 4)
+        return _normalize(np.array(vectors, dtype=np.float32))
+
+# The available embedding backends, a factory gets the user's API key and returns an object with name, embed(), reject_below and accept_above.
+EMBEDDERS = {
+    "hashing": lambda api_key: HashingEmbedder(),
+    "openai": lambda api_key: OpenAIEmbedder(api_key)
+}
+
+def register_embedder(name: str, factory) -> None:
+    EMBEDDERS[name] = factory
+
+# This function returns the embedding backend selected with RELEVANCE_EMBEDDER (hashing by default).
+def get_embedder(api_key: str = None, name: str = None):
+    name = name or os.environ.get('RELEVANCE_EMBEDDER', 'hashing')
+    if name not in EMBEDDERS:
+        raise ValueError(f"Unknown embedder: {name}")
+    return EMBEDDERS[name](api_key)
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256((text or '').encode()).hexdigest()
+
+# This function embeds the interests of a profile and stores the vector, the routes call it whenever a profile is created or updated.
+def update_profile_embedding(profile_id: int, interests_description: str, api_key: str = None, embedder=None) -> np.ndarray:
+    embedder = embedder or get_embedder(api_key)
+    vector = embedder.embed([interests_description])[0]
+    save_profile_embedding(profile_id, embedder.name, vector.astype(np.float32).tobytes(), len(vector), _text_hash(interests_description))
+    return vector
+
+# This function returns the stored profile vector of a user. Profiles that were never embedded, or changed since, are embedded now.
+def load_profile_vector(user_id: int, embedder) -> np.ndarray:
+    profile_id, interests_description = get_profile_text(user_id)
+    stored = get_profile_embedding(profile_id, embedder.name)
+    if stored is not None and stored["text_hash"] == _text_hash(interests_description):
+        return np.frombuffer(stored["vector"], dtype=np.float32)
+    return update_profile_embedding(profile_id, interests_description, embedder=embedder)
+
+# This class is the first, CPU-only stage of the relevance check. It scores the title and lead text of every candidate article
+# against the profile vector: clear hits are accepted, clear misses are rejected and only the band in between goes to the LLM.
+class RelevancePrefilter:
+    def __init__(self, user_id: int, api_key: str = None, embedder=None) -> None:
+        self.user_id = user_id
+        self.embedder = embedder or get_embedder(api_key)
+        self.reject_below = float(os.environ.get('RELEVANCE_REJECT_BELOW', self.embedder.reject_below))
+        self.accept_above = float(os.environ.get('RELEVANCE_ACCEPT_ABOVE', self.embedder.accept_above))
+        self._profile_vector = None
+
+    def profile_vector(self) -> np.ndarray:
+        if self._profile_vector is None:
+            self._profile_vector = load_profile_vector(self.user_id, self.embedder)
+        return self._profile_vector
+
+    # This method returns the cosine similarity of every text to the profile.
+    def score(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros(0, dtype=np.float32)
+        return self.embedder.embed(texts) @ self.profile_vector()
+
+    def verdict(self, score: float) -> str:
+        if score >= self.accept_above:
+            return "accept"
+        if score < self.reject_below:
+            return "reject"
+        return "uncertain"
+
+    # This method screens a dictionary of url: title and returns {url: {"score", "verdict"}}.
+    # The lead text of every article comes from its (usually cached) page, an article that can't be fetched is scored on its title.
+    async def screen(self, articles_dict: Dict[str, str]) -> Dict[str, Dict]:
+        from app.crawl4ai import get_lead_text
+        urls = list(articles_dict.keys())
+        leads = await asyncio.gather(*[get_lead_text(url) for url in urls], return_exceptions=True)
+        texts = [
+            f"{articles_dict[url] or ''}\n{lead if isinstance(lead, str) else ''}"
+            for url, lead in zip(urls, leads)
+        ]
+        scores = await asyncio.to_thread(self.score, texts)
+        return {
+            url: {"score": float(score), "verdict": self.verdict(float(score))}
+            for url, score in zip(urls, scores)
+        }
+
+# This function measures the prefilter against the verdicts the LLM gave on the user's past articles, without fetching anything:
+# the lead text is only used when the page is still in the fetch cache. The uncertain band would go to the LLM, so it counts as the LLM's verdict.
+def evaluate_prefilter(user_id: int, api_key: str = None, embedder_name: str = None) -> Dict:
+    from app.database.database import SessionLocal
+    from app.api.article_operations import get_llm_labelled_articles
+    from app.fetch_cache import get_fetch_cache
+    from app.readability import extract_main_content
+
+    db = SessionLocal()
+    try:
+        articles = [(article.url, article.title, article.profile_fit) for article in get_llm_labelled_articles(db, user_id)]
+    finally:
+        db.close()
+
+    prefilter = RelevancePrefilter(user_id, api_key, get_embedder(api_key, embedder_name))
+    cache = get_fetch_cache()
+    texts = []
+    with_lead = 0
+    for url, title, _ in articles:
+        entry = cache.get(url)
+        lead = ""
+        if entry is not None:
+            lead = " ".join(extract_main_content(entry["html"])["markdown"].split()[:80])
+            with_lead += 1
+        texts.append(f"{title or ''}\n{lead}")
+    scores = prefilter.score(texts)
+
+    counts = Counter()
+    for (_, _, llm_fit), score in zip(articles, scores):
+        verdict = prefilter.verdict(float(score))
+        counts[verdict] += 1
+        counts[f"{verdict}_llm_yes"] += int(bool(llm_fit))
+        pipeline_fit = llm_fit if verdict == "uncertain" else verdict == "accept"
+        counts["true_positives"] += int(bool(pipeline_fit and llm_fit))
+        counts["pipeline_positives"] += int(bool(pipeline_fit))
+        counts["llm_positives"] += int(bool(llm_fit))
+
+    total = len(articles)
+    return {
+        "embedder": prefilter.embedder.name,
+        "reject_below": prefilter.reject_below,
+        "accept_above": prefilter.accept_above,
+        "articles": total,
+        "with_lead_text": with_lead,
+        "accepted": counts["accept"],
+        "rejected": counts["reject"],
+        "uncertain": counts["uncertain"],
+        "llm_calls_saved": (counts["accept"] + counts["reject"]) / total if total else 0.0,
+        # Share of the automatic decisions the LLM agrees with
+        "accept_precision": counts["accept_llm_yes"] / counts["accept"] if counts["accept"] else None,
+        "reject_precision": 1 - counts["reject_llm_yes"] / counts["reject"] if counts["reject"] else None,
+        "missed_fits": counts["reject_llm_yes"],
+        # The whole pipeline (prefilter + LLM for the uncertain band) measured against LLM-only
+        "precision": counts["true_positives"] / counts["pipeline_positives"] if counts["pipeline_positives"] else None,
+        "recall": counts["true_positives"] / counts["llm_positives"] if counts["llm_positives"] else None
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate the relevance prefilter against the LLM verdicts of a user's articles")
+    parser.add_argument('--user-id', type=int, required=True)
+    parser.add_argument('--embedder', default=None)
+    parser.add_argument('--api-key', default=os.environ.get('OPENAI_API_KEY'))
+    args = parser.parse_args()
+    report = evaluate_prefilter(args.user_id, args.api_key, args.embedder)
+    for key, value in report.items():
+        print(f"{key:>18}: {value:.3f}" if isinstance(value, float) else f"{key:>18}: {value}")
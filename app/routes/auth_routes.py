@@ -18,13 +18,15 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         db = SessionLocal()
-        user = db.query(User).filter_by(email=form.email.data).first()
-        if user and user.check_password(form.password.data):
-            login_user(user)
-            flash('Logged in successfully!')
-            return redirect(url_for('base.base'))
-        flash('Invalid email opr password')
-        db.close()
+        try:
+            user = db.query(User).filter_by(email=form.email.data).first()
+            if user and user.check_password(form.password.data):
+                login_user(user)
+                flash('Logged in successfully!')
+                return redirect(url_for('base.base'))
+            flash('Invalid email opr password')
+        finally:
+            db.close()
     return render_template('login.html',form=form)
 
 @auth_bp.route('/register',methods=['GET','POST'])
@@ -1,98 +1,109 @@
-from flask import Flask, render_template, Blueprint, redirect, flash, url_for, request
+from flask import Flask, render_template, Blueprint, redirect, flash, url_for, request, jsonify, abort, Response, stream_with_context
 from flask_login import login_required, current_user
 import os
-from ..forms import UrlSubmit, PromptForm, ProfileForm, ArticleCompareForm, BlogForm, SetupProfileForm,SettingsForm
-from ..content_processor import ContentProcessor, ProfileComparer, BlogHandler
-from ..database.database import SessionLocal
+from ..forms import UrlSubmit, PromptForm, ProfileForm, ArticleCompareForm, BlogForm, SetupProfileForm,SettingsForm,BudgetForm
+from ..processor_cache import get_processor_cache
+from ..database.database import SessionLocal, AsyncSessionLocal, get_request_db, close_request_db, engine
+from ..database.pool import pool_stats
 from ..database.models import Prompt, Profile, User
 import asyncio
 from ..api.article_operations import get_user_articles
 import logging
 from cryptography.fernet import Fernet
-from ..api.prompt_operations import get_prompt
-from asgiref.sync import async_to_sync
+from ..api.prompt_operations import get_prompt, get_prompt_cache, bump_prompt_version
+from ..jobs import enqueue_job
+from ..api.job_operations import get_job, get_job_progress
+from ..job_events import JobEventStream, parse_event_position
+from ..api.user_operations import invalidate_session_user
+from ..relevance import update_profile_embedding
+from ..metrics import render_metrics
+from ..api.usage_operations import get_usage_summary, get_monthly_budget, set_monthly_budget
+from ..usage import get_usage_recorder
+from datetime import datetime, timezone
+from sqlalchemy import select
 
 
 bp = Blueprint('base', __name__)
 fernet = Fernet(os.environ['ENCRYPTION_KEY'].encode())
 
+# This function re-embeds the interests of a profile for the relevance prefilter. If it fails the prefilter embeds the profile the next time it needs it.
+def _refresh_profile_embedding(profile_id, interests_description, encrypted_api_key):
+    try:
+        update_profile_embedding(profile_id, interests_description, fernet.decrypt(encrypted_api_key).decode())
+    except Exception as e:
+        print(f'Error updating the profile embedding {str(e)}')
+
 @bp.before_request
 def check_onboarding():
-    # We open a new database connection to give the flask-login the info about the profile of the user that are needed for the profile section of the sidebar
-    if current_user.is_authenticated:
-        db = SessionLocal()        
-        try:
-            db.add(current_user)  
-            if not current_user.is_onboarded and request.endpoint != 'base.onboarding':
-                return redirect(url_for('base.onboarding'))
-        finally:
-            db.close()
+    # current_user already has everything the sidebar needs, see app/api/user_operations.py
+    if current_user.is_authenticated and not current_user.is_onboarded and request.endpoint != 'base.onboarding':
+        return redirect(url_for('base.onboarding'))
 
 @bp.route('/home',methods=['GET','POST'])
 @login_required
 def base():
     form = UrlSubmit()
-    result = None
 
+    # The url is processed in the background, the job page shows the progress and the tweets
     if form.validate_on_submit():
         try:
-            processor = ContentProcessor(current_user)
-            result = async_to_sync(processor.process_url(form.url.data))
+            job_id = enqueue_job(current_user.id, 'process_url', form.url.data)
+            return redirect(url_for('base.job', job_id=job_id))
         except Exception as e:
-            result = {
-                "status":"error",
-                "message": f"An error occured: {str(e)}"
-            }
+            flash(f'An error occured: {str(e)}', 'error')
 
-    return render_template('index.html', form=form, result=result)
+    return render_template('index.html', form=form)
 
 @bp.route('/prompts', methods =['GET','POST'])
 @login_required
 def prompts():
     db = SessionLocal()
     try:
-        prompt = db.query(Prompt).filter(Prompt.user_id == current_user.id, Prompt.type == 1).first()
-        # Create a prompt object that will be placed inside the form for a placeholder in order to showcase only the relevant parts of the prompt
-        modified_prompt = prompt
-        parts = modified_prompt.template.split("### Suffix_")
-        editable_template = parts[0] if len(parts) >1 else ''
-        modified_prompt.template = editable_template
-    except Exception as e:
-        logging.error(f"Error in prompts route: {str(e)}")
-        flash(f'An error occurred: {str(e)}', 'error')
-        return redirect(url_for('base.base'))
-
-    if modified_prompt:
-        form = PromptForm(obj=modified_prompt)
-    else:
-        form = PromptForm()
-
-    # Change the name and the template of the prompt
-    if form.validate_on_submit():
         try:
-            prompt.name = form.name.data
-            prompt.template = f"{form.template.data.strip()} \n ### Suffix_ {parts[1]}"
-            db.commit()
-            print(f"Prompt template : {prompt.template}")
-            flash('Prompt updated successfully', 'success')
-            return redirect(url_for('base.prompts'))
+            prompt = db.query(Prompt).filter(Prompt.user_id == current_user.id, Prompt.type == 1).first()
+            # Create a prompt object that will be placed inside the form for a placeholder in order to showcase only the relevant parts of the prompt
+            modified_prompt = prompt
+            parts = modified_prompt.template.split("### Suffix_")
+            editable_template = parts[0] if len(parts) >1 else ''
+            modified_prompt.template = editable_template
         except Exception as e:
-            db.rollback()
-            flash(f'Error updating prompt {str(e)}','error')
-    
-    db.close()
-    return render_template('prompts.html', form=form)
+            logging.error(f"Error in prompts route: {str(e)}")
+            flash(f'An error occurred: {str(e)}', 'error')
+            return redirect(url_for('base.base'))
+
+        if modified_prompt:
+            form = PromptForm(obj=modified_prompt)
+        else:
+            form = PromptForm()
+
+        # Change the name and the template of the prompt
+        if form.validate_on_submit():
+            try:
+                prompt.name = form.name.data
+                prompt.template = f"{form.template.data.strip()} \n ### Suffix_ {parts[1]}"
+                bump_prompt_version(prompt)
+                db.commit()
+                # Write through, the processors of this worker pick the new template up on their next run
+                get_prompt_cache().store(prompt)
+                print(f"Prompt template : {prompt.template}")
+                flash('Prompt updated successfully', 'success')
+                return redirect(url_for('base.prompts'))
+            except Exception as e:
+                db.rollback()
+                flash(f'Error updating prompt {str(e)}','error')
+
+        return render_template('prompts.html', form=form)
+    finally:
+        db.close()
    
 @bp.route('/profile', methods = ['GET','POST'])
 @login_required
 def profile():
-    db = SessionLocal()
-    profile = db.query(Profile).filter(Profile.user_id == current_user.id).first()
+    profile = get_request_db().query(Profile).filter(Profile.user_id == current_user.id).first()
     
     profile_form = ProfileForm(obj=profile) if profile else ProfileForm()
     article_comparison_form = ArticleCompareForm()
     comparison_result = None
-    db.close()
     return render_template('profile.html', 
                         profile_form=profile_form, 
                         article_comparison_form=article_comparison_form,
@@ -102,34 +113,42 @@ def profile():
 @login_required
 def update_profile():
     db = SessionLocal()
-    profile = db.query(Profile).filter(Profile.user_id == current_user.id).first()
-    profile_form = ProfileForm(obj=profile)
-    if profile_form.validate_on_submit():
-        try:
-            profile.full_name = profile_form.full_name.data
-            profile.bio = profile_form.bio.data
-            profile.interests_description = profile_form.interests_description.data
-            profile.user_id = current_user.id
-            db.commit()
-            flash('Profile updated successfully','success')
-            return redirect(url_for('base.profile'))
-        except Exception as e:
-            db.rollback()
-            flash(f'Error updating profile {str(e)}') 
-    db.close()
+    try:
+        profile = db.query(Profile).filter(Profile.user_id == current_user.id).first()
+        profile_form = ProfileForm(obj=profile)
+        if profile_form.validate_on_submit():
+            try:
+                profile.full_name = profile_form.full_name.data
+                profile.bio = profile_form.bio.data
+                profile.interests_description = profile_form.interests_description.data
+                profile.user_id = current_user.id
+                db.commit()
+                invalidate_session_user(current_user.id)
+                encrypted_api_key = db.query(User.openai_api_key).filter(User.id == current_user.id).scalar()
+                _refresh_profile_embedding(profile.id, profile.interests_description, encrypted_api_key)
+                flash('Profile updated successfully','success')
+            except Exception as e:
+                db.rollback()
+                flash(f'Error updating profile {str(e)}') 
+    finally:
+        db.close()
     return redirect(url_for('base.profile'))
     
 @bp.route('/profile/compare',methods=['POST'])
 @login_required
 async def compare_article():
     logging.getLogger().setLevel(logging.ERROR)
-    db = SessionLocal()
-    profile = db.query(Profile).filter(Profile.user_id == current_user.id).first()
+    # The session isn't kept open while the article is compared, that can take a while.
+    # The view runs on the event loop of the worker, so the profile is read through the async engine
+    # The cached current_user doesn't carry the API key, the comparer is built from the User row
+    async with AsyncSessionLocal() as db:
+        profile = await db.scalar(select(Profile).where(Profile.user_id == current_user.id).limit(1))
+        user = await db.get(User, current_user.id)
     article_comparison_form = ArticleCompareForm()
     comparison_result = None
     if article_comparison_form.validate_on_submit():
         try:
-            comparer = ProfileComparer(current_user)
+            comparer = get_processor_cache().get('profile_comparer', user)
             comparison_result = await comparer.compare_article_to_profile(
                 article_url=article_comparison_form.article_url.data,
                 user_id=current_user.id
@@ -137,7 +156,6 @@ async def compare_article():
             flash('Article comparison completed', 'success')
         except Exception as e:
             flash(f'Error comparing the articles {str(e)}')
-    db.close()
     return render_template('profile.html', 
                          profile_form=ProfileForm(obj=profile), 
                          article_comparison_form=article_comparison_form,
@@ -145,37 +163,77 @@ async def compare_article():
 
 @bp.route('/blogs' ,methods=['GET','POST'])
 @login_required
-async def blogs():
+def blogs():
     form = BlogForm()
-    result = None
 
+    # The blog is scanned in the background, the job page shows the progress and the articles
     if form.validate_on_submit():
         try:
-            print('Setting up blog handler')
-            blog_handler = BlogHandler(current_user)
-            print('Starting the processing and storing of articles')
-            result = await blog_handler.process_and_store_articles(form.url.data,current_user.id)
-            print('articles processed')
+            job_id = enqueue_job(current_user.id, 'process_blog', form.url.data)
+            return redirect(url_for('base.job', job_id=job_id))
         except Exception as e:
-                result = {
-                "status": "error",
-                "message": f"An error occurred: {str(e)}"
-                }
-    return render_template('blogs.html',form=form,result=result)
+            flash(f'An error occurred: {str(e)}', 'error')
+    return render_template('blogs.html',form=form)
+
+@bp.route('/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def job(job_id):
+    job = get_job(job_id, current_user.id)
+    if job is None:
+        abort(404)
+    return render_template('job.html', job=job)
+
+@bp.route('/jobs/<int:job_id>/status', methods=['GET'])
+@login_required
+def job_status(job_id):
+    job = get_job(job_id, current_user.id)
+    if job is None:
+        abort(404)
+    return jsonify(job)
+
+# This route streams the progress of a job as server-sent events, see app/job_events.py.
+# Under the ASGI app (app/asgi.py) the stream is served without Flask, so that it doesn't hold a thread while it waits.
+# Here it holds a worker thread, so it ends after JOB_EVENTS_THREAD_TIMEOUT seconds and the browser reconnects where it left off.
+@bp.route('/jobs/<int:job_id>/events', methods=['GET'])
+@login_required
+def job_events(job_id):
+    user_id = current_user.id
+    if get_job_progress(job_id, user_id) is None:
+        abort(404)
+    sent_steps, sent_tweets = parse_event_position(
+        request.headers.get('Last-Event-ID', ''),
+        request.args.get('steps', 0, type=int),
+        request.args.get('tweets', 0, type=int)
+    )
+
+    # The stream can stay open for minutes, it shouldn't hold on to a connection of the pool
+    close_request_db()
+    return Response(stream_with_context(iter(JobEventStream(job_id, user_id, sent_steps, sent_tweets, timeout=int(os.environ.get('JOB_EVENTS_THREAD_TIMEOUT', 30))))), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 @bp.route('/processed-articles', methods=['GET'])
 @login_required
 def processed_articles():
-    db = SessionLocal()
+    # The page is picked with the cursor of the previous one, the filters are kept in the links
+    cursor = request.args.get('cursor') or None
+    source_blog = request.args.get('source_blog') or None
+    fit = request.args.get('fit', '')
+    profile_fit = {'yes': True, 'no': False}.get(fit)
     try:
-        articles = get_user_articles(db,current_user.id)
+        articles, next_cursor = get_user_articles(get_request_db(), current_user.id, cursor=cursor, source_blog=source_blog, profile_fit=profile_fit)
         return render_template('processed_articles.html', 
-                             articles=articles)
+                             articles=articles,
+                             next_cursor=next_cursor,
+                             cursor=cursor,
+                             source_blog=source_blog or '',
+                             fit=fit if profile_fit is not None else '')
+    except ValueError:
+        return redirect(url_for('base.processed_articles', source_blog=source_blog, fit=fit or None))
     except Exception as e:
         flash(f'Error loading articles: {str(e)}', 'error')
         return redirect(url_for('base.base'))
-    finally:
-        db.close()
 
 @bp.route('/onboarding',methods=['GET','POST'])
 @login_required
@@ -200,6 +258,8 @@ def onboarding():
             user.openai_api_key = fernet.encrypt(form.openai_api_key.data.encode())
             db.add(profile)
             db.commit()
+            invalidate_session_user(current_user.id)
+            _refresh_profile_embedding(profile.id, profile.interests_description, user.openai_api_key)
 
             flash('Profile Created Successfully!','success')
             return redirect(url_for('base.base'))
@@ -223,6 +283,8 @@ def settings():
             user = db.query(User).get(current_user.id)
             user.openai_api_key = fernet.encrypt(form.openai_api_key.data.encode())
             db.commit()
+            get_processor_cache().invalidate(current_user.id)
+            invalidate_session_user(current_user.id)
             flash('Settings updated successfully', 'success')
             return redirect(url_for('base.settings'))
         except Exception as e:
@@ -234,4 +296,56 @@ def settings():
         form.openai_api_key.data = '********************************************************************'
     
     db.close()
-    return render_template('settings.html', form=form)
\ No newline at end of file
+    # The LLM usage of this month, what this worker recorded in the last seconds is written first so it shows up
+    get_usage_recorder().flush()
+    month_start = datetime.now(timezone.utc).date().replace(day=1)
+    usage = get_usage_summary(current_user.id, month_start)
+    budget = get_monthly_budget(current_user.id)
+    budget_form = BudgetForm(monthly_budget=budget)
+    return render_template('settings.html', form=form, budget_form=budget_form, usage=usage, budget=budget, month_start=month_start)
+
+# This route saves the monthly LLM budget of the user, an empty budget removes the limit.
+@bp.route('/settings/budget', methods=['POST'])
+@login_required
+def settings_budget():
+    budget_form = BudgetForm()
+    if budget_form.validate_on_submit():
+        try:
+            budget = budget_form.monthly_budget.data
+            set_monthly_budget(current_user.id, float(budget) if budget is not None else None)
+            get_usage_recorder().forget_budget(current_user.id)
+            flash('Budget updated successfully', 'success')
+        except Exception as e:
+            flash(f'Error updating the budget: {str(e)}', 'error')
+    else:
+        flash('The budget has to be a positive amount', 'error')
+    return redirect(url_for('base.settings'))
+
+# This route shows the health of the connection pool of the worker: checkout waits, connections out and the ones that look leaked.
+# It only exists when DEBUG_ENDPOINTS is set.
+@bp.route('/debug/db-pool', methods=['GET'])
+@login_required
+def debug_db_pool():
+    if os.environ.get('DEBUG_ENDPOINTS', 'false').lower() not in ('1', 'true', 'yes'):
+        abort(404)
+    return jsonify(pool_stats.stats(engine.pool))
+
+# This route waits for a number of seconds (at most 60) on the shared event loop, like a request that waits on a crawl or an LLM call.
+# The load test (app/load_test.py) uses it to measure how many slow requests a worker can hold at the same time. It only exists when DEBUG_ENDPOINTS is set.
+@bp.route('/debug/slow', methods=['GET'])
+async def debug_slow():
+    if os.environ.get('DEBUG_ENDPOINTS', 'false').lower() not in ('1', 'true', 'yes'):
+        abort(404)
+    seconds = min(max(request.args.get('seconds', 1.0, type=float), 0.0), 60.0)
+    await asyncio.sleep(seconds)
+    return jsonify({"slept": seconds})
+
+# This route serves the metrics of all the workers in the Prometheus text format, for the scraper rather than for users.
+# When METRICS_TOKEN is set the scraper has to send it as a bearer token.
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    token = os.environ.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
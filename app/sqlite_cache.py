@@ -0,0 +1,96 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+
+# This class is a small persistent key/value cache on top of a local SQLite file.
+# Values are dictionaries, stored as compressed JSON. When the cache grows past max_bytes or max_entries
+# the least recently used entries are removed. The file can be shared by all the gunicorn workers of a machine.
+class SQLiteLRUCache:
+    def __init__(self, path: str, table: str, max_bytes: int = None, max_entries: int = None) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.table = table
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    # This method returns the connection of the current process, opening it (and the table) on first use.
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )""")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{self.table}_last_access ON {self.table} (last_access)")
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    # This method returns the value stored under key (and marks it as recently used), None if there is nothing.
+    def get(self, key: str):
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute(f"UPDATE {self.table} SET last_access = ? WHERE key = ?", (time.time(), key))
+        return json.loads(zlib.decompress(row[0]))
+
+    # This method stores a dictionary under key, replacing what was there, and evicts old entries if needed.
+    def set(self, key: str, value: dict) -> None:
+        blob = zlib.compress(json.dumps(value).encode())
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now, now)
+            )
+            self._evict(conn)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._connection().execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection().execute(f"DELETE FROM {self.table}")
+
+    # This method returns the number of entries and their total (compressed) size in bytes.
+    def stats(self) -> dict:
+        with self._lock:
+            count, size = self._connection().execute(
+                f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}"
+            ).fetchone()
+        return {"entries": count, "bytes": size}
+
+    # This method removes the least recently used entries until the cache fits its limits again.
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        count, size = conn.execute(f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}").fetchone()
+        if self.max_entries is not None and count > self.max_entries:
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY last_access LIMIT ?)",
+                (count - self.max_entries,)
+            )
+            size = conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+        if self.max_bytes is not None and size > self.max_bytes:
+            rows = conn.execute(f"SELECT key, size FROM {self.table} ORDER BY last_access").fetchall()
+            to_delete = []
+            for key, entry_size in rows:
+                if size <= self.max_bytes:
+                    break
+                to_delete.append((key,))
+                size -= entry_size
+            conn.executemany(f"DELETE FROM {self.table} WHERE key = ?", to_delete)
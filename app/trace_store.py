@@ -0,0 +1,492 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlparse
+from app.metrics import observe_trace
+
+# This class stores the traces of the pipelines in a local SQLite file instead of one JSON file per run.
+# A trace is kept as compressed JSON, but its long texts (articles, summaries, prompt templates) are moved out into a blobs table
+# keyed on their sha256, so a text that shows up in many traces (the same article, the same template) is stored once.
+# save() only puts the trace on a queue, a writer thread of the process does the disk work, so a request never waits for it.
+# Old traces are removed after TRACE_RETENTION_DAYS days, or earlier when the store grows past TRACE_MAX_BYTES.
+# Next to every trace a small summary row (url, domain, status, durations, sizes) and a row per step are written,
+# the trace viewer lists and aggregates those and only reads the body of the trace that is opened.
+class TraceStore:
+    def __init__(self, path: str = None, blob_min_size: int = None, retention_days: float = None, max_bytes: int = None, queue_size: int = None) -> None:
+        self.path = Path(path or os.environ.get('TRACE_STORE_PATH', 'instance/traces.db'))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.blob_min_size = blob_min_size or int(os.environ.get('TRACE_BLOB_MIN_SIZE', 1024))
+        self.retention_days = retention_days if retention_days is not None else float(os.environ.get('TRACE_RETENTION_DAYS', 30))
+        self.max_bytes = max_bytes or int(os.environ.get('TRACE_MAX_BYTES', 500 * 1024 * 1024))
+        self.queue_size = queue_size or int(os.environ.get('TRACE_QUEUE_SIZE', 1000))
+        self.retention_every = int(os.environ.get('TRACE_RETENTION_EVERY', 100))
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._queue = None
+        self._writer = None
+        self._writer_pid = None
+        # Separate from _lock, which the writer holds while it writes, so save() never waits for the disk
+        self._writer_lock = threading.Lock()
+        self._writes = 0
+        self.dropped = 0
+
+    # This method returns the connection of the current process, opening it (and the tables) on first use.
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS traces (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    trace_id TEXT NOT NULL UNIQUE,
+                    kind TEXT NOT NULL,
+                    url TEXT,
+                    status TEXT,
+                    start_time TEXT,
+                    created_at REAL NOT NULL,
+                    body BLOB NOT NULL,
+                    size INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS ix_traces_created_at ON traces (created_at);
+                CREATE TABLE IF NOT EXISTS trace_blobs (
+                    hash TEXT PRIMARY KEY,
+                    data BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    raw_size INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS trace_blob_refs (
+                    trace_id TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    PRIMARY KEY (trace_id, hash)
+                );
+                CREATE INDEX IF NOT EXISTS ix_trace_blob_refs_hash ON trace_blob_refs (hash);
+                CREATE TABLE IF NOT EXISTS trace_summaries (
+                    trace_id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    url TEXT,
+                    domain TEXT,
+                    status TEXT,
+                    error TEXT,
+                    start_time TEXT,
+                    created_at REAL NOT NULL,
+                    total_duration REAL NOT NULL,
+                    steps INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    raw_size INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS ix_trace_summaries_created_at ON trace_summaries (created_at);
+                CREATE TABLE IF NOT EXISTS trace_steps (
+                    trace_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    duration REAL NOT NULL,
+                    success INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (trace_id, position)
+                );
+                CREATE TABLE IF NOT EXISTS trace_rollups (
+                    hour INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    domain TEXT NOT NULL,
+                    traces INTEGER NOT NULL,
+                    errors INTEGER NOT NULL,
+                    duration_sum REAL NOT NULL,
+                    duration_max REAL NOT NULL,
+                    PRIMARY KEY (hour, kind, domain)
+                );
+                CREATE TABLE IF NOT EXISTS trace_step_histograms (
+                    hour INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    count INTEGER NOT NULL,
+                    failed INTEGER NOT NULL,
+                    PRIMARY KEY (hour, kind, name, bucket)
+                );
+                CREATE INDEX IF NOT EXISTS ix_trace_summaries_total_duration ON trace_summaries (total_duration);
+            """)
+            # user_version 1: every trace has its summary, steps and rollups
+            if conn.execute("PRAGMA user_version").fetchone()[0] < 1:
+                self._backfill_summaries(conn)
+                conn.execute("PRAGMA user_version = 1")
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    # This method writes the summary and the step rows of a trace and adds it to the hourly rollups, inside the transaction of the caller.
+    @staticmethod
+    def _write_summary(conn: sqlite3.Connection, trace_id: str, trace: dict, created_at: float, size: int, raw_size: int) -> None:
+        steps = [step for step in trace.get("steps", []) if isinstance(step, dict)]
+        url = trace.get("url") or ""
+        domain = urlparse(url).netloc.lower()
+        if domain.startswith("www."):
+            domain = domain[4:]
+        kind = trace.get("kind", "url")
+        total_duration = sum(float(step.get("duration") or 0) for step in steps)
+        _add_to_rollups(conn, [(created_at, kind, domain, trace.get("status"), total_duration)],
+                        [(created_at, kind, step.get("name", "?"), float(step.get("duration") or 0), bool(step.get("success"))) for step in steps])
+        conn.execute(
+            "INSERT OR REPLACE INTO trace_summaries (trace_id, kind, url, domain, status, error, start_time, created_at, total_duration, steps, size, raw_size) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (trace_id, kind, url, domain, trace.get("status"), (trace.get("error") or "")[:500] or None,
+             trace.get("start_time"), created_at, total_duration, len(steps), size, raw_size)
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO trace_steps (trace_id, position, name, duration, success, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            [(trace_id, position, step.get("name", "?"), float(step.get("duration") or 0), int(bool(step.get("success"))), created_at)
+             for position, step in enumerate(steps)]
+        )
+
+    # Stores written before the summaries existed get them on first open, this reads every trace without one once.
+    def _backfill_summaries(self, conn: sqlite3.Connection) -> None:
+        rows = conn.execute(
+            "SELECT t.trace_id, t.created_at, t.body, t.size FROM traces t LEFT JOIN trace_summaries s ON s.trace_id = t.trace_id WHERE s.trace_id IS NULL"
+        ).fetchall()
+        if not rows:
+            return
+        conn.execute("BEGIN")
+        try:
+            for trace_id, created_at, body, size in rows:
+                raw = zlib.decompress(body)
+                self._write_summary(conn, trace_id, json.loads(raw), created_at, size, len(raw))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    # This method replaces every long string of a trace with {"$blob": hash} and collects the strings by hash.
+    def _split_blobs(self, value, blobs: dict):
+        if isinstance(value, dict):
+            return {key: self._split_blobs(item, blobs) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._split_blobs(item, blobs) for item in value]
+        if isinstance(value, str) and len(value) >= self.blob_min_size:
+            digest = hashlib.sha256(value.encode()).hexdigest()
+            blobs[digest] = value
+            return {"$blob": digest}
+        return value
+
+    def _join_blobs(self, value, blobs: dict):
+        if isinstance(value, dict):
+            if set(value.keys()) == {"$blob"}:
+                return blobs.get(value["$blob"], "")
+            return {key: self._join_blobs(item, blobs) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._join_blobs(item, blobs) for item in value]
+        return value
+
+    # This method writes one trace right away, in the calling thread. save() is the one the pipelines use.
+    def write(self, trace: dict, created_at: float = None) -> str:
+        trace_id = trace.get("trace_id") or uuid.uuid4().hex
+        blobs = {}
+        raw = json.dumps(self._split_blobs({**trace, "trace_id": trace_id}, blobs), default=str).encode()
+        body = zlib.compress(raw)
+        created_at = created_at or time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN")
+            try:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO traces (trace_id, kind, url, status, start_time, created_at, body, size) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (trace_id, trace.get("kind", "url"), trace.get("url"), trace.get("status"), trace.get("start_time"),
+                     created_at, body, len(body))
+                )
+                if cursor.rowcount:
+                    self._write_summary(conn, trace_id, trace, created_at, len(body), len(raw) + sum(len(text) for text in blobs.values()))
+                    for digest, text in blobs.items():
+                        # Only new texts are compressed, the ones that are already stored just get another reference
+                        if conn.execute("SELECT 1 FROM trace_blobs WHERE hash = ?", (digest,)).fetchone() is None:
+                            data = zlib.compress(text.encode())
+                            conn.execute("INSERT INTO trace_blobs (hash, data, size, raw_size) VALUES (?, ?, ?, ?)", (digest, data, len(data), len(text)))
+                        conn.execute("INSERT OR IGNORE INTO trace_blob_refs (trace_id, hash) VALUES (?, ?)", (trace_id, digest))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            self._writes += 1
+            if self._writes % self.retention_every == 0:
+                self._apply_retention(conn)
+        return trace_id
+
+    # This method hands a trace to the writer thread and returns straight away. If the writer can't keep up the trace is dropped.
+    def save(self, trace: dict) -> str:
+        if not isinstance(trace, dict):
+            raise ValueError(f"trace_data must be a dictionary, got {type(trace)}")
+        trace = {**trace, "trace_id": trace.get("trace_id") or uuid.uuid4().hex}
+        self._start_writer()
+        try:
+            self._queue.put_nowait((trace, time.time()))
+        except queue.Full:
+            self.dropped += 1
+            print(f"Trace store queue is full, dropped trace {trace['trace_id']}")
+        return trace["trace_id"]
+
+    def _start_writer(self) -> None:
+        with self._writer_lock:
+            # A forked worker doesn't inherit the writer thread of its parent
+            if self._writer is not None and self._writer.is_alive() and self._writer_pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._writer = threading.Thread(target=self._write_loop, args=(self._queue,), name="trace-writer", daemon=True)
+            self._writer_pid = os.getpid()
+            self._writer.start()
+
+    def _write_loop(self, traces: queue.Queue) -> None:
+        while True:
+            trace, created_at = traces.get()
+            try:
+                self.write(trace, created_at)
+            except Exception as e:
+                print(f"Error writing trace {trace.get('trace_id')}: {str(e)}")
+            finally:
+                traces.task_done()
+
+    # This method waits until the writer has written everything that was saved so far, the worker calls it before it exits.
+    def flush(self, timeout: float = 10) -> bool:
+        if self._queue is None:
+            return True
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks:
+            if time.time() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    # This method removes the traces that are too old, then the oldest ones until the store fits in max_bytes, and the blobs nobody uses anymore.
+    def _apply_retention(self, conn: sqlite3.Connection) -> None:
+        conn.execute("BEGIN")
+        try:
+            expired = [row[0] for row in conn.execute(
+                "SELECT trace_id FROM traces WHERE created_at < ?", (time.time() - self.retention_days * 86400,)
+            ).fetchall()]
+            size = conn.execute("SELECT (SELECT COALESCE(SUM(size), 0) FROM traces) + (SELECT COALESCE(SUM(size), 0) FROM trace_blobs)").fetchone()[0]
+            if size > self.max_bytes:
+                # The blobs are shared, so the size a trace frees is only estimated by its share of them
+                for trace_id, trace_size, blob_size in conn.execute("""
+                    SELECT t.trace_id, t.size, COALESCE(SUM(b.size * 1.0 / (SELECT COUNT(*) FROM trace_blob_refs r2 WHERE r2.hash = b.hash)), 0)
+                    FROM traces t LEFT JOIN trace_blob_refs r ON r.trace_id = t.trace_id LEFT JOIN trace_blobs b ON b.hash = r.hash
+                    GROUP BY t.id ORDER BY t.created_at
+                """).fetchall():
+                    if size <= self.max_bytes:
+                        break
+                    expired.append(trace_id)
+                    size -= trace_size + blob_size
+            for start in range(0, len(expired), 500):
+                chunk = expired[start:start + 500]
+                marks = ",".join("?" * len(chunk))
+                conn.execute(f"DELETE FROM traces WHERE trace_id IN ({marks})", chunk)
+                conn.execute(f"DELETE FROM trace_blob_refs WHERE trace_id IN ({marks})", chunk)
+                # The rollups forget the removed traces too, only the maximum duration of an hour can't be taken back
+                _add_to_rollups(
+                    conn,
+                    conn.execute(f"SELECT created_at, kind, domain, status, total_duration FROM trace_summaries WHERE trace_id IN ({marks})", chunk).fetchall(),
+                    conn.execute(f"SELECT st.created_at, s.kind, st.name, st.duration, st.success FROM trace_steps st JOIN trace_summaries s ON s.trace_id = st.trace_id WHERE st.trace_id IN ({marks})", chunk).fetchall(),
+                    sign=-1
+                )
+                conn.execute(f"DELETE FROM trace_summaries WHERE trace_id IN ({marks})", chunk)
+                conn.execute(f"DELETE FROM trace_steps WHERE trace_id IN ({marks})", chunk)
+            conn.execute("DELETE FROM trace_blobs WHERE hash NOT IN (SELECT hash FROM trace_blob_refs)")
+            conn.execute("DELETE FROM trace_rollups WHERE traces <= 0")
+            conn.execute("DELETE FROM trace_step_histograms WHERE count <= 0")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def apply_retention(self) -> None:
+        with self._lock:
+            self._apply_retention(self._connection())
+
+    # This method lists the summaries of the most recent traces, newest first, optionally only those since a time (epoch seconds) or of one kind or status.
+    def list_traces(self, limit: int = 1000, since: float = None, kind: str = None, status: str = None) -> list:
+        query = "SELECT trace_id, kind, url, domain, status, error, start_time, created_at, total_duration, steps, size, raw_size FROM trace_summaries WHERE created_at >= ?"
+        params = [since or 0]
+        if kind:
+            query += " AND kind = ?"
+            params.append(kind)
+        if status:
+            query += " AND status = ?"
+            params.append(status)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._connection().execute(query, params).fetchall()
+        columns = ("trace_id", "kind", "url", "domain", "status", "error", "start_time", "created_at", "total_duration", "steps", "size", "raw_size")
+        return [dict(zip(columns, row)) for row in rows]
+
+    # This method returns the p50/p95/p99 duration of every step of the traces since a time, with how often it ran and failed.
+    # The percentiles come from the hourly histograms, so they are exact to about 5% and the window starts at the beginning of an hour.
+    def step_percentiles(self, since: float = None, kind: str = None) -> list:
+        query = "SELECT name, bucket, SUM(count), SUM(failed) FROM trace_step_histograms WHERE hour >= ?"
+        params = [int((since or 0) // 3600)]
+        if kind:
+            query += " AND kind = ?"
+            params.append(kind)
+        query += " GROUP BY name, bucket ORDER BY name, bucket"
+        with self._lock:
+            rows = self._connection().execute(query, params).fetchall()
+        histograms = {}
+        for name, bucket, count, failed in rows:
+            histograms.setdefault(name, []).append((bucket, count, failed))
+        result = []
+        for name, buckets in histograms.items():
+            total = sum(count for _, count, _ in buckets)
+            if total <= 0:
+                continue
+            result.append({
+                "step": name,
+                "count": total,
+                "failed": sum(failed for _, _, failed in buckets),
+                "p50": _histogram_percentile(buckets, total, 0.50),
+                "p95": _histogram_percentile(buckets, total, 0.95),
+                "p99": _histogram_percentile(buckets, total, 0.99),
+                "max": _bucket_value(buckets[-1][0])
+            })
+        return sorted(result, key=lambda row: -row["p95"])
+
+    # This method returns the slowest domains since a time by their average total duration (from the hourly rollups),
+    # or with by="url" the slowest single traces (through the index on total_duration).
+    def slowest(self, since: float = None, by: str = "url", limit: int = 20) -> list:
+        with self._lock:
+            conn = self._connection()
+            if by == "domain":
+                rows = conn.execute(
+                    "SELECT domain, SUM(traces), SUM(duration_sum) / SUM(traces), MAX(duration_max), SUM(errors) FROM trace_rollups "
+                    "WHERE hour >= ? GROUP BY domain HAVING SUM(traces) > 0 ORDER BY 3 DESC LIMIT ?",
+                    (int((since or 0) // 3600), limit)
+                ).fetchall()
+                return [{"domain": row[0], "traces": row[1], "avg_duration": row[2], "max_duration": row[3], "errors": row[4]} for row in rows]
+            if by == "url":
+                rows = conn.execute(
+                    "SELECT url, kind, status, start_time, total_duration, trace_id FROM trace_summaries "
+                    "WHERE created_at >= ? ORDER BY total_duration DESC LIMIT ?",
+                    (since or 0, limit)
+                ).fetchall()
+                return [dict(zip(("url", "kind", "status", "start_time", "duration", "trace_id"), row)) for row in rows]
+        raise ValueError(f"Can't group traces by {by}")
+
+    # This method returns the number of traces and the share of errors per kind since a time, per bucket of bucket_seconds (a multiple of an hour).
+    def error_rates(self, since: float = None, bucket_seconds: int = 3600) -> list:
+        hours = max(1, bucket_seconds // 3600)
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT (hour / ?) * ? * 3600, kind, SUM(traces), SUM(errors) FROM trace_rollups "
+                "WHERE hour >= ? GROUP BY 1, 2 HAVING SUM(traces) > 0 ORDER BY 1",
+                (hours, hours, int((since or 0) // 3600))
+            ).fetchall()
+        return [{"bucket": row[0], "kind": row[1], "traces": row[2], "errors": row[3], "error_rate": row[3] / row[2]} for row in rows]
+
+    # This method returns the whole trace, with its blobs put back in, None if there is no such trace.
+    def load(self, trace_id: str):
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT body FROM traces WHERE trace_id = ?", (trace_id,)).fetchone()
+            if row is None:
+                return None
+            blobs = {
+                digest: zlib.decompress(data).decode()
+                for digest, data in conn.execute(
+                    "SELECT b.hash, b.data FROM trace_blobs b JOIN trace_blob_refs r ON r.hash = b.hash WHERE r.trace_id = ?", (trace_id,)
+                ).fetchall()
+            }
+        return self._join_blobs(json.loads(zlib.decompress(row[0])), blobs)
+
+    # This method returns how many traces and blobs there are and how much space they take, compressed and not.
+    def stats(self) -> dict:
+        with self._lock:
+            conn = self._connection()
+            traces, trace_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM traces").fetchone()
+            blobs, blob_bytes, raw_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(raw_size), 0) FROM trace_blobs").fetchone()
+        return {"traces": traces, "trace_bytes": trace_bytes, "blobs": blobs, "blob_bytes": blob_bytes, "blob_raw_bytes": raw_bytes, "dropped": self.dropped}
+
+    # This method imports the traces/trace_*.json files of the old format, a file that was imported already is skipped.
+    def import_legacy(self, directory: str = "traces") -> int:
+        imported = 0
+        for trace_file in sorted(Path(directory).glob("trace_*.json")):
+            trace_id = f"legacy-{trace_file.stem}"
+            with self._lock:
+                if self._connection().execute("SELECT 1 FROM traces WHERE trace_id = ?", (trace_id,)).fetchone():
+                    continue
+            try:
+                with open(trace_file) as f:
+                    trace = json.load(f)
+                created_at = datetime.fromisoformat(trace["start_time"]).timestamp() if trace.get("start_time") else trace_file.stat().st_mtime
+                self.write({**trace, "trace_id": trace_id}, created_at)
+                imported += 1
+            except Exception as e:
+                print(f"Error importing {trace_file}: {str(e)}")
+        return imported
+
+# The step durations are counted in buckets that are 5% wide, from a millisecond up
+BUCKET_GROWTH = math.log(1.05)
+
+def _bucket(duration: float) -> int:
+    return int(math.log1p(max(duration, 0.0) * 1000) / BUCKET_GROWTH)
+
+# This function returns the duration in the middle of a bucket, in seconds.
+def _bucket_value(bucket: int) -> float:
+    return math.expm1((bucket + 0.5) * BUCKET_GROWTH) / 1000
+
+# This function returns the duration below which the given share of a histogram [(bucket, count, failed)] falls (nearest rank).
+def _histogram_percentile(buckets: list, total: int, share: float) -> float:
+    rank = max(1, math.ceil(share * total))
+    seen = 0
+    for bucket, count, _ in buckets:
+        seen += count
+        if seen >= rank:
+            return _bucket_value(bucket)
+    return _bucket_value(buckets[-1][0])
+
+# This function adds traces [(created_at, kind, domain, status, total_duration)] and their steps [(created_at, kind, name, duration, success)]
+# to the hourly rollups, or takes them out again with sign=-1.
+def _add_to_rollups(conn: sqlite3.Connection, traces: list, steps: list, sign: int = 1) -> None:
+    conn.executemany(
+        "INSERT INTO trace_rollups (hour, kind, domain, traces, errors, duration_sum, duration_max) VALUES (?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (hour, kind, domain) DO UPDATE SET traces = traces + excluded.traces, errors = errors + excluded.errors, "
+        "duration_sum = duration_sum + excluded.duration_sum, duration_max = MAX(duration_max, excluded.duration_max)",
+        [(int(created_at // 3600), kind, domain or "", sign, sign * int(status == "error"), sign * duration, duration if sign > 0 else 0.0)
+         for created_at, kind, domain, status, duration in traces]
+    )
+    conn.executemany(
+        "INSERT INTO trace_step_histograms (hour, kind, name, bucket, count, failed) VALUES (?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (hour, kind, name, bucket) DO UPDATE SET count = count + excluded.count, failed = failed + excluded.failed",
+        [(int(created_at // 3600), kind, name, _bucket(duration), sign, sign * int(not success))
+         for created_at, kind, name, duration, success in steps]
+    )
+
+_trace_store = None
+
+# This function returns the trace store of the current process.
+def get_trace_store() -> TraceStore:
+    global _trace_store
+    if _trace_store is None:
+        _trace_store = TraceStore()
+    return _trace_store
+
+# This function records the metrics of a trace and saves it in the background, it returns the id of the trace.
+def save_trace(trace: dict) -> str:
+    observe_trace(trace)
+    return get_trace_store().save(trace)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the trace store")
+    parser.add_argument('command', choices=['import', 'stats', 'retention'])
+    parser.add_argument('--directory', default='traces', help="Folder of the old trace_*.json files, for import")
+    args = parser.parse_args()
+    store = get_trace_store()
+    if args.command == 'import':
+        print(f"Imported {store.import_legacy(args.directory)} traces")
+    elif args.command == 'retention':
+        store.apply_retention()
+    print(store.stats())
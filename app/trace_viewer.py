@@ -1,43 +1,127 @@
 import streamlit as st
-import json
-from pathlib import Path
+import time
 import pandas as pd
+from app.trace_store import get_trace_store
+
+# The time windows the aggregates can be computed over, in seconds
+WINDOWS = {
+    "Last hour": 3600,
+    "Last 24 hours": 86400,
+    "Last 7 days": 7 * 86400,
+    "Last 30 days": 30 * 86400
+}
 
 def view_traces():
     st.title("Content Processor Traces")
 
-    traces_dir = Path("traces")
-    trace_files = list(traces_dir.glob("trace_*.json"))
+    # Import the traces of the old one-file-per-run format with: python -m app.trace_store import
+    # Everything but the selected trace comes from the summary tables, so opening the viewer doesn't read any trace body
+    store = get_trace_store()
+    window = st.sidebar.selectbox("Time window", list(WINDOWS.keys()), index=1)
+    kind = st.sidebar.selectbox("Kind", ["all", "url", "blog", "comparison"])
+    since = time.time() - WINDOWS[window]
+    kind = None if kind == "all" else kind
+
+    traces_tab, latency_tab, slowest_tab, errors_tab = st.tabs(["Traces", "Step Latency", "Slowest", "Errors"])
+
+    with latency_tab:
+        percentiles = store.step_percentiles(since, kind)
+        if percentiles:
+            st.dataframe(pd.DataFrame(percentiles).set_index("step").style.format(
+                {"p50": "{:.2f}s", "p95": "{:.2f}s", "p99": "{:.2f}s", "max": "{:.2f}s"}
+            ))
+        else:
+            st.info("No traces in this window")
+
+    with slowest_tab:
+        st.subheader("Slowest Domains")
+        st.dataframe(pd.DataFrame(store.slowest(since, by="domain")))
+        st.subheader("Slowest URLs")
+        st.dataframe(pd.DataFrame(store.slowest(since, by="url")))
 
-    traces_data = []
-    for trace_file in trace_files:
-        with open(trace_file) as f:
-            trace = json.load(f)
-            total_duration = sum(step["duration"] for step in trace["steps"])
+    with errors_tab:
+        rates = pd.DataFrame(store.error_rates(since, bucket_seconds=3600 if WINDOWS[window] <= 86400 else 86400))
+        if not rates.empty:
+            totals = rates.groupby("kind")[["traces", "errors"]].sum()
+            totals["error_rate"] = totals["errors"] / totals["traces"]
+            st.dataframe(totals)
+            rates["time"] = pd.to_datetime(rates["bucket"], unit="s")
+            st.line_chart(rates.pivot_table(index="time", columns="kind", values="error_rate", fill_value=0))
+            st.subheader("Recent Errors")
+            st.dataframe(pd.DataFrame(store.list_traces(50, since, kind, status="error"))[["start_time", "kind", "url", "error"]])
+        else:
+            st.info("No traces in this window")
+
+    with traces_tab:
+        traces = store.list_traces(1000, since, kind)
+        traces_data = []
+        for trace in traces:
             traces_data.append({
                 "Timestamp": trace["start_time"],
+                "Kind": trace["kind"],
                 "URL": trace["url"],
                 "Status": trace["status"],
-                "Total Duration": f"{total_duration:.2f}s",
-                "File": trace_file.name
+                "Total Duration": f"{trace['total_duration']:.2f}s",
+                "Size": f"{trace['raw_size'] / 1024:.1f} KB",
+                "Trace": trace["trace_id"]
             })
-    
-    df = pd.DataFrame(traces_data)
-    st.dataframe(df)
+        st.dataframe(pd.DataFrame(traces_data))
 
     # View detailed trace
-    selected_trace = st.selectbox("Select trace to view details", trace_files)
+    selected_trace = st.selectbox("Select trace to view details", [trace["trace_id"] for trace in traces])
     if selected_trace:
-        with open(selected_trace) as f:
-            trace = json.load(f)
+        trace = store.load(selected_trace)
+        total_duration = sum(step["duration"] for step in trace["steps"])
 
         st.header("Trace Details")
+        st.caption(f"Total duration {total_duration:.2f}s")
+        if trace.get("error"):
+            st.error(trace["error"])
 
         # Show steps timing
         st.subheader("Steps")
-        steps_df = pd.DataFrame(trace["steps"])
+        steps_df = pd.DataFrame(trace["steps"]).drop(columns=["summaries", "extraction", "screening", "comparison"], errors="ignore")
         st.dataframe(steps_df)
-        
+
+        # Show whether the article came from the local extraction or from the LLM
+        extraction = next((step.get("extraction") for step in trace["steps"] if step.get("extraction")), None)
+        if extraction:
+            st.subheader("Article Extraction")
+            st.json(extraction)
+
+        # Show how long every secondary article summary took, so the slow ones stand out
+        summary_timings = next((step.get("summaries") for step in trace["steps"] if step.get("summaries")), None)
+        if summary_timings:
+            st.subheader("Secondary Article Summaries")
+            st.dataframe(pd.DataFrame(summary_timings).sort_values("duration", ascending=False))
+
+        # Show how many articles of a blog scan every screening tier decided and how long it took
+        if trace.get("screening"):
+            st.subheader("Screening Tiers")
+            tiers = {name: tier for name, tier in trace["screening"].items() if isinstance(tier, dict)}
+            st.dataframe(pd.DataFrame(tiers).T)
+            st.json({name: value for name, value in trace["screening"].items() if not isinstance(value, dict)})
+
+        # Show what a single comparison sent and got back
+        if trace.get("comparison"):
+            st.subheader("Comparison")
+            st.text_area("LLM Response", trace["comparison"]["llm_response"], height=80)
+            st.text_area("Article", trace["comparison"]["article"], height=200)
+
+        if "content" not in trace:
+            return
+
+        # The formatted prompt isn't stored anymore, it is put back together from the template and the articles
+        final_prompt = trace["content"].get("final_prompt")
+        if final_prompt is None and "prompt_template" in trace["content"]:
+            try:
+                final_prompt = trace["content"]["prompt_template"].format(
+                    primary=trace["content"].get("article_preview", ""),
+                    secondary=trace["content"].get("secondary_articles", "")
+                )
+            except (KeyError, IndexError, ValueError):
+                final_prompt = None
+
         # Add tabs for different content views
         tab1, tab2, tab3 = st.tabs(["Process Steps", "Final LLM Prompt", "Results"])
         
@@ -53,11 +137,11 @@ def view_traces():
             st.text_area("Template", trace["content"].get("prompt_template", "Not found"), height=200)
             
             st.subheader("Final Formatted Prompt")
-            st.text_area("Exact Prompt Sent to LLM", trace["content"].get("final_prompt", "Not found"), height=400)
+            st.text_area("Exact Prompt Sent to LLM", final_prompt or "Not found", height=400)
         
         with tab3:
             st.subheader("Generated Tweets")
-            for i, tweet in enumerate(trace["content"]["tweets"], 1):
+            for i, tweet in enumerate(trace["content"].get("tweets", []), 1):
                 st.text_area(f"Tweet {i}", tweet, height=100)
 
 
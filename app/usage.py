@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from app.api.usage_operations import add_usage, get_spend_since, get_monthly_budget
+
+# USD per million tokens (prompt, completion). A dated model name (gpt-4o-mini-2024-07-18) takes the price of the longest name it starts with,
+# a model that isn't listed costs USAGE_DEFAULT_PROMPT_PRICE / USAGE_DEFAULT_COMPLETION_PRICE.
+MODEL_PRICES = {
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4-turbo': (10.00, 30.00),
+    'gpt-4': (30.00, 60.00),
+    'gpt-3.5-turbo': (0.50, 1.50),
+    'text-embedding-3-small': (0.02, 0.0),
+    'text-embedding-3-large': (0.13, 0.0)
+}
+
+# The user whose work is running, the pipeline methods set it so that every LLM call below them is accounted to that user.
+# asyncio tasks and asyncio.to_thread take it with them.
+usage_user_id = ContextVar('usage_user_id', default=None)
+
+class BudgetExceededError(Exception):
+    pass
+
+def _model_name(model: str) -> str:
+    return (model or 'unknown').split('/')[-1]
+
+# This function returns what a call cost in USD.
+def token_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    name = _model_name(model)
+    matches = [known for known in MODEL_PRICES if name.startswith(known)]
+    if matches:
+        prompt_price, completion_price = MODEL_PRICES[max(matches, key=len)]
+    else:
+        prompt_price = float(os.environ.get('USAGE_DEFAULT_PROMPT_PRICE', 2.50))
+        completion_price = float(os.environ.get('USAGE_DEFAULT_COMPLETION_PRICE', 10.00))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+def _month_start():
+    return datetime.now(timezone.utc).date().replace(day=1)
+
+# This class adds up the LLM usage of the worker per user, day, call site and model and writes it to the llm_usage table
+# every USAGE_FLUSH_INTERVAL seconds (in a background thread), so the calls themselves never wait for the database.
+# It also answers whether a user went over their monthly budget, from the database plus what it hasn't written yet.
+class UsageRecorder:
+    def __init__(self, flush_interval: float = None, budget_check_interval: float = None) -> None:
+        self.flush_interval = flush_interval if flush_interval is not None else float(os.environ.get('USAGE_FLUSH_INTERVAL', 10))
+        self.budget_check_interval = budget_check_interval if budget_check_interval is not None else float(os.environ.get('USAGE_BUDGET_CHECK_INTERVAL', 30))
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._flushing = False
+        self._budgets = {}
+
+    # This method records one LLM call. Calls the LLM cache answered are counted as cached and cost nothing.
+    # Calls made outside of the work of a user (e.g. the command line tools) aren't recorded.
+    def record(self, call_site: str, model: str, prompt_tokens: int = 0, completion_tokens: int = 0, cached: bool = False, user_id: int = None) -> None:
+        user_id = user_id if user_id is not None else usage_user_id.get()
+        if user_id is None:
+            return
+        prompt_tokens = int(prompt_tokens or 0)
+        completion_tokens = int(completion_tokens or 0)
+        key = (user_id, datetime.now(timezone.utc).date(), call_site, _model_name(model))
+        with self._lock:
+            row = self._pending.setdefault(key, {"calls": 0, "cached_calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0})
+            row["calls"] += 1
+            if cached:
+                row["cached_calls"] += 1
+            else:
+                row["prompt_tokens"] += prompt_tokens
+                row["completion_tokens"] += completion_tokens
+                row["cost"] += token_cost(model, prompt_tokens, completion_tokens)
+            due = not self._flushing and time.monotonic() - self._last_flush >= self.flush_interval
+            if due:
+                self._flushing = True
+        if due:
+            threading.Thread(target=self.flush, name="usage-flush", daemon=True).start()
+
+    # This method writes the usage that was recorded since the last flush. Rows that can't be written are kept for the next one.
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._last_flush = time.monotonic()
+            try:
+                add_usage([
+                    {"user_id": user_id, "day": day, "call_site": call_site, "model": model, **counters}
+                    for (user_id, day, call_site, model), counters in pending.items()
+                ])
+            except Exception as e:
+                print(f"Error writing the LLM usage: {str(e)}")
+                with self._lock:
+                    for key, counters in pending.items():
+                        row = self._pending.setdefault(key, {column: 0 for column in counters})
+                        for column, value in counters.items():
+                            row[column] += value
+            finally:
+                self._flushing = False
+
+    def _pending_cost(self, user_id: int, since) -> float:
+        with self._lock:
+            return sum(counters["cost"] for (pending_user, day, _, _), counters in self._pending.items() if pending_user == user_id and day >= since)
+
+    # This method returns the budget and what the user spent this month (USD). Both are read from the database
+    # at most every USAGE_BUDGET_CHECK_INTERVAL seconds, the spend of this worker since then is added on top.
+    def month_spend(self, user_id: int) -> tuple:
+        now = time.monotonic()
+        month_start = _month_start()
+        cached = self._budgets.get(user_id)
+        if cached is None or now - cached["checked"] > self.budget_check_interval or cached["month"] != month_start:
+            # What this worker hasn't written yet would otherwise be missing from the total until the next check
+            self.flush()
+            cached = {"budget": get_monthly_budget(user_id), "spend": get_spend_since(user_id, month_start), "month": month_start, "checked": now}
+            self._budgets[user_id] = cached
+            return cached["budget"], cached["spend"]
+        return cached["budget"], cached["spend"] + self._pending_cost(user_id, month_start)
+
+    # This method tells whether a user spent their monthly budget. Users without a budget never do.
+    def over_budget(self, user_id: int) -> bool:
+        budget, spend = self.month_spend(user_id)
+        return budget is not None and spend >= budget
+
+    # The settings page calls this after the user changed their budget, so it applies straight away in this worker (the others read it again within budget_check_interval).
+    def forget_budget(self, user_id: int) -> None:
+        self._budgets.pop(user_id, None)
+
+_usage_recorder = None
+
+# This function returns the usage recorder of the current worker.
+def get_usage_recorder() -> UsageRecorder:
+    global _usage_recorder
+    if _usage_recorder is None:
+        _usage_recorder = UsageRecorder()
+    return _usage_recorder
+
+# This function records one LLM call for the user whose work is running.
+def record_usage(call_site: str, model: str, prompt_tokens: int = 0, completion_tokens: int = 0, cached: bool = False) -> None:
+    get_usage_recorder().record(call_site, model, prompt_tokens, completion_tokens, cached)
+
+# This function raises BudgetExceededError when a user spent their monthly budget, the work that can't do without the LLM calls it first.
+def check_budget(user_id: int) -> None:
+    if get_usage_recorder().over_budget(user_id):
+        raise BudgetExceededError("The monthly LLM budget of this account is used up, raise it in the settings to continue")
@@ -1,8 +1,13 @@
+import os
+
 # Reduce to 2 workers due to limited RAM
-workers = 2
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# The workers split the LLM rate limits between them (see app/llm_scheduler.py), so they have to know how many they are
+os.environ['WEB_CONCURRENCY'] = str(workers)
 
-# Use async worker to handle concurrent requests efficiently
-worker_class = 'sync'
+# Threaded workers, so that the open event streams of the job pages don't take a whole worker each
+worker_class = 'gthread'
+threads = 8
 
 # Bind to all network interfaces
 bind = "0.0.0.0:10000"
@@ -19,7 +24,40 @@ worker_tmp_dir = '/dev/shm'
 worker_connections = 250
 
 
+# Every worker writes its metrics to this folder, so /metrics can add up the workers whatever worker answers the scrape.
+# It has to be set before the workers import the app.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/dev/shm/audience-builder-metrics')
+
 # Logging
 accesslog = '-'
 errorlog = '-'
-loglevel = 'info'
\ No newline at end of file
+loglevel = 'info'
+
+# The metrics of the previous run of the server would otherwise be added to the new ones
+def on_starting(server):
+    import shutil
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+# The metric files of a worker that exited are folded into the totals, otherwise every worker recycled by max_requests
+# would leave its files behind and every scrape would read more of them
+def child_exit(server, worker):
+    from app.metrics import archive_dead_worker
+    archive_dead_worker(worker.pid)
+
+# Start the background job executors of the worker as soon as it has booted
+def post_worker_init(worker):
+    from app.jobs import get_job_runner
+    get_job_runner().start()
+
+# Put the worker's running jobs back in the queue, close its shared headless browser and write its last traces and LLM usage before the worker goes away
+def worker_exit(server, worker):
+    from app.jobs import shutdown_job_runner
+    from app.browser_pool import shutdown_crawler_pool
+    from app.trace_store import get_trace_store
+    from app.usage import get_usage_recorder
+    shutdown_job_runner()
+    shutdown_crawler_pool()
+    get_trace_store().flush()
+    get_usage_recorder().flush()
@@ -0,0 +1,48 @@
+import os
+
+# The async serving mode: the ASGI app (app/asgi.py) on uvicorn workers.
+# Every worker has a single event loop that the jobs, the shared browser and the async views run on, so one worker can wait on many
+# slow crawls and LLM calls at the same time. The job event streams and the async views don't hold a thread while they wait,
+# the synchronous parts of the requests share ASGI_WSGI_THREADS threads.
+wsgi_app = 'app.asgi:application'
+worker_class = 'uvicorn.workers.UvicornWorker'
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# The workers split the LLM rate limits between them (see app/llm_scheduler.py), so they have to know how many they are
+os.environ['WEB_CONCURRENCY'] = str(workers)
+
+# Bind to all network interfaces
+bind = "0.0.0.0:10000"
+
+# Keep timeout high for long-running processes
+timeout = 600
+
+# Aggressive memory management
+max_requests = 50
+max_requests_jitter = 5
+
+# Reduce worker memory footprint
+worker_tmp_dir = '/dev/shm'
+
+# Every worker writes its metrics to this folder, so /metrics can add up the workers whatever worker answers the scrape.
+# It has to be set before the workers import the app.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/dev/shm/audience-builder-metrics')
+
+# Logging
+accesslog = '-'
+errorlog = '-'
+loglevel = 'info'
+
+# The metrics of the previous run of the server would otherwise be added to the new ones
+def on_starting(server):
+    import shutil
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+# The metric files of a worker that exited are folded into the totals, otherwise every worker recycled by max_requests
+# would leave its files behind and every scrape would read more of them
+def child_exit(server, worker):
+    from app.metrics import archive_dead_worker
+    archive_dead_worker(worker.pid)
+
+# The job executors are started and stopped by the lifespan of the ASGI app, once the loop of the server is running
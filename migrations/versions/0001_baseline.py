@@ -0,0 +1,73 @@
+"""The tables the app shipped with
+
+Revision ID: 0001_baseline
+Revises:
+Create Date: 2026-10-18 12:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001_baseline'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('email', sa.String(length=120), nullable=False, unique=True),
+        sa.Column('password_hash', sa.String(length=1024), nullable=False),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.Column('openai_api_key', sa.String(length=1024), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('is_onboarded', sa.Boolean(), nullable=True)
+    )
+    op.create_table(
+        'prompts',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('type', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('description', sa.Text(), nullable=True),
+        sa.Column('template', sa.Text(), nullable=False),
+        sa.Column('input_variables', sa.Text(), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True)
+    )
+    op.create_table(
+        'profiles',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('username', sa.String(length=50), nullable=True, unique=True),
+        sa.Column('full_name', sa.String(length=50), nullable=True),
+        sa.Column('bio', sa.Text(), nullable=True),
+        sa.Column('interests_description', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True)
+    )
+    op.create_table(
+        'online_articles',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('url', sa.String(length=500), nullable=False),
+        sa.Column('title', sa.Text(), nullable=True),
+        sa.Column('source_blog', sa.String(length=200), nullable=True),
+        sa.Column('profile_fit', sa.Boolean(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True)
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('online_articles')
+    op.drop_table('profiles')
+    op.drop_table('prompts')
+    op.drop_table('users')
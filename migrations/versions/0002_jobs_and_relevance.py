@@ -0,0 +1,69 @@
+"""Background jobs, profile embeddings and online_articles.fit_source
+
+Revision ID: 0002_jobs_and_relevance
+Revises: 0001_baseline
+Create Date: 2026-10-18 12:31:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002_jobs_and_relevance'
+down_revision: Union[str, None] = '0001_baseline'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# init_db() may already have created the new tables (not the new columns) on some databases, those are skipped
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    tables = inspector.get_table_names()
+
+    if 'jobs' not in tables:
+        op.create_table(
+            'jobs',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+            sa.Column('kind', sa.String(length=50), nullable=False),
+            sa.Column('url', sa.String(length=500), nullable=False),
+            sa.Column('status', sa.String(length=20), nullable=False),
+            sa.Column('current_step', sa.String(length=100), nullable=True),
+            sa.Column('steps', sa.Text(), nullable=True),
+            sa.Column('result', sa.Text(), nullable=True),
+            sa.Column('partial_result', sa.Text(), nullable=True),
+            sa.Column('error', sa.Text(), nullable=True),
+            sa.Column('attempts', sa.Integer(), nullable=False),
+            sa.Column('worker_id', sa.String(length=100), nullable=True),
+            sa.Column('heartbeat_at', sa.DateTime(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('started_at', sa.DateTime(), nullable=True),
+            sa.Column('finished_at', sa.DateTime(), nullable=True)
+        )
+    elif 'partial_result' not in [column['name'] for column in inspector.get_columns('jobs')]:
+        op.add_column('jobs', sa.Column('partial_result', sa.Text(), nullable=True))
+
+    if 'profile_embeddings' not in tables:
+        op.create_table(
+            'profile_embeddings',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('profile_id', sa.Integer(), sa.ForeignKey('profiles.id'), nullable=False),
+            sa.Column('embedder', sa.String(length=100), nullable=False),
+            sa.Column('dimensions', sa.Integer(), nullable=False),
+            sa.Column('vector', sa.LargeBinary(), nullable=False),
+            sa.Column('text_hash', sa.String(length=64), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+            sa.UniqueConstraint('profile_id', 'embedder')
+        )
+
+    if 'fit_source' not in [column['name'] for column in inspector.get_columns('online_articles')]:
+        op.add_column('online_articles', sa.Column('fit_source', sa.String(length=20), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('online_articles', 'fit_source')
+    op.drop_table('profile_embeddings')
+    op.drop_table('jobs')
@@ -0,0 +1,57 @@
+"""One online_articles row per user and normalised url
+
+Revision ID: 0003_online_articles_normalized_url
+Revises: 0002_jobs_and_relevance
+Create Date: 2026-10-18 12:32:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from app.url_utils import normalize_url
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003_online_articles_normalized_url'
+down_revision: Union[str, None] = '0002_jobs_and_relevance'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+online_articles = sa.table(
+    'online_articles',
+    sa.column('id', sa.Integer),
+    sa.column('user_id', sa.Integer),
+    sa.column('url', sa.String),
+    sa.column('normalized_url', sa.String)
+)
+
+
+def upgrade() -> None:
+    op.add_column('online_articles', sa.Column('normalized_url', sa.String(length=500), nullable=True))
+
+    # Every scan used to insert a new row per link, only the most recent row of every (user, url) is kept
+    bind = op.get_bind()
+    rows = bind.execute(sa.select(online_articles.c.id, online_articles.c.user_id, online_articles.c.url).order_by(online_articles.c.id)).all()
+    latest = {}
+    for row in rows:
+        latest[(row.user_id, normalize_url(row.url))] = row.id
+    keep = set(latest.values())
+    duplicates = [row.id for row in rows if row.id not in keep]
+    for start in range(0, len(duplicates), 500):
+        bind.execute(online_articles.delete().where(online_articles.c.id.in_(duplicates[start:start + 500])))
+    if latest:
+        bind.execute(
+            online_articles.update().where(online_articles.c.id == sa.bindparam('row_id')).values(normalized_url=sa.bindparam('normalized')),
+            [{"row_id": row_id, "normalized": normalized} for (_, normalized), row_id in latest.items()]
+        )
+
+    with op.batch_alter_table('online_articles') as batch_op:
+        batch_op.alter_column('normalized_url', existing_type=sa.String(length=500), nullable=False)
+        batch_op.create_unique_constraint('uq_online_articles_user_normalized_url', ['user_id', 'normalized_url'])
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('online_articles') as batch_op:
+        batch_op.drop_constraint('uq_online_articles_user_normalized_url', type_='unique')
+        batch_op.drop_column('normalized_url')
@@ -0,0 +1,28 @@
+"""Version counter on prompts
+
+Revision ID: 0004_prompt_version
+Revises: 0003_online_articles_normalized_url
+Create Date: 2026-10-18 14:05:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004_prompt_version'
+down_revision: Union[str, None] = '0003_online_articles_normalized_url'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('prompts') as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('prompts') as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,29 @@
+"""Indexes for the per-user lookups and the processed articles pages
+
+Revision ID: 0005_listing_indexes
+Revises: 0004_prompt_version
+Create Date: 2026-10-18 15:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005_listing_indexes'
+down_revision: Union[str, None] = '0004_prompt_version'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_online_articles_user_id_created_at', 'online_articles', ['user_id', 'created_at', 'id'])
+    op.create_index('ix_prompts_user_id_type', 'prompts', ['user_id', 'type'])
+    op.create_index('ix_profiles_user_id', 'profiles', ['user_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_profiles_user_id', table_name='profiles')
+    op.drop_index('ix_prompts_user_id_type', table_name='prompts')
+    op.drop_index('ix_online_articles_user_id_created_at', table_name='online_articles')
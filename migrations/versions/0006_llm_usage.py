@@ -0,0 +1,43 @@
+"""LLM usage per user, day and call site, and a monthly budget per user
+
+Revision ID: 0006_llm_usage
+Revises: 0005_listing_indexes
+Create Date: 2026-10-18 17:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006_llm_usage'
+down_revision: Union[str, None] = '0005_listing_indexes'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'llm_usage',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('call_site', sa.String(length=50), nullable=False),
+        sa.Column('model', sa.String(length=100), nullable=False),
+        sa.Column('calls', sa.Integer(), nullable=False),
+        sa.Column('cached_calls', sa.Integer(), nullable=False),
+        sa.Column('prompt_tokens', sa.BigInteger(), nullable=False),
+        sa.Column('completion_tokens', sa.BigInteger(), nullable=False),
+        sa.Column('cost', sa.Float(), nullable=False),
+        sa.UniqueConstraint('user_id', 'day', 'call_site', 'model', name='uq_llm_usage_user_day_call_site_model')
+    )
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('monthly_budget', sa.Float(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('monthly_budget')
+    op.drop_table('llm_usage')
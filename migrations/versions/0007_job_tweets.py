@@ -0,0 +1,38 @@
+"""Streamed tweets of a job in their own table instead of the partial_result JSON of the job
+
+Revision ID: 0007_job_tweets
+Revises: 0006_llm_usage
+Create Date: 2026-10-18 21:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007_job_tweets'
+down_revision: Union[str, None] = '0006_llm_usage'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'job_tweets',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('job_id', sa.Integer(), sa.ForeignKey('jobs.id'), nullable=False),
+        sa.Column('position', sa.Integer(), nullable=False),
+        sa.Column('text', sa.Text(), nullable=False),
+        sa.UniqueConstraint('job_id', 'position', name='uq_job_tweets_job_id_position')
+    )
+    # Only running jobs have a partial result and a requeued job starts over, so it isn't carried over
+    with op.batch_alter_table('jobs') as batch_op:
+        batch_op.drop_column('partial_result')
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('jobs') as batch_op:
+        batch_op.add_column(sa.Column('partial_result', sa.Text(), nullable=True))
+    op.drop_table('job_tweets')
@@ -6,4 +6,6 @@ app = create_app()
 # This is for deployment - use environment variable PORT if available
 port = int(os.environ.get("PORT", 10000))
 if __name__ == "__main__":
+    # The development server reports when something blocks the event loop (see app/event_loop.py)
+    os.environ.setdefault('LOOP_BLOCK_MONITOR', 'true')
     app.run(host="0.0.0.0", port=port)
\ No newline at end of file
@@ -0,0 +1,33 @@
+import asyncio
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from app.database.database import Base, async_database_url
+from app.database import models
+
+# Every test that needs the database gets a SQLite file of its own, so nothing is written to the database of DATABASE_URL
+# and the tests can run any number of times.
+@pytest.fixture
+def db_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+@pytest.fixture
+def db_sessionmaker(db_engine):
+    return sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+
+@pytest.fixture
+def db(db_sessionmaker):
+    session = db_sessionmaker()
+    yield session
+    session.close()
+
+# The same database through the async driver, for the code that uses AsyncSessionLocal
+@pytest.fixture
+def async_db_sessionmaker(db_engine):
+    engine = create_async_engine(async_database_url(db_engine.url.render_as_string()))
+    yield async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+    asyncio.run(engine.dispose())
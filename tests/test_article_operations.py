@@ -0,0 +1,49 @@
+from app.database.models import User, OnlineArticles
+from app.api.article_operations import get_known_articles, upsert_articles
+
+def test_upsert_keeps_one_row_per_normalized_url(db):
+    user = User(email='upsert@example.com', is_active=True)
+    user.set_password('x')
+    db.add(user)
+    db.commit()
+
+    upsert_articles(db, [
+        {"user_id": user.id, "url": "https://blog.com/a?utm_source=rss", "title": "A", "profile_fit": False, "fit_source": "llm"},
+        {"user_id": user.id, "url": "https://blog.com/b", "title": "B", "profile_fit": False, "fit_source": "error"}
+    ])
+    db.commit()
+    upsert_articles(db, [{"user_id": user.id, "url": "https://blog.com/a/", "title": "A", "profile_fit": True, "fit_source": "llm"}])
+    db.commit()
+
+    articles = db.query(OnlineArticles).filter(OnlineArticles.user_id == user.id).all()
+    assert len(articles) == 2
+    known = get_known_articles(db, user.id, ["https://blog.com/a", "https://blog.com/b", "https://blog.com/c"])
+    # Failed comparisons are tried again, so they don't count as known
+    assert list(known.keys()) == ["https://blog.com/a"]
+    assert known["https://blog.com/a"].profile_fit is True
+
+def test_user_articles_keyset_pages(db):
+    from datetime import datetime, timedelta
+    from app.api.article_operations import get_user_articles
+    user = User(email='pages@example.com', is_active=True)
+    user.set_password('x')
+    db.add(user)
+    db.commit()
+    created = datetime(2026, 1, 1)
+    for index in range(5):
+        db.add(OnlineArticles(user_id=user.id, url=f"https://blog.com/{index}", title=str(index), source_blog='https://blog.com',
+                              profile_fit=index % 2 == 0, created_at=created + timedelta(minutes=index // 2)))
+    db.add(OnlineArticles(user_id=user.id, url="https://other.com/x", title='x', source_blog='https://other.com', profile_fit=True, created_at=created))
+    db.commit()
+
+    titles, cursor = [], None
+    while True:
+        page, cursor = get_user_articles(db, user.id, limit=2, cursor=cursor, source_blog='https://blog.com')
+        titles += [article.title for article in page]
+        if cursor is None:
+            break
+    # Newest first, rows created at the same time come in the order of their ids
+    assert titles == ['4', '3', '2', '1', '0']
+
+    page, cursor = get_user_articles(db, user.id, limit=10, profile_fit=True)
+    assert [article.title for article in page] == ['4', '2', 'x', '0'] and cursor is None
@@ -0,0 +1,68 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import request
+import app.asgi as asgi
+from app import create_app
+
+def make_app():
+    flask_app = create_app()
+    torn_down = []
+
+    @flask_app.route('/test/wait')
+    async def wait():
+        await asyncio.sleep(0.3)
+        # The request context is still there after the view waited on the loop
+        return {"name": request.args.get('name')}
+
+    @flask_app.route('/test/fail')
+    async def fail():
+        await asyncio.sleep(0)
+        raise RuntimeError("boom")
+
+    @flask_app.route('/test/sync')
+    def sync():
+        return "sync"
+
+    flask_app.teardown_request(lambda error: torn_down.append(error))
+    return flask_app, torn_down
+
+async def get(path: str, query: bytes = b"") -> dict:
+    scope = {"type": "http", "method": "GET", "path": path, "query_string": query, "http_version": "1.1", "headers": [], "server": ("test", 80)}
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await asgi.serve_flask(scope, receive, send)
+    return {
+        "status": messages[0]["status"],
+        "body": b"".join(message.get("body", b"") for message in messages[1:])
+    }
+
+def test_async_views_wait_on_the_loop_without_holding_a_thread(monkeypatch):
+    flask_app, torn_down = make_app()
+    monkeypatch.setattr(asgi, 'flask_app', flask_app)
+    monkeypatch.setattr(asgi, '_executor', ThreadPoolExecutor(max_workers=1))
+
+    async def run():
+        return await asyncio.gather(*[get('/test/wait', f"name={index}".encode()) for index in range(6)], get('/test/sync'))
+
+    started = time.perf_counter()
+    responses = asyncio.run(run())
+    # With one thread that waits in every view, the six requests would take 1.8s one after the other
+    assert time.perf_counter() - started < 1.0
+    assert [response["body"] for response in responses[:6]] == [b'{"name":"%d"}\n' % index for index in range(6)]
+    assert responses[6] == {"status": 200, "body": b"sync"}
+    assert len(torn_down) == 7
+
+def test_errors_of_async_views_are_handled_like_flask(monkeypatch):
+    flask_app, torn_down = make_app()
+    monkeypatch.setattr(asgi, 'flask_app', flask_app)
+
+    assert asyncio.run(get('/test/fail'))["status"] == 500
+    assert asyncio.run(get('/test/missing'))["status"] == 404
+    assert isinstance(torn_down[0], RuntimeError) and torn_down[1] is None
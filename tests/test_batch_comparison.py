@@ -0,0 +1,100 @@
+import asyncio
+import pytest
+from langchain_core.messages import AIMessage
+import app.content_processor as content_processor
+from app.content_processor import ProfileComparer
+
+def make_comparer(max_articles=10):
+    comparer = ProfileComparer.__new__(ProfileComparer)
+    comparer.batch_max_articles = max_articles
+    comparer.prompt = 'Judge {article} for {profile}. Answer Yes or No.'
+    comparer.decripted_api_key = 'key'
+    comparer.llm = None
+    comparer.batch_chain = None
+    comparer.batch_prompt_template = None
+    async def profile_interests(user_id):
+        return 'data engineering'
+    comparer._get_profile_interests = profile_interests
+
+    # The prompt is set above instead of coming from the prompt cache
+    async def setup_comparison_chain():
+        pass
+    comparer.setup_comparison_chain = setup_comparison_chain
+    return comparer
+
+def test_pack_batches_adapts_to_content_length():
+    comparer = make_comparer(max_articles=3)
+    short = [{"url": f"u{i}", "title": "t", "content": "x" * 40} for i in range(7)]
+    assert [len(batch) for batch in comparer._pack_batches(short, token_budget=1000)] == [3, 3, 1]
+    long = [{"url": f"u{i}", "title": "t", "content": "x" * 2400} for i in range(3)]
+    assert [len(batch) for batch in comparer._pack_batches(long, token_budget=1000)] == [1, 1, 1]
+
+def test_parse_verdicts():
+    verdicts = ProfileComparer._parse_verdicts('```json\n{"1": "Yes", "2": "no", "7": "Yes"}\n```', 3)
+    assert verdicts == {1: "Yes", 2: "No"}
+    with pytest.raises(ValueError):
+        ProfileComparer._parse_verdicts('Yes', 3)
+
+def test_compare_articles_batch_falls_back_to_single_calls(monkeypatch):
+    async def fake_extract(url, api_key, use_cache=True, stats=None):
+        return f"content of {url}"
+
+    answers = iter(['{"1": "Yes"}'])
+    monkeypatch.setattr(content_processor, 'extract_article_content', fake_extract)
+    async def fake_invoke(*args, **kwargs):
+        return AIMessage(content=next(answers))
+
+    monkeypatch.setattr(content_processor, 'scheduled_invoke', fake_invoke)
+    comparer = make_comparer()
+
+    async def fake_single(url, user_id, use_cache=True, traced=True):
+        return {"status": "success", "url": url, "user_id": user_id, "llm_response": "No"}
+    comparer.compare_article_to_profile = fake_single
+
+    stats = {}
+    results = asyncio.run(comparer.compare_articles_batch({"https://a.com/1": "One", "https://a.com/2": "Two"}, 1, stats=stats))
+    assert [result["url"] for result in results] == ["https://a.com/1", "https://a.com/2"]
+    assert [result["llm_response"] for result in results] == ["Yes", "No"]
+    assert stats["batches"] == 1 and stats["single_calls"] == 1 and stats["llm_calls"] == 2
+
+def test_failed_batch_is_split_without_shrinking_the_comparer(monkeypatch):
+    async def fake_extract(url, api_key, use_cache=True, stats=None):
+        return f"content of {url}"
+
+    async def fake_invoke(chain, llm, template, inputs, use_cache=None, call_site=None):
+        # The model gets confused by four articles, two at a time it answers
+        if inputs["articles"].count("Article ") > 2:
+            return AIMessage(content='I am not sure')
+        return AIMessage(content='{"1": "Yes", "2": "No"}')
+
+    monkeypatch.setattr(content_processor, 'extract_article_content', fake_extract)
+    monkeypatch.setattr(content_processor, 'scheduled_invoke', fake_invoke)
+    comparer = make_comparer(max_articles=4)
+    stats = {}
+    results = asyncio.run(comparer.compare_articles_batch({f"https://a.com/{i}": f"T{i}" for i in range(4)}, 1, stats=stats))
+    assert [result["llm_response"] for result in results] == ["Yes", "No", "Yes", "No"]
+    assert stats["failed_batches"] == 1 and stats["split_batches"] == 1 and stats["smallest_batch"] == 2
+    assert stats["single_calls"] == 0 and stats["llm_calls"] == 3
+    # The next scan starts with the full batch size again
+    assert comparer.batch_max_articles == 4
+
+def test_screen_titles_defaults_to_maybe(monkeypatch):
+    prompts = []
+
+    async def fake_invoke(chain, llm, template, inputs, use_cache=None, call_site=None):
+        prompts.append(inputs["articles"])
+        return AIMessage(content='{"1": "no", "2": "Yes"}')
+
+    monkeypatch.setattr(content_processor, 'scheduled_invoke', fake_invoke)
+    comparer = make_comparer()
+    comparer.title_chain = None
+    comparer.title_prompt_template = None
+    stats = {}
+    verdicts = asyncio.run(comparer.screen_titles({
+        "https://a.com/1": {"title": "Pasta recipes", "description": ""},
+        "https://a.com/2": {"title": "Data pipelines", "description": "How we run Airflow"},
+        "https://a.com/3": {"title": "Release notes", "description": None}
+    }, 1, stats=stats))
+    assert verdicts == {"https://a.com/1": "no", "https://a.com/2": "yes", "https://a.com/3": "maybe"}
+    assert "How we run Airflow" in prompts[0]
+    assert stats["llm_calls"] == 1
@@ -0,0 +1,30 @@
+import asyncio
+import json
+import threading
+from types import SimpleNamespace
+from app.browser_pool import CrawlerPool
+from app.event_loop import get_background_loop
+
+def test_extraction_runs_off_the_shared_loop(monkeypatch):
+    pool = CrawlerPool()
+    fetched = []
+
+    async def fake_arun(**kwargs):
+        fetched.append(kwargs)
+        return SimpleNamespace(success=True, url=kwargs["url"], markdown="First part\n\nSecond part", extracted_content=None)
+    monkeypatch.setattr(pool, '_arun', fake_arun)
+
+    loop_thread = []
+    get_background_loop().call_soon_threadsafe(lambda: loop_thread.append(threading.get_ident()))
+
+    class FakeStrategy:
+        def run(self, url, sections):
+            self.thread = threading.get_ident()
+            return [{"index": 0, "content": sections}]
+
+    strategy = FakeStrategy()
+    result = asyncio.run(pool.arun(url="https://a.com", extraction_strategy=strategy, bypass_cache=True))
+    # The browser never sees the strategy, the extraction ran in a thread of its own
+    assert "extraction_strategy" not in fetched[0]
+    assert strategy.thread != loop_thread[0]
+    assert json.loads(result.extracted_content)[0]["content"] == ["First part", "Second part"]
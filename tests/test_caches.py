@@ -0,0 +1,50 @@
+from app.url_utils import normalize_url
+from app.sqlite_cache import SQLiteLRUCache
+
+def test_normalize_url():
+    assert normalize_url('HTTPS://Example.com:443/blog/?utm_source=x&b=2&a=1#top') == 'https://example.com/blog?a=1&b=2'
+    assert normalize_url('https://example.com') == 'https://example.com/'
+    assert normalize_url('http://example.com:8080/post/') == 'http://example.com:8080/post'
+
+def test_lru_eviction(tmp_path):
+    cache = SQLiteLRUCache(str(tmp_path / 'cache.db'), table='pages', max_entries=2)
+    cache.set('a', {"html": "a"})
+    cache.set('b', {"html": "b"})
+    # Reading "a" makes "b" the least recently used entry
+    assert cache.get('a') == {"html": "a"}
+    cache.set('c', {"html": "c"})
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.stats()["entries"] == 2
+
+def test_llm_cache_counters(tmp_path):
+    from app.llm_cache import LLMCache
+    cache = LLMCache(path=str(tmp_path / 'llm.db'), max_entries=10)
+    key = cache.make_key('gpt-4o-mini', 0, 'prompt')
+    assert key != cache.make_key('gpt-4o-mini', 0.7, 'prompt')
+    assert cache.get(key) is None
+    cache.set(key, {"content": "Yes"})
+    assert cache.get(key) == {"content": "Yes"}
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+def test_processor_cache(monkeypatch):
+    from types import SimpleNamespace
+    from app.processor_cache import ProcessorCache
+    cache = ProcessorCache(max_users=2, idle_timeout=900)
+    monkeypatch.setattr(cache, '_build', lambda kind, user: object())
+    user = SimpleNamespace(id=1, openai_api_key=b'key-1')
+    processor = cache.get('content_processor', user)
+    assert cache.get('content_processor', user) is processor
+    assert cache.get('profile_comparer', user) is not processor
+    # A new API key builds new objects, so does invalidate()
+    user.openai_api_key = b'key-2'
+    assert cache.get('content_processor', user) is not processor
+    processor = cache.get('content_processor', user)
+    cache.invalidate(1)
+    assert cache.get('content_processor', user) is not processor
+    # Only the two most recent users are kept
+    for user_id in (2, 3):
+        cache.get('content_processor', SimpleNamespace(id=user_id, openai_api_key=b'k'))
+    assert cache.stats()["users"] == 2
+    cache.idle_timeout = 0
+    assert cache.get('content_processor', SimpleNamespace(id=3, openai_api_key=b'k')) is not None
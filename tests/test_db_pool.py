@@ -0,0 +1,53 @@
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, text
+from app.metrics import render_metrics
+from app.database.pool import PoolStats, InstrumentedQueuePool, InstrumentedAsyncQueuePool, pool_options, async_pool_options
+from app.database.database import async_database_url
+
+def test_pool_options_from_environment(monkeypatch):
+    assert pool_options('sqlite:///instance/app.db') == {}
+    monkeypatch.setenv('DB_POOL_SIZE', '4')
+    monkeypatch.setenv('DB_POOL_PRE_PING', 'false')
+    options = pool_options('postgresql://user:pw@localhost/app')
+    assert options["poolclass"] is InstrumentedQueuePool
+    assert options["pool_size"] == 4 and options["pool_pre_ping"] is False
+
+def test_pool_stats_report_leaked_connections(tmp_path, monkeypatch):
+    monkeypatch.delenv('DB_POOL_TRACK_STACKS', raising=False)
+    assert not PoolStats().track_stacks
+    stats = PoolStats()
+    stats.leak_after = 0
+    stats.track_stacks = True
+    engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}")
+    from sqlalchemy import event
+    event.listen(engine, 'checkout', stats.on_checkout)
+    event.listen(engine, 'checkin', stats.on_checkin)
+
+    checked_out_before = REGISTRY.get_sample_value('db_pool_checked_out_connections')
+    connection = engine.connect()
+    connection.execute(text("SELECT 1"))
+    leaks = stats.leaks()
+    assert len(leaks) == 1 and 'test_db_pool.py' in leaks[0]["stack"]
+    # The same numbers are on /metrics
+    assert REGISTRY.get_sample_value('db_pool_checked_out_connections') == checked_out_before + 1
+    stats.update_leak_gauge()
+    assert REGISTRY.get_sample_value('db_pool_leaked_connections') == 1
+    assert 'db_pool_wait_seconds_bucket' in render_metrics()[0].decode()
+    connection.close()
+    assert REGISTRY.get_sample_value('db_pool_checked_out_connections') == checked_out_before
+    assert stats.stats()["checked_out"] == 0 and stats.stats()["checkouts"] == 1
+
+    stats.record_wait(0.003)
+    stats.record_wait(7, timed_out=True)
+    histogram = stats.stats()["wait_histogram"]
+    assert histogram["0.005"] == 1 and histogram["+Inf"] == 1 and stats.timeouts == 1
+    assert REGISTRY.get_sample_value('db_pool_timeouts_total') >= 1
+
+def test_async_engine_uses_the_async_drivers(monkeypatch):
+    assert async_database_url('sqlite:////srv/instance/prompts.db') == 'sqlite+aiosqlite:////srv/instance/prompts.db'
+    assert async_database_url('postgresql://user:pw@db:5432/app?sslmode=require') == 'postgresql+asyncpg://user:pw@db:5432/app?ssl=require'
+    assert async_database_url('postgresql+psycopg2://user:pw@db/app') == 'postgresql+asyncpg://user:pw@db/app'
+    monkeypatch.setenv('DB_ASYNC_POOL_SIZE', '3')
+    options = async_pool_options('postgresql://user:pw@localhost/app')
+    assert options["poolclass"] is InstrumentedAsyncQueuePool and options["pool_size"] == 3
+    assert async_pool_options('sqlite:///instance/app.db') == {}
@@ -0,0 +1,27 @@
+import asyncio
+import threading
+import time
+from app.event_loop import LoopBlockMonitor
+
+def _parse_everything_synchronously():
+    time.sleep(0.3)
+
+def test_monitor_reports_what_blocks_the_loop(capsys):
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    monitor = LoopBlockMonitor(loop, thread.ident, threshold=0.1, interval=0.02)
+    monitor.start()
+    try:
+        # Awaiting doesn't block the loop
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0.3), loop).result()
+        assert monitor.blocks == 0
+        loop.call_soon_threadsafe(_parse_everything_synchronously)
+        time.sleep(0.5)
+    finally:
+        monitor.stop()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=5)
+        loop.close()
+    assert monitor.blocks == 1 and monitor.longest >= 0.2
+    assert '_parse_everything_synchronously' in capsys.readouterr().out
@@ -0,0 +1,61 @@
+import asyncio
+import app.job_events as job_events
+from app.job_events import JobEventStream, parse_event_position
+
+def test_parse_event_position_prefers_the_last_event_id():
+    assert parse_event_position('3-2', 1, 1) == (3, 2)
+    assert parse_event_position('', 1, 4) == (1, 4)
+    assert parse_event_position('garbage') == (0, 0)
+
+def test_stream_only_sends_what_the_browser_has_not_seen(monkeypatch):
+    jobs = [
+        {"steps": [{"name": "extract_article"}], "tweets": [], "current_step": "run_chain", "status": "running", "error": None},
+        {"steps": [{"name": "extract_article"}, {"name": "run_chain"}], "tweets": ["First"], "current_step": None, "status": "success", "error": None}
+    ]
+    monkeypatch.setattr(job_events, 'get_job_progress', lambda job_id, user_id, sent_tweets: jobs.pop(0))
+    stream = JobEventStream(1, 1, sent_steps=1)
+    stream.interval = 0
+
+    async def collect():
+        return [event async for event in stream]
+
+    events = asyncio.run(collect())
+    assert [event.split('event: ')[1].split('\n')[0] for event in events] == ['current', 'step', 'tweet', 'current', 'done']
+    assert events[1].startswith('id: 2-0') and events[2].startswith('id: 2-1')
+    assert stream.finished
+
+def test_stream_backs_off_while_nothing_changes(monkeypatch):
+    job = {"steps": [], "tweets": [], "current_step": "run_chain", "status": "running", "error": None}
+    monkeypatch.setattr(job_events, 'get_job_progress', lambda job_id, user_id, sent_tweets: dict(job))
+    monkeypatch.setenv('JOB_EVENTS_INTERVAL', '0.5')
+    monkeypatch.setenv('JOB_EVENTS_MAX_INTERVAL', '3')
+    stream = JobEventStream(1, 1)
+
+    stream.poll()
+    assert stream.delay == 0.5
+    delays = []
+    for _ in range(4):
+        stream.poll()
+        delays.append(stream.delay)
+    assert delays == [1.0, 2.0, 3.0, 3.0]
+    job["tweets"] = ["First"]
+    stream.poll()
+    assert stream.delay == 0.5
+
+def test_job_tweets_are_appended_and_read_from_the_offset(db, db_sessionmaker, monkeypatch):
+    import app.api.job_operations as job_operations
+    from app.database.models import User
+    monkeypatch.setattr(job_operations, 'SessionLocal', db_sessionmaker)
+    user = User(email='tweets@example.com', is_active=True)
+    user.set_password('x')
+    db.add(user)
+    db.commit()
+    job_id = job_operations.create_job(user.id, 'process_url', 'https://blog.com/a')
+
+    for tweet in ('First', 'Second', 'Third'):
+        job_operations.record_job_tweet(job_id, tweet)
+
+    assert job_operations.get_job(job_id, user.id)["partial_result"] == ['First', 'Second', 'Third']
+    progress = job_operations.get_job_progress(job_id, user.id, sent_tweets=2)
+    assert progress["tweets"] == ['Third'] and progress["status"] == 'queued'
+    assert job_operations.get_job_progress(job_id, user.id + 1) is None
@@ -0,0 +1,36 @@
+from app.link_extractor import extract_article_links, extract_content_links, resolve_link
+
+INDEX_PAGE = """
+<html><body>
+  <header><nav><a href="/blog">Blog</a><a href="/about">About us and the team</a></nav></header>
+  <main>
+    <div class="card"><a href="/blog/first-post"><img src="x.png"></a>
+      <a href="/blog/first-post"><h3>The first post about analytics</h3></a></div>
+    <div class="card"><a href="https://www.example.com/blog/second-post#comments">The second post title here</a></div>
+    <div class="card"><a href="/tag/ai">Everything tagged with AI</a></div>
+    <div class="card"><a href="/author/jane">Posts written by Jane Doe</a></div>
+    <div class="card"><a href="https://other.com/blog/elsewhere">A post on another site</a></div>
+  </main>
+  <footer><a href="/privacy">Our privacy policy page</a></footer>
+</body></html>
+"""
+
+def test_resolve_link():
+    assert resolve_link('../post', 'https://example.com/blog/index/') == 'https://example.com/blog/post'
+    assert resolve_link('#top', 'https://example.com/') is None
+    assert resolve_link('mailto:me@example.com', 'https://example.com/') is None
+    assert resolve_link('/category/news', 'https://example.com/') is None
+
+def test_extract_article_links():
+    links = extract_article_links(INDEX_PAGE, 'https://www.example.com/blog')
+    assert links == {
+        'https://www.example.com/blog/first-post': 'The first post about analytics',
+        'https://www.example.com/blog/second-post': 'The second post title here',
+    }
+
+def test_extract_content_links_limit():
+    paragraphs = "".join(f'<p>Read <a href="https://site{i}.com/news/story">story {i}</a> for more.</p>' for i in range(8))
+    html = f"<html><body><article>{paragraphs}</article></body></html>"
+    assert extract_content_links(html, 'https://example.com/post', limit=5) == [
+        f'https://site{i}.com/news/story' for i in range(5)
+    ]
@@ -0,0 +1,124 @@
+import asyncio
+import time
+import app.llm_scheduler as llm_scheduler
+from app.llm_scheduler import LLMScheduler, TokenBucket, RateLimitedError, scheduled_invoke
+
+class FakeResponse:
+    def __init__(self, headers):
+        self.headers = headers
+        self.status_code = 429
+
+class FakeRateLimitError(Exception):
+    def __init__(self, retry_after):
+        super().__init__("429 Too Many Requests")
+        self.response = FakeResponse({'retry-after': str(retry_after)})
+
+def test_token_bucket_paces_reservations():
+    bucket = TokenBucket(per_minute=60)
+    assert bucket.reserve(60) == 0
+    # The bucket is empty now, the next token comes in one second at 60/minute
+    assert 0.9 < bucket.reserve(1) <= 1.0
+
+def test_retries_rate_limits_honouring_retry_after():
+    scheduler = LLMScheduler(rpm=6000, tpm=10**7, max_concurrency=2, max_retries=3)
+    scheduler.base_delay = 0.01
+    attempts = []
+
+    async def call():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise FakeRateLimitError(retry_after=0.2)
+        return "ok"
+
+    assert asyncio.run(scheduler.run('key', call)) == "ok"
+    assert attempts[1] - attempts[0] >= 0.2
+    stats = scheduler.stats()[scheduler.key_id('key')]
+    assert stats["rate_limited"] == 1 and stats["retries"] == 1 and stats["in_flight"] == 0
+
+def test_does_not_retry_other_errors_or_when_told_not_to():
+    scheduler = LLMScheduler(rpm=6000, tpm=10**7, max_concurrency=2, max_retries=3)
+    calls = []
+
+    async def bad_request():
+        calls.append(1)
+        raise ValueError("bad request")
+
+    async def rate_limited():
+        calls.append(1)
+        raise RateLimitedError("slow down")
+
+    for call, can_retry in ((bad_request, None), (rate_limited, lambda: False)):
+        calls.clear()
+        try:
+            asyncio.run(scheduler.run('key', call, can_retry=can_retry))
+        except Exception:
+            pass
+        assert len(calls) == 1
+
+def test_concurrency_is_bounded():
+    scheduler = LLMScheduler(rpm=6000, tpm=10**7, max_concurrency=2)
+    running = []
+    peak = []
+
+    async def call():
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(0.05)
+        running.pop()
+
+    async def main():
+        await asyncio.gather(*[scheduler.run('key', call) for _ in range(6)])
+
+    asyncio.run(main())
+    assert max(peak) == 2
+
+def test_scheduled_invoke_calls_run_side_by_side_on_the_loop(monkeypatch):
+    monkeypatch.setattr(llm_scheduler, '_scheduler', LLMScheduler(rpm=6000, tpm=10**7, max_concurrency=8))
+
+    class FakeTemplate:
+        def format(self, **inputs):
+            return inputs["article"]
+
+    class FakeLLM:
+        model_name = 'gpt-4o-mini'
+        temperature = 0.7
+        max_tokens = 10
+        openai_api_key = 'key'
+
+    class FakeChain:
+        def invoke(self, inputs):
+            raise AssertionError("the async path must not call invoke")
+
+        async def ainvoke(self, inputs):
+            await asyncio.sleep(0.2)
+            return inputs["article"]
+
+    async def main():
+        return await asyncio.gather(*[
+            scheduled_invoke(FakeChain(), FakeLLM(), FakeTemplate(), {"article": str(i)}, use_cache=False, call_site='comparison')
+            for i in range(8)
+        ])
+
+    started = time.monotonic()
+    assert asyncio.run(main()) == [str(i) for i in range(8)]
+    # Eight calls of 0.2s that overlap, not one after another
+    assert time.monotonic() - started < 0.8
+
+def test_limits_are_split_between_the_workers():
+    scheduler = LLMScheduler(rpm=1000, tpm=100000, max_concurrency=8, workers=2)
+    assert scheduler.rpm == 1000 * 0.9 / 2 and scheduler.tpm == 100000 * 0.9 / 2
+    assert scheduler.max_concurrency == 4
+
+def test_a_freed_slot_wakes_the_next_call_straight_away():
+    scheduler = LLMScheduler(rpm=60000, tpm=10**8, max_concurrency=1, workers=1)
+
+    async def call():
+        await asyncio.sleep(0.005)
+
+    async def main():
+        await asyncio.gather(*[scheduler.run('key', call) for _ in range(40)])
+
+    started = time.monotonic()
+    asyncio.run(main())
+    # One call after the other, without waiting for a poll between them
+    assert time.monotonic() - started < 1.0
@@ -0,0 +1,61 @@
+import asyncio
+from prometheus_client import REGISTRY
+import app.api.job_operations as job_operations
+from app.llm_scheduler import LLMScheduler
+from app.metrics import observe_trace, render_metrics
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+def test_observe_trace_records_steps_errors_and_fanout():
+    steps_before = sample('pipeline_step_seconds_count', pipeline='url', step='run_chain', outcome='success')
+    errors_before = sample('pipeline_errors_total', component='blog', error_type='ValueError')
+    observe_trace({"kind": "url", "status": "success", "steps": [
+        {"name": "extract_article", "duration": 0.5, "success": True},
+        {"name": "run_chain", "duration": 2.0, "success": True}
+    ]})
+    observe_trace({"kind": "blog", "status": "error", "error_type": "ValueError", "steps": [],
+                   "screening": {"articles": 40, "title": {"input": 40}, "content": {"input": 7}}})
+
+    assert sample('pipeline_step_seconds_count', pipeline='url', step='run_chain', outcome='success') == steps_before + 1
+    assert sample('pipeline_errors_total', component='blog', error_type='ValueError') == errors_before + 1
+    assert sample('comparison_fanout_articles_bucket', stage='content', le='10.0') >= 1
+
+def test_scheduler_reports_latency_per_call_site():
+    before = sample('llm_call_seconds_count', call_site='test_site', outcome='success')
+
+    async def call():
+        return "ok"
+
+    scheduler = LLMScheduler(rpm=6000, tpm=10**7, max_concurrency=2)
+    assert asyncio.run(scheduler.run('key', call, call_site='test_site')) == "ok"
+    assert sample('llm_call_seconds_count', call_site='test_site', outcome='success') == before + 1
+
+def test_metrics_include_the_job_queue(monkeypatch):
+    monkeypatch.setattr(job_operations, 'count_jobs_by_status', lambda statuses: ({"queued": 4, "running": 1}, 12.5))
+    body, content_type = render_metrics()
+    text = body.decode()
+    assert content_type.startswith('text/plain')
+    assert 'job_queue_depth{status="queued"} 4.0' in text
+    assert 'job_queue_oldest_seconds 12.5' in text
+    assert 'pipeline_step_seconds_bucket' in text
+
+def test_archive_dead_worker_keeps_the_totals_in_one_file(tmp_path, monkeypatch):
+    from prometheus_client import CollectorRegistry, multiprocess
+    from prometheus_client.mmap_dict import MmapedDict, mmap_key
+    from app.metrics import archive_dead_worker
+    monkeypatch.setenv('PROMETHEUS_MULTIPROC_DIR', str(tmp_path))
+    key = mmap_key('jobs_total', 'jobs_total', ['status'], ['done'], 'help')
+    for pid, value in ((101, 2.0), (102, 3.0)):
+        worker_file = MmapedDict(str(tmp_path / f'counter_{pid}.db'))
+        worker_file.write_value(key, value, 0.0)
+        worker_file.close()
+    (tmp_path / 'gauge_livesum_101.db').write_bytes(b'')
+
+    archive_dead_worker(101)
+    archive_dead_worker(102)
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['counter_archive.db']
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, str(tmp_path))
+    assert registry.get_sample_value('jobs_total', {'status': 'done'}) == 5.0
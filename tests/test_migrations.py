@@ -0,0 +1,33 @@
+from pathlib import Path
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, inspect, text
+
+ROOT = Path(__file__).resolve().parent.parent
+
+def alembic_config():
+    config = Config(str(ROOT / 'alembic.ini'))
+    config.set_main_option('script_location', str(ROOT / 'migrations'))
+    return config
+
+def test_normalized_url_migration_dedupes_articles(tmp_path, monkeypatch):
+    database_url = f"sqlite:///{tmp_path / 'migrations.db'}"
+    monkeypatch.setenv('DATABASE_URL', database_url)
+    config = alembic_config()
+    command.upgrade(config, '0002_jobs_and_relevance')
+
+    engine = create_engine(database_url)
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO users (id, email, password_hash) VALUES (1, 'a@b.com', 'x')"))
+        for url, fit in [("https://Blog.com/post/?utm_source=x", 0), ("https://blog.com/post", 1), ("https://blog.com/other", 0)]:
+            connection.execute(text("INSERT INTO online_articles (user_id, url, profile_fit) VALUES (1, :url, :fit)"), {"url": url, "fit": fit})
+
+    command.upgrade(config, 'head')
+    with engine.connect() as connection:
+        rows = connection.execute(text("SELECT normalized_url, profile_fit FROM online_articles ORDER BY id")).all()
+    assert [tuple(row) for row in rows] == [("https://blog.com/post", 1), ("https://blog.com/other", 0)]
+    constraints = inspect(engine).get_unique_constraints('online_articles')
+    assert any(constraint['column_names'] == ['user_id', 'normalized_url'] for constraint in constraints)
+
+    command.downgrade(config, '0001_baseline')
+    assert 'jobs' not in inspect(engine).get_table_names()
@@ -0,0 +1,39 @@
+import asyncio
+import app.api.prompt_operations as prompt_operations
+from app.database.models import User, Prompt
+from app.api.prompt_operations import PromptCache, bump_prompt_version
+
+def test_prompt_cache_notices_edits_of_other_workers(db, db_sessionmaker, async_db_sessionmaker, monkeypatch):
+    monkeypatch.setattr(prompt_operations, 'SessionLocal', db_sessionmaker)
+    monkeypatch.setattr(prompt_operations, 'AsyncSessionLocal', async_db_sessionmaker)
+    user = User(email='prompts@example.com', is_active=True)
+    user.set_password('x')
+    db.add(user)
+    db.commit()
+    prompt = Prompt(type=2, name='Comparison', user_id=user.id, template='Old {profile} {article}')
+    db.add(prompt)
+    db.commit()
+
+    # Two workers, both read the prompt once
+    this_worker = PromptCache(check_interval=0)
+    other_worker = PromptCache(check_interval=3600)
+    assert this_worker.get(2, user.id)["template"] == 'Old {profile} {article}'
+    assert other_worker.get(2, user.id)["template"] == 'Old {profile} {article}'
+
+    prompt.template = 'New {profile} {article}'
+    bump_prompt_version(prompt)
+    db.commit()
+    other_worker.store(prompt)
+
+    assert other_worker.get(2, user.id)["template"] == 'New {profile} {article}'
+    assert this_worker.get(2, user.id)["template"] == 'New {profile} {article}'
+    assert this_worker.get(2, user.id)["version"] == 2
+    assert this_worker.stats()["misses"] == 2
+    assert this_worker.get(1, user.id) is None
+
+    # The pipeline reads the prompts through the async engine, with the same cache
+    async_worker = PromptCache(check_interval=0)
+    assert asyncio.run(async_worker.aget(2, user.id))["template"] == 'New {profile} {article}'
+    assert asyncio.run(async_worker.aget(2, user.id))["version"] == 2
+    assert async_worker.stats()["misses"] == 1 and async_worker.stats()["hits"] == 1
+    assert asyncio.run(async_worker.aget(1, user.id)) is None
@@ -0,0 +1,36 @@
+from app.readability import extract_main_content, extract_meta_description
+
+PARAGRAPH = "This is a sentence about data analytics and the way teams use it every single day at work. " * 4
+
+ARTICLE_PAGE = f"""
+<html><head><title>Site | A post</title><meta property="og:title" content="A post about analytics"></head>
+<body>
+  <nav><a href="/">Home</a><a href="/blog">Blog</a></nav>
+  <div class="sidebar"><a href="/tag/ai">AI</a><a href="/tag/bi">BI</a></div>
+  <article>
+    <h2>Why it matters</h2>
+    <p>{PARAGRAPH}</p><p>{PARAGRAPH}</p><p>{PARAGRAPH}</p>
+    <ul><li>First point</li><li>Second point</li></ul>
+    <p>{PARAGRAPH}</p><p>{PARAGRAPH}</p>
+  </article>
+  <footer>Copyright and <a href="/privacy">privacy</a></footer>
+</body></html>
+"""
+
+def test_extracts_article_with_headings():
+    result = extract_main_content(ARTICLE_PAGE)
+    markdown = result["markdown"]
+    assert markdown.startswith("# A post about analytics")
+    assert "## Why it matters" in markdown
+    assert "- First point" in markdown
+    assert "privacy" not in markdown and "Home" not in markdown
+    assert result["score"] >= 0.7
+
+def test_thin_page_scores_low():
+    result = extract_main_content("<html><body><div><a href='/a'>A link</a> and a few words</div></body></html>")
+    assert result["score"] < 0.7
+
+def test_meta_description():
+    html = "<html><head><meta property='og:description' content=' Fast   pipelines '></head><body><p>Text</p></body></html>"
+    assert extract_meta_description(html) == "Fast pipelines"
+    assert extract_meta_description("<html><body></body></html>") == ""
@@ -0,0 +1,26 @@
+import numpy as np
+from app.relevance import HashingEmbedder, RelevancePrefilter
+
+PROFILE = "I write about data engineering, machine learning models, data pipelines and analytics platforms."
+
+class FixedProfilePrefilter(RelevancePrefilter):
+    def profile_vector(self):
+        return self.embedder.embed([PROFILE])[0]
+
+def test_hashing_embedder_is_normalized_and_deterministic():
+    embedder = HashingEmbedder(dimensions=1024)
+    vectors = embedder.embed(["Data pipelines at scale", "Data pipelines at scale", ""])
+    assert np.allclose(vectors[0], vectors[1])
+    assert np.isclose(np.linalg.norm(vectors[0]), 1.0)
+    assert not vectors[2].any()
+
+def test_prefilter_ranks_related_articles_higher():
+    prefilter = FixedProfilePrefilter(1, embedder=HashingEmbedder())
+    scores = prefilter.score([
+        "Building data pipelines for machine learning models",
+        "Ten easy pasta recipes for the summer"
+    ])
+    assert scores[0] > scores[1]
+    assert prefilter.verdict(float(scores[1])) == "reject"
+    assert prefilter.verdict(prefilter.accept_above) == "accept"
+    assert prefilter.verdict((prefilter.accept_above + prefilter.reject_below) / 2) == "uncertain"
@@ -0,0 +1,25 @@
+import asyncio
+from langchain_core.messages import AIMessageChunk
+from app.content_processor import ContentProcessor
+
+class FakeChain:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def astream(self, inputs):
+        for chunk in self.chunks:
+            yield AIMessageChunk(content=chunk)
+
+def test_stream_chain_emits_tweets_at_blank_lines():
+    chunks = ["First tw", "eet\n", "\nSecond tweet\n\n", "\n\nThird", " tweet"]
+    processor = ContentProcessor.__new__(ContentProcessor)
+    processor.post_chain = FakeChain(chunks)
+    tweets = []
+
+    async def on_tweet(tweet):
+        tweets.append(tweet)
+
+    content = asyncio.run(processor._stream_chain({}, on_tweet))
+    assert content == "".join(chunks)
+    assert tweets == ["First tweet", "Second tweet", "Third tweet"]
+    assert tweets == ContentProcessor._parse_tweets(content)
@@ -0,0 +1,84 @@
+import json
+import time
+from app.trace_store import TraceStore
+
+def make_trace(url, article, status="success"):
+    return {
+        "kind": "url",
+        "url": url,
+        "start_time": "2026-10-18T10:00:00",
+        "status": status,
+        "steps": [{"name": "extract_article", "duration": 1.5, "success": True}],
+        "content": {"article_preview": article, "tweets": ["short tweet"]}
+    }
+
+def test_blobs_are_stored_once(tmp_path):
+    store = TraceStore(path=str(tmp_path / 'traces.db'), blob_min_size=100)
+    article = "An article that is long enough to become a blob. " * 20
+    first = store.write(make_trace("https://a.com/1", article))
+    store.write(make_trace("https://a.com/2", article))
+    stats = store.stats()
+    assert stats["traces"] == 2 and stats["blobs"] == 1
+    assert store.load(first) == {**make_trace("https://a.com/1", article), "trace_id": first}
+    assert store.load("missing") is None
+
+def test_background_writer_and_retention(tmp_path):
+    store = TraceStore(path=str(tmp_path / 'traces.db'), blob_min_size=100, retention_days=1)
+    trace_id = store.save(make_trace("https://a.com/1", "x" * 500))
+    assert store.flush()
+    assert [trace["trace_id"] for trace in store.list_traces()] == [trace_id]
+
+    store.write(make_trace("https://a.com/old", "y" * 500), created_at=time.time() - 3 * 86400)
+    store.apply_retention()
+    assert [trace["url"] for trace in store.list_traces()] == ["https://a.com/1"]
+    # The blob of the removed trace went with it
+    assert store.stats()["blobs"] == 1
+
+def test_import_legacy_traces(tmp_path):
+    legacy = tmp_path / 'traces'
+    legacy.mkdir()
+    with open(legacy / 'trace_20241220_133042.json', 'w') as f:
+        json.dump(make_trace("https://a.com/legacy", "z" * 2000), f)
+    store = TraceStore(path=str(tmp_path / 'traces.db'))
+    assert store.import_legacy(str(legacy)) == 1
+    assert store.import_legacy(str(legacy)) == 0
+    assert store.load('legacy-trace_20241220_133042')["url"] == "https://a.com/legacy"
+
+def test_summaries_and_aggregates(tmp_path):
+    store = TraceStore(path=str(tmp_path / 'traces.db'))
+    now = time.time()
+    for index in range(10):
+        trace = make_trace(f"https://www.slow.com/{index % 2}", "text", status="error" if index == 0 else "success")
+        trace["steps"] = [{"name": "extract_article", "duration": index + 1, "success": index != 0}, {"name": "run_chain", "duration": 0.5, "success": True}]
+        store.write(trace, created_at=now - index)
+    store.write(make_trace("https://fast.com/a", "text"), created_at=now)
+
+    summaries = store.list_traces(since=now - 3600)
+    assert len(summaries) == 11 and summaries[0]["domain"] in ("slow.com", "fast.com")
+    percentiles = {row["step"]: row for row in store.step_percentiles(now - 3600)}
+    assert percentiles["extract_article"]["count"] == 11
+    # The percentiles come from histograms with 5% wide buckets
+    assert abs(percentiles["extract_article"]["p50"] - 5) < 0.25 and abs(percentiles["extract_article"]["p99"] - 10) < 0.5
+    assert percentiles["extract_article"]["failed"] == 1
+    assert store.slowest(now - 3600, by="domain")[0]["domain"] == "slow.com"
+    assert store.slowest(now - 3600, by="url", limit=1)[0]["url"] == "https://www.slow.com/1"
+    assert sum(row["errors"] for row in store.error_rates(now - 3600)) == 1
+    assert len(store.list_traces(status="error")) == 1
+
+def test_summaries_are_backfilled(tmp_path):
+    path = str(tmp_path / 'traces.db')
+    store = TraceStore(path=path)
+    trace_id = store.write(make_trace("https://a.com/1", "text"))
+    connection = store._connection()
+    connection.execute("DELETE FROM trace_summaries")
+    connection.execute("DELETE FROM trace_steps")
+    connection.execute("PRAGMA user_version = 0")
+    assert [trace["trace_id"] for trace in TraceStore(path=path).list_traces()] == [trace_id]
+
+def test_retention_takes_traces_out_of_the_rollups(tmp_path):
+    store = TraceStore(path=str(tmp_path / 'traces.db'), retention_days=1)
+    store.write(make_trace("https://a.com/old", "text", status="error"), created_at=time.time() - 3 * 86400)
+    store.write(make_trace("https://a.com/new", "text"))
+    store.apply_retention()
+    assert sum(row["errors"] for row in store.error_rates()) == 0
+    assert [row["count"] for row in store.step_percentiles()] == [1]
@@ -0,0 +1,37 @@
+import app.usage as usage
+from app.usage import UsageRecorder, token_cost, usage_user_id
+
+def test_token_cost_uses_the_longest_matching_model():
+    # gpt-4o-mini-2024-07-18 is priced as gpt-4o-mini, not gpt-4o
+    assert token_cost('gpt-4o-mini-2024-07-18', 1_000_000, 1_000_000) == 0.75
+    assert token_cost('openai/gpt-4o', 1_000_000, 0) == 2.50
+
+def test_recorder_rolls_calls_up_and_checks_the_budget(monkeypatch):
+    written = []
+    monkeypatch.setattr(usage, 'add_usage', lambda rows: written.extend(rows))
+    monkeypatch.setattr(usage, 'get_monthly_budget', lambda user_id: 0.5)
+    monkeypatch.setattr(usage, 'get_spend_since', lambda user_id, since: sum(row["cost"] for row in written if row["user_id"] == user_id))
+    recorder = UsageRecorder(flush_interval=3600, budget_check_interval=3600)
+
+    # Calls outside of the work of a user aren't recorded
+    recorder.record('comparison', 'gpt-4o-mini', 1000, 10)
+    token = usage_user_id.set(7)
+    try:
+        recorder.record('comparison', 'gpt-4o-mini', 1000, 10)
+        recorder.record('comparison', 'gpt-4o-mini', 2000, 20)
+        recorder.record('comparison', 'gpt-4o-mini', cached=True)
+        recorder.record('summary', 'openai/gpt-4o-mini', 500, 50)
+    finally:
+        usage_user_id.reset(token)
+    recorder.flush()
+
+    rows = {row["call_site"]: row for row in written}
+    assert set(rows) == {'comparison', 'summary'}
+    assert rows['comparison']["calls"] == 3 and rows['comparison']["cached_calls"] == 1
+    assert rows['comparison']["prompt_tokens"] == 3000 and rows['comparison']["completion_tokens"] == 30
+    assert rows['summary']["model"] == 'gpt-4o-mini'
+    assert not recorder.over_budget(7)
+
+    # Usage this worker hasn't written yet counts towards the budget too
+    recorder.record('generation', 'gpt-4o', 200_000, 0, user_id=7)
+    assert recorder.over_budget(7)
@@ -0,0 +1,26 @@
+from app.api.user_operations import UserCache, SessionUser
+
+def test_user_cache_ttl_and_invalidation():
+    cache = UserCache(ttl=30, max_users=2)
+    user = SessionUser(1, 'a@b.com', True)
+    cache.set(user)
+    assert cache.get(1) is user
+    cache.invalidate(1)
+    assert cache.get(1) is None
+
+    # Users that are still onboarding are always loaded again
+    cache.set(SessionUser(2, 'c@d.com', False))
+    assert cache.get(2) is None
+
+    for user_id in (3, 4, 5):
+        cache.set(SessionUser(user_id, f'{user_id}@b.com', True))
+    assert cache.get(3) is None and cache.get(5) is not None
+
+    cache.ttl = -1
+    cache.set(SessionUser(6, 'e@f.com', True))
+    assert cache.get(6) is None
+
+def test_deactivated_users_are_not_authenticated():
+    assert SessionUser(1, 'a@b.com', True).is_authenticated
+    user = SessionUser(2, 'c@d.com', True, active=False)
+    assert not user.is_active and not user.is_authenticated